@@ -4,7 +4,14 @@ from flask import Flask
 from flask.ext.bootstrap import Bootstrap
 from flask.ext.mail import Mail
 from flask.ext.moment import Moment
-from flask.ext.sqlalchemy import SQLAlchemy
+from .database import FlaskySQLAlchemy
+from .startup import timed
+from .sampler import StackSampler
+from .metrics import Metrics
+from .slowlog import SlowQueryLog
+from .compression import Compress
+from .assets import StaticAssets
+from .sessions import ServerSessions
 from flask.ext.login import LoginManager
 from flask.ext.pagedown import PageDown
 from config import config
@@ -13,8 +20,14 @@ from config import config
 bootstrap = Bootstrap()
 mail = Mail()
 moment = Moment()
-db = SQLAlchemy()
+db = FlaskySQLAlchemy()  # stock Flask-SQLAlchemy plus engine profiles, see database.py
 pagedown = PageDown()
+metrics = Metrics()  # request/db/template/cache metrics on /metrics for prometheus
+slowlog = SlowQueryLog()  # slow queries grouped by fingerprint, `manage.py slowlog`
+sampler = StackSampler()  # statistical profiler, off unless FLASKY_SAMPLER_RATE or `manage.py sampler start`
+compress = Compress()  # gzips html/json responses
+assets = StaticAssets()  # fingerprinted, precompressed static files from `manage.py assets`
+server_sessions = ServerSessions()  # sessions in the local store instead of the cookie, if FLASKY_SERVER_SESSIONS
 
 login_manager = LoginManager()
 login_manager.session_protection='strong'  # can be none, basic, strong. Strong keeps track of IP & browser.
@@ -24,30 +37,52 @@ login_manager.login_view = 'auth.login'  # sets endpoint for login page. Since t
 
 def create_app(config_name):
     app = Flask(__name__)
+    timings = app.extensions.setdefault('startup_timings', [])  # (step, secs), see startup.py
     app.config.from_object(config[config_name])  # gets configuration from config file's object by name
-    config[config_name].init_app(app)  # runs init_app
+    with timed(timings, 'config.init_app'):
+        config[config_name].init_app(app)  # runs init_app
 
     # extension objs not initially bound to an app
-    bootstrap.init_app(app)  # serve local static?
-    mail.init_app(app)
-    moment.init_app(app)
-    db.init_app(app)
-    login_manager.init_app(app)
-    pagedown.init_app(app)
+    with timed(timings, 'bootstrap'):
+        bootstrap.init_app(app)  # serve local static?
+    with timed(timings, 'mail'):
+        mail.init_app(app)
+    with timed(timings, 'moment'):
+        moment.init_app(app)
+    with timed(timings, 'db'):
+        db.init_app(app)
+    with timed(timings, 'login_manager'):
+        login_manager.init_app(app)
+    with timed(timings, 'pagedown'):
+        pagedown.init_app(app)
+    with timed(timings, 'metrics'):
+        metrics.init_app(app)
+    with timed(timings, 'slowlog'):
+        slowlog.init_app(app)
+    with timed(timings, 'sampler'):
+        sampler.init_app(app)
+    with timed(timings, 'compress'):
+        compress.init_app(app)
+    with timed(timings, 'assets'):
+        assets.init_app(app)
+    with timed(timings, 'server_sessions'):
+        server_sessions.init_app(app)
 
     # attach routes and custom error pages here
 
 
-    from .main import main as main_blueprint
-    app.register_blueprint(main_blueprint)
+    with timed(timings, 'blueprint main'):
+        from .main import main as main_blueprint
+        app.register_blueprint(main_blueprint)
 
-    from .auth import auth as auth_blueprint
-    app.register_blueprint(auth_blueprint, url_prefix='/auth')
+    with timed(timings, 'blueprint auth'):
+        from .auth import auth as auth_blueprint
+        app.register_blueprint(auth_blueprint, url_prefix='/auth')
     # url_prefix optional. When used, all routes defined in blueprint will register with given prefix.
     # in this case: /auth. For example. /login will be /auth/login. localhost:5000/auth/login
 
-    from .api_1_0 import api as api_1_0_blueprint
-    app.register_blueprint(api_1_0_blueprint, url_prefix='/api/v1.0')
+    with timed(timings, 'blueprint api'):
+        from .api_1_0 import api as api_1_0_blueprint
+        app.register_blueprint(api_1_0_blueprint, url_prefix='/api/v1.0')
 
     return app
-
@@ -10,4 +10,4 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import authentication, posts, users, comments, errors
+from . import admission, authentication, posts, users, comments, errors  # admission first, its hook runs before auth
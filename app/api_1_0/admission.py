@@ -0,0 +1,72 @@
+__author__ = 'Stuart'
+"""
+Keeps one aggressive API client from starving everyone else.
+
+1) Before anything else (even authentication, which hashes passwords and isn't cheap), a request has to get into
+the per-process concurrency gate. If FLASKY_API_MAX_INFLIGHT requests are already running, it gets a 503 with
+Retry-After right away instead of queueing.
+2) Still before authentication, it takes a token from its IP address' 'ip' bucket, or gets a 429. This is what
+limits password guessing: a request with bad credentials never gets as far as the per-user buckets.
+3) Once we know who the client is, check_rate_limit() (called from the auth before_request) takes a token from their
+bucket for this kind of endpoint, or answers 429 with Retry-After. Clients are keyed by user id, whether they logged
+in with a password or a token, and anonymous ones by IP address.
+
+This module must be imported before authentication in api_1_0/__init__.py so that the gate runs first.
+"""
+
+from flask import g, request, current_app
+from . import api
+from .errors import too_many_requests, service_unavailable
+from ..localstore import get_store
+from ..ratelimit import TokenBucketLimiter, ConcurrencyGate
+
+
+def endpoint_class():
+    """
+    Buckets requests into the classes FLASKY_API_RATE_LIMITS has limits for.
+    """
+    if request.endpoint == 'api.get_token':
+        return 'token'
+    if request.method in ('GET', 'HEAD', 'OPTIONS'):
+        return 'read'
+    return 'write'
+
+
+def _gate():
+    gate = current_app.extensions.get('api_gate')
+    if gate is None:
+        gate = current_app.extensions.setdefault(
+            'api_gate', ConcurrencyGate(current_app.config['FLASKY_API_MAX_INFLIGHT']))
+    return gate
+
+
+def _limiter():
+    return TokenBucketLimiter(get_store(current_app), current_app.config['FLASKY_API_RATE_LIMITS'])
+
+
+@api.before_request
+def admit():
+    if not _gate().try_enter():
+        return service_unavailable('Too many requests in progress, try again shortly', retry_after=1)
+    g.api_admitted = True
+    allowed, retry_after = _limiter().hit('ip:{}'.format(request.remote_addr), 'ip')
+    if not allowed:
+        return too_many_requests('Rate limit exceeded', retry_after)
+
+
+@api.teardown_request
+def release(exc):
+    if getattr(g, 'api_admitted', False):
+        g.api_admitted = False
+        _gate().leave()
+
+
+def check_rate_limit():
+    """
+    :return: a 429 response if the client is over its limit, else None
+    """
+    user = g.current_user
+    client = 'ip:{}'.format(request.remote_addr) if user.is_anonymous() else 'user:{}'.format(user.id)
+    allowed, retry_after = _limiter().hit(client, endpoint_class())
+    if not allowed:
+        return too_many_requests('Rate limit exceeded', retry_after)
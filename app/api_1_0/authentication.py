@@ -4,6 +4,7 @@ from flask.ext.httpauth import HTTPBasicAuth
 from ..models import User, AnonymousUser
 from . import api
 from .errors import unauthorized, forbidden
+from .admission import check_rate_limit
 
 auth = HTTPBasicAuth()  # auth obj created
 
@@ -50,6 +51,7 @@ def auth_error():
 def before_request():
     if not g.current_user.is_anonymous() and not g.current_user.confirmed:
         return forbidden('Unconfirmed account')
+    return check_rate_limit()  # None lets the request through
 
 @api.route('/token/')
 def get_token():
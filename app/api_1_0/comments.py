@@ -1,26 +1,31 @@
 __author__ = 'Stuart'
 from flask import jsonify, request, g, url_for, current_app
-from .. import db
+from .. import db, groupcommit
 from ..models import Post, Permission, Comment
+from ..archive import get_post_or_404, get_comment_or_404, comment_model
 from . import api
 from .decorators import permission_required
+from .expand import expand_arg, fields_arg, comments_json, COMMENT_EXPANSIONS
+from ..pagination import paginate, count_arg
 
 
 @api.route('/comments/')
 def get_comments():
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    expand, fields = expand_arg(COMMENT_EXPANSIONS), fields_arg(Comment)
+    pagination = paginate(Comment.query.order_by(Comment.timestamp.desc()), page,
+                          current_app.config['FLASKY_COMMENTS_PER_PAGE'], mode=count_arg())
     comments = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page-1, _external=True)
+        prev = url_for('api.get_comments', page=page-1, expand=request.args.get('expand'),
+                       fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     next_posts = None
     if pagination.has_next:
-        next_posts = url_for('api.get_comments', page=page+1, _external=True)
+        next_posts = url_for('api.get_comments', page=page+1, expand=request.args.get('expand'),
+                             fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     return jsonify({
-        'posts': [comment.to_json() for comment in comments],
+        'posts': comments_json(comments, expand, fields),
         'prev': prev,
         'next': next_posts,
         'count': pagination.total
@@ -29,26 +34,29 @@ def get_comments():
 
 @api.route('/comments/<int:id>')
 def get_comment(id):
-    comment = Comment.query.get_or_404(id)
-    return jsonify(comment.to_json())
+    expand, fields = expand_arg(COMMENT_EXPANSIONS), fields_arg(Comment)
+    comment = get_comment_or_404(id)
+    return jsonify(comments_json([comment], expand, fields)[0])
 
 
 @api.route('/posts/<int:id>/comments/')
 def get_post_comments(id):
-    post = Post.query.get_or_404(id)
+    post = get_post_or_404(id)
     page = request.args.get('page', 1, type=int)
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    expand, fields = expand_arg(COMMENT_EXPANSIONS), fields_arg(Comment)
+    pagination = paginate(post.comments.order_by(comment_model(post).timestamp.asc()), page,
+                          current_app.config['FLASKY_COMMENTS_PER_PAGE'], mode=count_arg())
     comments = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page-1, _external=True)
+        prev = url_for('api.get_post_comments', id=id, page=page-1, expand=request.args.get('expand'),
+                       fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     next_posts = None
     if pagination.has_next:
-        next_posts = url_for('api.get_comments', page=page+1, _external=True)
+        next_posts = url_for('api.get_post_comments', id=id, page=page+1, expand=request.args.get('expand'),
+                             fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     return jsonify({
-        'posts': [comment.to_json() for comment in comments],
+        'posts': comments_json(comments, expand, fields),
         'prev': prev,
         'next': next_posts,
         'count': pagination.total
@@ -58,12 +66,12 @@ def get_post_comments(id):
 @api.route('/posts/<int:id>/comments/', methods=['POST'])
 @permission_required(Permission.COMMENT)
 def new_post_comment(id):
+    fields = fields_arg(Comment)  # before anything is written
     post = Post.query.get_or_404(id)
     comment = Comment.from_json(request.json)
-    comment.author = g.current_user
-    comment.post = post
-    db.session.add(comment)
-    db.session.commit()
-    return jsonify(comment.to_json()), 201, \
+    comment.author_id = g.current_user.id
+    comment.post_id = post.id
+    groupcommit.insert(comment)
+    return jsonify(comment.to_json(fields)), 201, \
         {'Location': url_for('api.get_comment', id=comment.id,
                              _external=True)}
\ No newline at end of file
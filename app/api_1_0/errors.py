@@ -1,6 +1,7 @@
 __author__ = 'Stuart'
+import math
 from flask import jsonify
-from app.exceptions import ValidationError
+from app.exceptions import ValidationError, ServiceUnavailable
 from . import api
 
 
@@ -26,6 +27,24 @@ def forbidden(message):
     response.status_code = 403
     return response
 
+def too_many_requests(message, retry_after):
+    """
+    429 for clients over their rate limit. Retry-After tells well behaved clients how long to back off, in whole secs.
+    :param message:
+    :param retry_after: secs
+    :return:
+    """
+    response = jsonify({'error':'too many requests', 'message':message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+    return response
+
+def service_unavailable(message, retry_after):
+    response = jsonify({'error':'service unavailable', 'message':message})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+    return response
+
 @api.errorhandler(ValidationError)
 def validation_error(e):
     """
@@ -40,4 +59,8 @@ def validation_error(e):
     :param e:
     :return:
     """
-    return bad_request(e.args[0])
\ No newline at end of file
+    return bad_request(e.args[0])
+
+@api.errorhandler(ServiceUnavailable)
+def unavailable_error(e):
+    return service_unavailable(e.args[0], e.retry_after)
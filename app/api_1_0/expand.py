@@ -0,0 +1,135 @@
+__author__ = 'Stuart'
+"""
+?expand= and ?fields= for the API endpoints.
+
+By default to_json() links to related resources by URL, so a client showing a page of posts with their authors and
+comments follows 2 more URLs per post. With ?expand=author,comments the related objects are embedded instead of their
+URLs:
+    posts (/posts/, /posts/<id>, /users/<id>/posts/, /users/<id>/timeline/): author, comments
+    comments (/comments/, /comments/<id>, /posts/<id>/comments/): author, post
+
+Each relation costs one batched query for the whole page (two for authors, with their post counts), never one per
+item. Embedded objects are to_json() as usual, their own relations stay URLs: expansion is one level deep.
+
+?fields=url,body_html,timestamp goes the other way, for clients that need less: only those fields are in the output,
+and only they are computed (see pick_fields() in models.py). Leaving out comment_count saves its query, leaving out
+the urls their url_for calls. It applies to the top level objects, and a relation is only expanded if its field is
+one of them. Field names are the model's JSON_FIELDS, anything else is a 400.
+"""
+
+from flask import request
+from ..exceptions import ValidationError
+from ..models import User, Post, ArchivedPost, ArchivedComment, prefetch_authors
+from ..archive import comment_model
+
+POST_EXPANSIONS = ('author', 'comments')
+COMMENT_EXPANSIONS = ('author', 'post')
+
+
+def expand_arg(allowed):
+    """
+    :param allowed: what can be expanded on this endpoint
+    :return: set of the names in ?expand=, ValidationError (400) for anything else
+    """
+    names = set(name.strip() for name in request.args.get('expand', '').split(',') if name.strip())
+    unknown = names.difference(allowed)
+    if unknown:
+        raise ValidationError('Cannot expand {}, only {}'.format(', '.join(sorted(unknown)), ', '.join(allowed)))
+    return names
+
+
+def fields_arg(model):
+    """
+    :param model: whose JSON_FIELDS can be asked for
+    :return: set of the names in ?fields=, None if there is none (all fields). ValidationError (400) for others
+    """
+    if not request.args.get('fields'):
+        return None
+    names = set(name.strip() for name in request.args['fields'].split(',') if name.strip())
+    unknown = names.difference(model.JSON_FIELDS)
+    if unknown:
+        raise ValidationError('No field {}, only {}'.format(', '.join(sorted(unknown)), ', '.join(model.JSON_FIELDS)))
+    return names
+
+
+def _wanted(name, fields):
+    return fields is None or name in fields
+
+
+def _authors(items):
+    """
+    :return: {user id: user json} for the authors of posts or comments
+    """
+    prefetch_authors(items)
+    users = dict((item.author.id, item.author) for item in items if item.author is not None)
+    User.prefetch(list(users.values()))
+    return dict((id, user.to_json()) for id, user in users.items())
+
+
+def _comments(posts):
+    """
+    :return: {post id: [comments, oldest first]}, one query per tier the posts are in
+    """
+    comments = {}
+    for model in set(comment_model(post) for post in posts):
+        ids = [post.id for post in posts if comment_model(post) is model]
+        for comment in model.query.filter(model.post_id.in_(ids)).order_by(model.timestamp.asc()):
+            comments.setdefault(comment.post_id, []).append(comment)
+    return comments
+
+
+def _posts(comments):
+    """
+    :return: {post id: post json} for the posts the comments are on
+    """
+    posts = {}
+    for model, archived in ((Post, False), (ArchivedPost, True)):
+        ids = set(c.post_id for c in comments if isinstance(c, ArchivedComment) == archived and c.post_id is not None)
+        if ids:
+            found = model.query.filter(model.id.in_(ids)).all()
+            if model is Post:
+                Post.prefetch_comment_counts(found)
+            posts.update((post.id, post.to_json()) for post in found)
+    return posts
+
+
+def posts_json(posts, expand, fields=None):
+    """
+    :param posts: Post or ArchivedPost
+    :param expand: from expand_arg()
+    :param fields: from fields_arg()
+    :return: [post.to_json(fields), with the expansions]
+    """
+    if _wanted('comment_count', fields):
+        Post.prefetch_comment_counts([post for post in posts if not post.archived])
+    items = [post.to_json(fields) for post in posts]
+    expand = set(name for name in expand if _wanted(name, fields))
+    if 'author' in expand:
+        authors = _authors(posts)
+        for item, post in zip(items, posts):
+            item['author'] = authors.get(post.author_id)
+    if 'comments' in expand:
+        comments = _comments(posts)
+        for item, post in zip(items, posts):
+            item['comments'] = [comment.to_json() for comment in comments.get(post.id, [])]
+    return items
+
+
+def comments_json(comments, expand, fields=None):
+    """
+    :param comments: Comment or ArchivedComment
+    :param expand: from expand_arg()
+    :param fields: from fields_arg()
+    :return: [comment.to_json(fields), with the expansions]
+    """
+    items = [comment.to_json(fields) for comment in comments]
+    expand = set(name for name in expand if _wanted(name, fields))
+    if 'author' in expand:
+        authors = _authors(comments)
+        for item, comment in zip(items, comments):
+            item['author'] = authors.get(comment.author_id)
+    if 'post' in expand:
+        posts = _posts(comments)
+        for item, comment in zip(items, comments):
+            item['post'] = posts.get(comment.post_id)
+    return items
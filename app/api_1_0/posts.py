@@ -1,11 +1,14 @@
 __author__ = 'Stuart'
 
 from flask import jsonify, request, g, abort, url_for, current_app
-from .. import db
+from .. import db, trending, live, groupcommit
 from ..models import Post, Permission
+from ..archive import get_post_or_404
 from . import api
 from .decorators import permission_required
-from .errors import forbidden
+from .errors import forbidden, service_unavailable
+from .expand import expand_arg, fields_arg, posts_json, POST_EXPANSIONS
+from ..pagination import paginate, count_arg
 
 @api.route('/posts/')
 def get_posts():
@@ -14,25 +17,56 @@ def get_posts():
     :return:
     """
     page = request.args.get('page',1,type=int)
-    pagination = Post.query.paginate(
-        page,
-        per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    expand, fields = expand_arg(POST_EXPANSIONS), fields_arg(Post)
+    pagination = paginate(Post.query, page, current_app.config['FLASKY_POSTS_PER_PAGE'], mode=count_arg())
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page-1, _external=True)
+        prev = url_for('api.get_posts', page=page-1, expand=request.args.get('expand'),
+                       fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     next_posts = None
     if pagination.has_next:
-        next_posts = url_for('api.get_posts', page=page+1, _external=True)
+        next_posts = url_for('api.get_posts', page=page+1, expand=request.args.get('expand'),
+                             fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     return jsonify({
-        'posts':[post.to_json() for post in posts],
+        'posts': posts_json(posts, expand, fields),
         'prev': prev,
         'next': next_posts,
         'count': pagination.total
     })
 
 
+@api.route('/posts/hot/')
+def get_hot_posts():
+    """
+    Same ranking as /hot, see app/trending.py. ?limit= up to 100, a page's worth by default.
+    """
+    limit = min(request.args.get('limit', current_app.config['FLASKY_POSTS_PER_PAGE'], type=int), 100)
+    expand, fields = expand_arg(POST_EXPANSIONS), fields_arg(Post)
+    posts = trending.hot_posts(max(limit, 0))
+    return jsonify({
+        'posts': posts_json(posts, expand, fields),
+        'count': len(posts)
+    })
+
+
+@api.route('/posts/live/')
+def get_live_posts():
+    """
+    Server-sent events with the ids of new posts as they are committed, instead of polling /posts/. ?followed=1 for
+    the user's followed authors only. See app/live.py.
+    """
+    if not current_app.config['FLASKY_LIVE_EVENTS']:
+        return '', 204
+    user = None
+    if request.args.get('followed') and not g.current_user.is_anonymous():
+        user = g.current_user
+    response = live.stream(user, live.last_event_id(request))
+    if response is None:
+        return service_unavailable('Too many live connections', retry_after=30)
+    return response
+
+
 @api.route('/posts/<int:id>')
 def get_post(id):
     """
@@ -41,8 +75,9 @@ def get_post(id):
     :param id:
     :return:
     """
-    post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    expand, fields = expand_arg(POST_EXPANSIONS), fields_arg(Post)
+    post = get_post_or_404(id)  # archived posts too
+    return jsonify(posts_json([post], expand, fields)[0])
 
 @api.route('/posts/', methods=['POST'])
 @permission_required(Permission.WRITE_ARTICLES)
@@ -58,11 +93,11 @@ def new_post():
     Body of response includes new resource in JSON, so client doesn't have to issue another GET right after creation.
     :return:
     """
+    fields = fields_arg(Post)  # before anything is written
     post = Post.from_json(request.json)
-    post.author = g.current_user
-    db.session.add(post)
-    db.session.commit()
-    return jsonify(post.to_json()), 201, {'Location': url_for('api.get_post', id=post.id, _external=True)}
+    post.author_id = g.current_user.id  # not .author, that would put it in the session before groupcommit has it
+    groupcommit.insert(post)
+    return jsonify(post.to_json(fields)), 201, {'Location': url_for('api.get_post', id=post.id, _external=True)}
 
 @api.route('/posts/<int:id>', methods=['PUT'])
 @permission_required(Permission.WRITE_ARTICLES)
@@ -76,9 +111,10 @@ def edit_post(id):
     :param id:
     :return:
     """
+    fields = fields_arg(Post)
     post = Post.query.get_or_404(id)
     if g.current_user != post.author and not g.current_user.can(Permission.ADMINISTER):
         return forbidden("Not permitted")
     post.body = request.json.get('body', post.body)
     db.session.add(post)
-    return jsonify(post.to_json())
+    return jsonify(post.to_json(fields))
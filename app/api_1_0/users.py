@@ -2,29 +2,33 @@ __author__ = 'Stuart'
 from flask import jsonify, request, current_app, url_for
 from . import api
 from ..models import User, Post
+from .expand import expand_arg, fields_arg, posts_json, POST_EXPANSIONS
+from ..pagination import paginate, count_arg
+from .. import timelinecache
 
 @api.route('/users/<int:id>')
 def get_user(id):
     user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    return jsonify(user.to_json(fields_arg(User)))
 
 @api.route('/users/<int:id>/posts/')
 def get_user_posts(id):
     user = User.query.get_or_404(id)
     page = request.args.get('page',1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page,
-        per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    expand, fields = expand_arg(POST_EXPANSIONS), fields_arg(Post)
+    pagination = paginate(user.posts.order_by(Post.timestamp.desc()), page,
+                          current_app.config['FLASKY_POSTS_PER_PAGE'], mode=count_arg())
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_posts', page = page-1, _external=True)
+        prev = url_for('api.get_user_posts', id=id, page=page-1, expand=request.args.get('expand'),
+                       fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     next_posts = None
     if pagination.has_next:
-        next_posts = url_for('api.get_posts', page = page + 1, _external=True)
+        next_posts = url_for('api.get_user_posts', id=id, page=page+1, expand=request.args.get('expand'),
+                             fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     return jsonify({
-        'posts': [post.to_json() for post in posts],
+        'posts': posts_json(posts, expand, fields),
         'prev': prev,
         'next': next_posts,
         'count': pagination.total
@@ -34,19 +38,23 @@ def get_user_posts(id):
 def get_user_followed_posts(id):
     user = User.query.get_or_404(id)
     page = request.args.get('page', 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(
-        page,
-        per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    expand, fields = expand_arg(POST_EXPANSIONS), fields_arg(Post)
+    if page == 1:  # the newest posts, from the cache
+        pagination = timelinecache.first_page(user, current_app.config['FLASKY_POSTS_PER_PAGE'], mode=count_arg())
+    else:
+        pagination = paginate(user.followed_posts.order_by(Post.timestamp.desc()), page,
+                              current_app.config['FLASKY_POSTS_PER_PAGE'], mode=count_arg())
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_posts', page = page-1, _external=True)
+        prev = url_for('api.get_user_followed_posts', id=id, page=page-1, expand=request.args.get('expand'),
+                       fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     next_posts = None
     if pagination.has_next:
-        next_posts = url_for('api.get_posts', page = page + 1, _external=True)
+        next_posts = url_for('api.get_user_followed_posts', id=id, page=page+1, expand=request.args.get('expand'),
+                             fields=request.args.get('fields'), count=request.args.get('count'), _external=True)
     return jsonify({
-        'posts': [post.to_json() for post in posts],
+        'posts': posts_json(posts, expand, fields),
         'prev': prev,
         'next': next_posts,
         'count': pagination.total
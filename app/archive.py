@@ -0,0 +1,120 @@
+__author__ = 'Stuart'
+"""
+Hot/cold split of posts and comments.
+
+`python manage.py archive` moves posts older than FLASKY_ARCHIVE_AFTER_DAYS, together with all their comments, from
+posts/comments into posts_archive/comments_archive (ArchivedPost/ArchivedComment in models.py). The ids stay the
+same. After that, everything that lists or counts posts (index, timelines, profiles, /moderate, the API lists) runs
+on the hot tables only, with their indexes and the db cache holding recent rows instead of years of history. Nothing
+had to change in those queries, the old rows just aren't there anymore.
+
+Lookups by id fall back to the archive: get_post_or_404() and get_comment_or_404() are used by the permalink page and
+the API detail endpoints, so old links keep working. Archived posts are read only.
+
+Comments younger than the cutoff on posts that are still hot stay where they are. A post goes with all its comments
+or not at all, so comments never point across the two tiers.
+
+Each chunk of posts is copied (INSERT ... SELECT, no rows through Python) and deleted in one transaction, so
+stopping the command half way leaves every post in exactly one of the two places. Run it again to carry on.
+"""
+
+import datetime
+from flask import abort, current_app
+from sqlalchemy import select, literal, func
+from . import db, scheduler, timelinecache, trending
+from .models import Post, Comment, ArchivedPost, ArchivedComment
+
+
+def get_post_or_404(id):
+    """
+    Post, or ArchivedPost if it was archived (check post.archived).
+    """
+    post = Post.query.get(id) or ArchivedPost.query.get(id)
+    if post is None:
+        abort(404)
+    return post
+
+
+def get_comment_or_404(id):
+    comment = Comment.query.get(id) or ArchivedComment.query.get(id)
+    if comment is None:
+        abort(404)
+    return comment
+
+
+def comment_model(post):
+    """
+    For queries on a post's comments, which live with the post.
+    """
+    return ArchivedComment if post.archived else Comment
+
+
+def _copy(source, target, where, now):
+    """
+    INSERT INTO target (cols, archived_at) SELECT cols, now FROM source WHERE ...
+    """
+    columns = [c.name for c in source.columns]
+    query = select([source.c[name] for name in columns] + [literal(now, db.DateTime)]).where(where)
+    db.session.execute(target.insert().from_select(columns + ['archived_at'], query))
+
+
+def _never_reuse_ids(table, archived):
+    """
+    New rows must not get ids that are in the archive, or get_post_or_404() would find the new row and the archived
+    one could never be reached again. Postgres sequences only go up. On sqlite that takes AUTOINCREMENT (the
+    2e7a5c9d4f18 migration): then the next id is one past sqlite_sequence, which is moved past the archive's ids
+    in case rows were copied in from elsewhere. Without it, refuse to archive.
+    """
+    if db.session.bind.dialect.name != 'sqlite':
+        return
+    sql = db.session.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name",
+                             {'name': table.name}).scalar()
+    if 'AUTOINCREMENT' not in (sql or '').upper():
+        raise RuntimeError('{} reuses ids, run `manage.py db upgrade` before archiving'.format(table.name))
+    highest = db.session.execute(select([func.max(archived.c.id)])).scalar()
+    if highest is None:
+        return
+    if db.session.execute("SELECT 1 FROM sqlite_sequence WHERE name = :name", {'name': table.name}).scalar() is None:
+        db.session.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, 0)", {'name': table.name})
+    db.session.execute("UPDATE sqlite_sequence SET seq = :highest WHERE name = :name AND seq < :highest",
+                       {'name': table.name, 'highest': highest})
+
+
+def archive(cutoff, chunk=1000, progress=None):
+    """
+    :param cutoff: datetime, posts with an older timestamp are archived
+    :param chunk: posts per transaction
+    :param progress: called after every chunk with (posts moved, comments moved)
+    :return: (posts moved, comments moved)
+    """
+    posts, comments = Post.__table__, Comment.__table__
+    _never_reuse_ids(posts, ArchivedPost.__table__)
+    _never_reuse_ids(comments, ArchivedComment.__table__)
+    db.session.commit()
+    moved_posts = moved_comments = 0
+    while True:
+        ids = [id for id, in db.session.execute(
+            select([posts.c.id]).where(posts.c.timestamp < cutoff).order_by(posts.c.id).limit(chunk))]
+        if not ids:
+            break
+        now = datetime.datetime.utcnow()
+        _copy(posts, ArchivedPost.__table__, posts.c.id.in_(ids), now)
+        _copy(comments, ArchivedComment.__table__, comments.c.post_id.in_(ids), now)
+        moved_comments += db.session.execute(comments.delete().where(comments.c.post_id.in_(ids))).rowcount
+        moved_posts += db.session.execute(posts.delete().where(posts.c.id.in_(ids))).rowcount
+        db.session.commit()
+        if progress:
+            progress(moved_posts, moved_comments)
+    if moved_posts:
+        timelinecache.invalidate()  # the posts left without ORM events
+        trending.invalidate()
+    return moved_posts, moved_comments
+
+
+@scheduler.job('archive', cron='45 4 * * *', jitter=600, lease=6 * 3600)
+def archive_old_posts():
+    """
+    Nightly `manage.py archive`, for posts older than FLASKY_ARCHIVE_AFTER_DAYS.
+    """
+    days = current_app.config['FLASKY_ARCHIVE_AFTER_DAYS']
+    archive(datetime.datetime.utcnow() - datetime.timedelta(days=days))
@@ -0,0 +1,112 @@
+__author__ = 'Stuart'
+"""
+Fingerprinted, precompressed static files with far-future caching.
+
+`python manage.py assets` (deploy runs it too) copies every file of app/static/ into app/static/build/, named
+after a hash of its content: styles.css -> build/styles.3f2a9c1b07.css. Files worth compressing also get a
+build/styles.3f2a9c1b07.css.gz next to them, made with gzip -9 once instead of on every request.
+build/manifest.json maps the original names to the built ones.
+
+With a manifest in place, url_for('static', filename='styles.css') in the templates gives the built name, and those
+are sent with Cache-Control: max-age of FLASKY_STATIC_MAX_AGE (a year) and immutable. Browsers don't even
+revalidate them on repeat visits. A changed file gets a new name, so nobody gets a stale copy. The .gz copy is sent to
+clients that accept gzip. Old builds stay in build/, pages cached somewhere may still point at them.
+
+Without a manifest, or with FLASKY_STATIC_BUILD off (development, so edits to styles.css show without a rebuild),
+static files are served the stock Flask way.
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from flask import current_app, send_from_directory
+from .compression import gzip_bytes, accepts_gzip
+
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ico', '.txt', '.json', '.xml', '.html', '.map')
+
+
+def fingerprinted_name(path, data):
+    stem, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(stem, hashlib.md5(data).hexdigest()[:10], ext)
+
+
+def build(static_folder):
+    """
+    :return: the manifest, {original name: built name}, names relative to static_folder with / separators
+    """
+    build_folder = os.path.join(static_folder, BUILD_DIR)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder) and BUILD_DIR in dirs:
+            dirs.remove(BUILD_DIR)
+        for name in files:
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            built = fingerprinted_name(relative, data)
+            target = os.path.join(build_folder, *built.split('/'))
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.copyfile(source, target)
+            if name.lower().endswith(COMPRESSIBLE):
+                compressed = gzip_bytes(data, 9)
+                if len(compressed) < len(data):
+                    with open(target + '.gz', 'wb') as f:
+                        f.write(compressed)
+            manifest[relative] = BUILD_DIR + '/' + built
+    with open(os.path.join(build_folder, MANIFEST) + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(os.path.join(build_folder, MANIFEST) + '.tmp', os.path.join(build_folder, MANIFEST))  # atomic
+    return manifest
+
+
+class StaticAssets(object):
+    """
+    Flask extension, create_app() calls init_app(). The manifest is read on first use, not at startup.
+    """
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_STATIC_BUILD', True)
+        app.config.setdefault('FLASKY_STATIC_MAX_AGE', 365 * 24 * 3600)
+        app.extensions['assets'] = self
+
+        @app.url_defaults
+        def built_static_name(endpoint, values):
+            if endpoint == 'static' and 'filename' in values:
+                values['filename'] = self.manifest(app).get(values['filename'], values['filename'])
+
+        app.view_functions['static'] = self.send_static
+
+    def manifest(self, app):
+        if not app.config['FLASKY_STATIC_BUILD']:
+            return {}
+        manifest = app.extensions.get('assets_manifest')
+        if manifest is None:
+            try:
+                with open(os.path.join(app.static_folder, BUILD_DIR, MANIFEST)) as f:
+                    manifest = json.load(f)
+            except IOError:
+                manifest = {}
+            app.extensions['assets_manifest'] = manifest
+            app.extensions['assets_built'] = set(manifest.values())
+        return manifest
+
+    def send_static(self, filename):
+        app = current_app._get_current_object()
+        self.manifest(app)
+        if filename not in app.extensions.get('assets_built', ()):
+            return app.send_static_file(filename)
+        if accepts_gzip() and os.path.isfile(os.path.join(app.static_folder, filename + '.gz')):
+            response = send_from_directory(app.static_folder, filename + '.gz',
+                                           mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_from_directory(app.static_folder, filename)
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(app.config['FLASKY_STATIC_MAX_AGE'])
+        return response
@@ -3,6 +3,7 @@ from flask.ext.wtf import Form
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, ValidationError
 from wtforms.validators import DataRequired, Email, Length, Regexp, EqualTo
 from ..models import User
+from .. import usercache
 
 class LoginForm(Form):
     email = StringField('Email', validators=[DataRequired(),
@@ -38,7 +39,7 @@ class RegistrationForm(Form):
             raise ValidationError("Email already registered")
 
     def validate_username(self,field):
-        if User.query.filter_by(username=field.data).first():
+        if usercache.lookup(field.data, trust_negative=False):  # a cached "no such user" could be stale, ask the db
             raise ValidationError('Username already in use.')
 
 class ChangePasswordForm(Form):
@@ -63,10 +63,11 @@ def register():
                     username = form.username.data,
                     password = form.password.data)
         db.session.add(user)
-        db.session.commit()  # even though app autocommits at end of request, we need to do it explicit now since need
-                                # id for token creation
+        db.session.flush()  # need the id for token creation. Only flush, so the user and the outboxed email below
+                            # are committed together
         token = user.generate_confirmation_token()
         send_email(user.email, 'Confirm Your Account','auth/email/confirm', user=user, token=token)
+        db.session.commit()
         flash('A confirmation email has been sent to you by email.')
         return redirect(url_for('auth.login'))
     return render_template('auth/register.html',form=form)
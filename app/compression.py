@@ -0,0 +1,65 @@
+__author__ = 'Stuart'
+"""
+gzip for the HTML pages and API JSON, done in after_request.
+
+A response is compressed when all of these hold:
+    the client accepts gzip: Accept-Encoding has gzip (or *) with a q-value above 0, gzip;q=0 is a refusal
+    it's a 2xx with a body (not 204/206) and nobody set Content-Encoding already
+    its mimetype is in FLASKY_COMPRESS_MIMETYPES. Images, fonts, zips are compressed already, gzip only costs CPU
+    the body is at least FLASKY_COMPRESS_MIN_SIZE bytes. Below ~500 bytes the gzip header and the CPU aren't worth
+    it, the response fits in a packet either way
+    it's not streamed or a file (direct_passthrough). Static files are gzipped once at deploy time, see assets.py
+
+FLASKY_COMPRESS_LEVEL is the usual zlib 1-9. 6 gets nearly all of 9's size for about half the CPU.
+"""
+
+import zlib
+from flask import request
+
+
+DEFAULT_MIMETYPES = ['text/html', 'text/css', 'text/plain', 'text/xml', 'application/json',
+                     'application/javascript', 'application/xml', 'image/svg+xml']
+
+
+def gzip_bytes(data, level=6):
+    """
+    gzip format (not just deflate), what Content-Encoding: gzip means.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16+: gzip header and trailer
+    return compressor.compress(data) + compressor.flush()
+
+
+def accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+
+class Compress(object):
+    """
+    Flask extension, create_app() calls init_app().
+    """
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_COMPRESS_MIMETYPES', DEFAULT_MIMETYPES)
+        app.config.setdefault('FLASKY_COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('FLASKY_COMPRESS_LEVEL', 6)
+        app.extensions['compress'] = self
+
+        @app.after_request
+        def compress(response):
+            return self.compress(app, response)
+
+    def compress(self, app, response):
+        if (response.status_code < 200 or response.status_code >= 300 or response.status_code in (204, 206) or
+                response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers or
+                response.mimetype not in app.config['FLASKY_COMPRESS_MIMETYPES']):
+            return response
+        response.vary.add('Accept-Encoding')  # caches in between must keep the gzipped and plain copies apart
+        if not accepts_gzip():
+            return response
+        data = response.get_data()
+        if len(data) < app.config['FLASKY_COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(gzip_bytes(data, app.config['FLASKY_COMPRESS_LEVEL']))
+        response.headers['Content-Encoding'] = 'gzip'
+        if response.headers.get('ETag'):  # same entity, different bytes
+            response.headers['ETag'] = response.headers['ETag'].rstrip('"') + '-gzip"'
+        return response
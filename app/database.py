@@ -0,0 +1,353 @@
+__author__ = 'Stuart'
+"""
+Our own subclass of Flask-SQLAlchemy's SQLAlchemy. The db object in app/__init__.py is one of these, everything else
+(db.Model, db.session, paginate...) works exactly like the stock extension.
+
+What it adds:
+1) Engine tuning: the profile named by FLASKY_DB_PROFILE (see db_profiles in config.py) gets applied to every engine
+the extension builds. Pool arguments go in through apply_driver_hacks(), which is the hook Flask-SQLAlchemy calls
+with the create_engine() kwargs. Per-connection settings go in through SQLAlchemy events on the engine once it exists.
+2) Read/write routing: when SQLALCHEMY_REPLICA_URI is set, SELECTs from GET requests in the main and api blueprints
+are sent to the replica and everything else to the primary. See ReplicaRouter for the rules.
+"""
+
+import time
+from contextlib import contextmanager
+from threading import Lock
+from flask import request, session, g, _request_ctx_stack
+from flask.ext.sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, exc, select
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.expression import Select
+from config import db_profiles, db_profiles_by_dialect
+
+
+_profile_lock = Lock()
+REPLICA_BIND = 'replica'  # name of the replica in SQLALCHEMY_BINDS
+
+
+def resolve_profile(name, drivername):
+    """
+    Turns a profile name into its settings dict. 'auto' picks by dialect, so the same config works whether
+    DATABASE_URL points at postgres or we fell back to sqlite. Unknown dialects just get the driver defaults.
+    :param name: FLASKY_DB_PROFILE value
+    :param drivername: from the sqlalchemy URL, e.g. 'sqlite' or 'postgresql+psycopg2'
+    :return: dict of settings
+    """
+    if name is None or name == 'auto':
+        name = db_profiles_by_dialect.get(drivername.split('+')[0], 'default')
+    if name not in db_profiles:
+        raise ValueError('Unknown database profile: {}'.format(name))
+    return db_profiles[name]
+
+
+def _is_memory_sqlite(url):
+    return url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:')
+
+
+def apply_engine_profile(engine, profile):
+    """
+    Registers the per-connection half of a profile on an engine. Safe to call more than once, the listeners are only
+    added the first time.
+    :param engine: sqlalchemy Engine
+    :param profile: settings dict from resolve_profile()
+    :return: the engine
+    """
+    if getattr(engine, 'flasky_profile', None) is not None:
+        return engine
+    with _profile_lock:
+        if getattr(engine, 'flasky_profile', None) is None:
+            _register_profile_events(engine, profile)
+            engine.flasky_profile = profile
+    return engine
+
+
+def _register_profile_events(engine, profile):
+    if engine.dialect.name == 'sqlite':
+        pragmas = sqlite_pragmas(profile, in_memory=_is_memory_sqlite(engine.url))
+        if pragmas:
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+                cursor.close()
+            event.listen(engine, 'connect', set_sqlite_pragmas)
+    if profile.get('pre_ping'):
+        event.listen(engine, 'engine_connect', ping_connection)
+
+
+def sqlite_pragmas(profile, in_memory=False):
+    """
+    PRAGMA statements for a profile. WAL and mmap mean nothing for an in-memory db, so those are skipped there.
+    busy_timeout goes first so the journal_mode switch itself waits politely if another process holds the lock.
+    """
+    pragmas = []
+    if profile.get('busy_timeout') is not None:
+        pragmas.append('PRAGMA busy_timeout = {:d}'.format(profile['busy_timeout']))
+    if profile.get('journal_mode') and not in_memory:
+        pragmas.append('PRAGMA journal_mode = {}'.format(profile['journal_mode']))
+    if profile.get('synchronous'):
+        pragmas.append('PRAGMA synchronous = {}'.format(profile['synchronous']))
+    if profile.get('cache_size') is not None:
+        pragmas.append('PRAGMA cache_size = {:d}'.format(profile['cache_size']))
+    if profile.get('mmap_size') is not None and not in_memory:
+        pragmas.append('PRAGMA mmap_size = {:d}'.format(profile['mmap_size']))
+    return pragmas
+
+
+def ping_connection(connection, branch):
+    """
+    Pessimistic disconnect handling, straight from the SQLAlchemy docs recipe (1.0 has no pool_pre_ping yet).
+    Runs SELECT 1 whenever a connection is checked out. If the db went away, the error invalidates the whole pool and
+    the second SELECT 1 runs on a brand new connection, so the request never sees the stale one.
+    """
+    if branch:  # sub-connection of one we already checked
+        return
+    save_should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as err:
+        if err.connection_invalidated:
+            connection.scalar(select([1]))
+        else:
+            raise
+    finally:
+        connection.should_close_with_result = save_should_close_with_result
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that can send reads somewhere else. ReplicaRouter puts the replica engine in session.info at the start
+    of a request it considers safe. Only plain SELECTs go there: flushes, bulk updates/deletes and anything executed
+    without a statement (session.connection()) stay on the primary, so nothing can ever be written to the replica.
+    Once this session has written something, later reads in the same request go to the primary too, otherwise the
+    request couldn't see its own changes.
+    """
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica_engine')
+        if replica is not None and not self._flushing and isinstance(clause, Select) \
+                and not self.info.get('wrote') and not self.info['router'].user_recently_wrote():
+            return replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+@contextmanager
+def on_primary(db_session):
+    """
+    Reads in the block go to the primary even in a request routed to the replica. For code that fills a cache kept
+    right by change events (timelinecache.py, trending.py): a replica lagging behind events already applied would
+    leave rows out, and no later event would bring them back.
+    """
+    replica = db_session.info.pop('replica_engine', None)
+    try:
+        yield
+    finally:
+        if replica is not None:
+            db_session.info['replica_engine'] = replica
+
+
+class ReplicaRouter(object):
+    """
+    Decides, per request, whether reads may go to the replica.
+
+    Reads use the replica when all of these hold:
+    - the request is GET/HEAD/OPTIONS on one of FLASKY_REPLICA_BLUEPRINTS, and the view isn't marked @use_primary
+    - the client hasn't written anything for FLASKY_REPLICA_MAX_LAG seconds (read-your-writes). We remember the last
+      write both in the cookie session and per user id, since API clients often don't keep cookies
+    - the replica answered its last health check. A failed check or a connection error on the replica benches it
+      for FLASKY_REPLICA_RETRY seconds and everyone reads from the primary meanwhile
+
+    The per-user write times live in this process only, so with several workers the cookie is what really carries
+    the guarantee for browsers. The api client gets it per worker.
+    """
+    def __init__(self, db, app):
+        self.db = db
+        self.app = app
+        self.down_until = 0
+        self.checked_at = 0
+        self.last_write_by_user = {}
+        self._lock = Lock()
+
+    def replica_engine(self):
+        """
+        Engine for SQLALCHEMY_REPLICA_URI, registered as a normal Flask-SQLAlchemy bind so it gets the same pool
+        defaults, sqlite path handling and engine profile as the primary. Read lazily so the URI can be changed after
+        create_app() (tests do this). No tables are mapped to the bind, and create_all()/drop_all() skip it.
+        """
+        uri = self.app.config.get('SQLALCHEMY_REPLICA_URI')
+        if not uri:
+            return None
+        binds = self.app.config.get('SQLALCHEMY_BINDS') or {}
+        if binds.get(REPLICA_BIND) != uri:
+            binds = dict(binds)
+            binds[REPLICA_BIND] = uri
+            self.app.config['SQLALCHEMY_BINDS'] = binds
+        engine = self.db.get_engine(self.app, bind=REPLICA_BIND)
+        if not event.contains(engine, 'handle_error', self.on_replica_error):
+            event.listen(engine, 'handle_error', self.on_replica_error)
+        return engine
+
+    def replica_available(self, engine):
+        now = time.time()
+        if now < self.down_until:
+            return False
+        if now - self.checked_at < self.app.config['FLASKY_REPLICA_CHECK_INTERVAL']:
+            return True
+        self.checked_at = now
+        try:
+            conn = engine.connect()
+            try:
+                conn.scalar(select([1]))
+            finally:
+                conn.close()
+        except exc.DBAPIError:
+            self.mark_down()
+            return False
+        return True
+
+    def mark_down(self):
+        self.down_until = time.time() + self.app.config['FLASKY_REPLICA_RETRY']
+        self.app.logger.warning('Replica database unavailable, reading from primary for {}s'.format(
+            self.app.config['FLASKY_REPLICA_RETRY']))
+
+    def on_replica_error(self, context):
+        # connection is None when the error happened while connecting, e.g. "unable to open database file" in sqlite
+        if context.is_disconnect or context.connection is None:
+            self.mark_down()
+
+    def wants_replica(self):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return False
+        if request.blueprint not in self.app.config['FLASKY_REPLICA_BLUEPRINTS']:
+            return False
+        view = self.app.view_functions.get(request.endpoint)
+        if view is None or getattr(view, 'use_primary', False):
+            return False
+        last_write = session.get('_db_last_write')
+        return last_write is None or time.time() - last_write > self.app.config['FLASKY_REPLICA_MAX_LAG']
+
+    def user_recently_wrote(self):
+        user_id = _current_user_id()
+        if user_id is None:
+            return False
+        last_write = self.last_write_by_user.get(user_id)
+        return last_write is not None and time.time() - last_write <= self.app.config['FLASKY_REPLICA_MAX_LAG']
+
+    def before_request(self):
+        engine = self.replica_engine()
+        if engine is None:
+            return
+        # the scoped session normally dies at teardown, but don't count on it (tests keep one for the whole test)
+        db_session = self.db.session()
+        for key in ('replica_engine', 'router', 'wrote'):
+            db_session.info.pop(key, None)
+        if self.wants_replica() and self.replica_available(engine):
+            db_session.info['replica_engine'] = engine
+            db_session.info['router'] = self
+
+    def after_request(self, response):
+        """
+        Remembers when this client last wrote. Commit-on-teardown flushes after this runs, so pending objects count
+        as a write too. Plain attribute changes on GETs (User.ping() on every request) deliberately don't, or no
+        logged in user would ever read from the replica. GET views that do update rows get @use_primary instead.
+        """
+        if self.replica_engine() is None:
+            return response
+        db_session = self.db.session()
+        if db_session.info.get('wrote') or db_session.new or db_session.deleted or \
+                request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            now = time.time()
+            session['_db_last_write'] = now
+            user_id = _current_user_id()
+            if user_id is not None:
+                with self._lock:
+                    if len(self.last_write_by_user) > 10000:
+                        self._prune(now)
+                    self.last_write_by_user[user_id] = now
+        return response
+
+    def _prune(self, now):
+        max_lag = self.app.config['FLASKY_REPLICA_MAX_LAG']
+        for user_id, last_write in list(self.last_write_by_user.items()):
+            if now - last_write > max_lag:
+                del self.last_write_by_user[user_id]
+
+
+def _current_user_id():
+    """
+    Id of whoever is making the request, without loading anyone from the db. The API stores its user in g, and
+    Flask-Login keeps the loaded user on the request context.
+    """
+    user = getattr(g, 'current_user', None)
+    if user is None and _request_ctx_stack.top is not None:
+        user = getattr(_request_ctx_stack.top, 'user', None)
+    return getattr(user, 'id', None)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_session_wrote(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+class FlaskySQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def init_app(self, app):
+        super(FlaskySQLAlchemy, self).init_app(app)
+        app.config.setdefault('SQLALCHEMY_REPLICA_URI', None)
+        app.config.setdefault('FLASKY_REPLICA_BLUEPRINTS', ('main', 'api'))
+        app.config.setdefault('FLASKY_REPLICA_MAX_LAG', 5)
+        app.config.setdefault('FLASKY_REPLICA_CHECK_INTERVAL', 10)
+        app.config.setdefault('FLASKY_REPLICA_RETRY', 30)
+        router = ReplicaRouter(self, app)
+        app.extensions['replica_router'] = router
+        app.before_request(router.before_request)
+        app.after_request(router.after_request)
+
+    def _own_binds(self, bind, app):
+        """
+        The replica is ours to read from, not to run DDL on, and it may well be down. Leave it out of '__all__'.
+        """
+        if bind != '__all__':
+            return bind
+        return [None] + [b for b in (self.get_app(app).config.get('SQLALCHEMY_BINDS') or ()) if b != REPLICA_BIND]
+
+    def create_all(self, bind='__all__', app=None):
+        super(FlaskySQLAlchemy, self).create_all(self._own_binds(bind, app), app)
+
+    def drop_all(self, bind='__all__', app=None):
+        super(FlaskySQLAlchemy, self).drop_all(self._own_binds(bind, app), app)
+
+    def reflect(self, bind='__all__', app=None):
+        super(FlaskySQLAlchemy, self).reflect(self._own_binds(bind, app), app)
+
+    def profile_for(self, app, drivername):
+        return resolve_profile(app.config.get('FLASKY_DB_PROFILE'), drivername)
+
+    def apply_driver_hacks(self, app, info, options):
+        """
+        Called by Flask-SQLAlchemy right before create_engine() with the kwargs it is about to use. Pool sizing for
+        sqlite stays with the parent class (NullPool for files, which is what we want across processes).
+        """
+        super(FlaskySQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('sqlite') and info.database in (None, '', ':memory:'):
+            # every new connection to :memory: is a new, empty db, so all checkouts have to share the one connection.
+            # Newer Flask-SQLAlchemy does this itself, 2.0 doesn't
+            options['poolclass'] = StaticPool
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+        profile = self.profile_for(app, info.drivername)
+        if not info.drivername.startswith('sqlite'):
+            for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+                if profile.get(key) is not None:
+                    options.setdefault(key, profile[key])
+        if profile.get('statement_timeout') and info.drivername.startswith('postgres'):
+            # libpq passes these to the server at connect time, so it sticks for the life of the connection and
+            # survives the pool's rollback-on-return
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = '-c statement_timeout={:d}'.format(profile['statement_timeout'])
+
+    def get_engine(self, app, bind=None):
+        engine = super(FlaskySQLAlchemy, self).get_engine(app, bind)
+        return apply_engine_profile(engine, self.profile_for(app, engine.url.drivername))
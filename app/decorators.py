@@ -15,4 +15,13 @@ def permission_required(permission):
     return decorator
 
 def admin_required(f):
-    return permission_required(Permission.ADMINISTER)(f)
\ No newline at end of file
+    return permission_required(Permission.ADMINISTER)(f)
+
+def use_primary(f):
+    """
+    Keeps a view on the primary database even when it is a GET. For GET views that change rows (follow, moderation
+    toggles...), so they read what they are about to write and the client's next request gets the read-your-writes
+    treatment. See ReplicaRouter in database.py.
+    """
+    f.use_primary = True
+    return f
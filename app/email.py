@@ -3,7 +3,7 @@ __author__ = 'Stuart'
 from threading import Thread
 from flask import current_app, render_template
 from flask.ext.mail import Message
-from . import mail
+from . import mail, outbox
 
 
 def send_async_email(app, msg):
@@ -12,11 +12,28 @@ def send_async_email(app, msg):
 
 
 def send_email(to, subject, template, **kwargs):
+    """
+    Renders the email now (templates may need the request for url_for(_external=True)) and hands it off.
+    With FLASKY_MAIL_OUTBOX on, it goes into the outbox, gets committed with the rest of the request and the worker
+    process sends it. Otherwise it is sent from a background thread like before, and is lost if the process dies.
+    :return: the Outbox row, or the sending thread
+    """
     app = current_app._get_current_object()
     msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
                   sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
+    if app.config['FLASKY_MAIL_OUTBOX']:
+        return outbox.enqueue('email', subject=msg.subject, sender=msg.sender, recipients=msg.recipients,
+                              body=msg.body, html=msg.html)
     thr = Thread(target=send_async_email, args=[app, msg])
     thr.start()
-    return thr
\ No newline at end of file
+    return thr
+
+
+@outbox.handler('email')
+def deliver_email(subject, sender, recipients, body, html):
+    msg = Message(subject, sender=sender, recipients=recipients)
+    msg.body = body
+    msg.html = html
+    mail.send(msg)
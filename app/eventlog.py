@@ -0,0 +1,80 @@
+__author__ = 'Stuart'
+"""
+Change logs in the local store, for the in-process structures that have to follow what other workers on the host
+commit (timelinecache.py, trending.py, live.py).
+
+Model events call log.record(target, ...) during the flush. When the session commits, what was recorded is appended
+to the log, each event numbered ([seq, ...]), and only the last `size` events are kept. On a rollback it is thrown
+away. Readers keep the seq they got to and call log.read(app, seq) before using their structure: one read of the
+local store when nothing happened, the new events otherwise, or None if some have already left the log (or it's the
+first read), in which case the reader starts over from the db.
+"""
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from .database import RoutingSession
+from .localstore import get_store
+
+
+class EventLog(object):
+    def __init__(self, name, size_config):
+        """
+        :param name: prefix of its keys in the local store
+        :param size_config: config key with the number of events to keep
+        """
+        self.name = name
+        self.seq_key = name + ':seq'
+        self.events_key = name + ':events'
+        self.size_config = size_config
+        event.listen(RoutingSession, 'after_commit', self._after_commit)
+        event.listen(RoutingSession, 'after_rollback', self._after_rollback)
+
+    def record(self, target, *args):
+        """
+        From a mapper event: publish args when target's session commits.
+        """
+        object_session(target).info.setdefault(self.events_key, []).append(args)
+
+    def publish(self, app, events):
+        keep = app.config[self.size_config]
+        store = get_store(app)
+        start = store.get(self.seq_key, 0)
+
+        def append(log):
+            log = log or []
+            seq = log[-1][0] if log else start
+            log = log + [[seq + i + 1] + list(args) for i, args in enumerate(events)]
+            return log[-keep:], log[-1][0]
+        seq = store.update(self.events_key, append)
+        # another worker may have appended after us and set its seq already, which must not go back
+        store.update(self.seq_key, lambda old: (max(old or 0, seq), None))
+
+    def last(self, app):
+        """
+        Seq of the newest event, for a reader that only wants what comes after now.
+        """
+        return get_store(app).get(self.seq_key, 0)
+
+    def read(self, app, since):
+        """
+        :param since: last seq the caller applied, None the first time
+        :return: (seq to remember, [events after since] or None if the caller must start over)
+        """
+        store = get_store(app)
+        seq = store.get(self.seq_key, 0)
+        if seq == since:
+            return since, []
+        events = store.get(self.events_key) or []
+        last = max([seq] + [args[0] for args in events])
+        if since is None or not events or events[0][0] > since + 1:
+            return last, None
+        return last, [args for args in events if args[0] > since]
+
+    def _after_commit(self, session):
+        events = session.info.pop(self.events_key, None)
+        if events and has_app_context():
+            self.publish(current_app._get_current_object(), events)
+
+    def _after_rollback(self, session):
+        session.info.pop(self.events_key, None)
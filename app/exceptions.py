@@ -5,3 +5,12 @@ class ValidationError(ValueError):
     Simple subclass of ValueError.
     """
     pass
+
+
+class ServiceUnavailable(Exception):
+    """
+    Something the request needs isn't available for now. The API answers with a 503 and Retry-After.
+    """
+    def __init__(self, message, retry_after=1):
+        super(ServiceUnavailable, self).__init__(message)
+        self.retry_after = retry_after
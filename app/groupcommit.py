@@ -0,0 +1,153 @@
+__author__ = 'Stuart'
+"""
+Group commit for the API's inserts (new posts and comments).
+
+Every commit is a trip through the database's lock and, on sqlite, an fsync of its own, so concurrent writers queue
+up behind each other one commit at a time. With FLASKY_GROUP_COMMIT on, insert() hands the new row to one writer
+thread per process instead. The writer takes whatever has queued up within FLASKY_GROUP_COMMIT_WINDOW secs of the
+first row (up to FLASKY_GROUP_COMMIT_MAX rows), inserts them all and commits once. Each request waits until the
+commit its row was in has gone through, so a 201 still means the row is on disk, it just shared the fsync.
+
+If the batch fails, it's rolled back and each row is retried on its own, so one bad row only fails its own request.
+A request whose row isn't committed within FLASKY_GROUP_COMMIT_TIMEOUT secs gets a 503, and its row is dropped unless
+the writer has already taken it. If the writer thread dies, the rows it had fail the same way, and the next insert
+starts a new one.
+Model events fire in the writer's session as usual, so the timeline cache, hot ranking and live events hear about
+the rows when the batch commits.
+
+Rows must come in transient: set foreign keys (author_id...) rather than relationships to objects of the request's
+session, which would cascade the row into that session. Off (the default), insert() is the usual add and commit.
+"""
+
+import threading
+import time
+from flask import current_app
+from . import db
+from .exceptions import ServiceUnavailable
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class _Write(object):
+    def __init__(self, row):
+        self.row = row
+        self.error = None
+        self.committed = False
+        self.abandoned = False  # the request stopped waiting
+        self.done = threading.Event()
+
+
+class GroupCommitter(object):
+    def __init__(self, app):
+        self.app = app
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.batches = 0  # commits done, for the tests and anyone curious
+
+    def submit(self, row):
+        """
+        Queues row and waits until it's committed.
+        :raise: whatever committing it on its own raised, ServiceUnavailable if it took too long or the writer died
+        """
+        write = _Write(row)
+        self.queue.put(write)
+        with self.lock:
+            if self.thread is None:
+                self._start()
+        if not write.done.wait(self.app.config['FLASKY_GROUP_COMMIT_TIMEOUT']):
+            write.abandoned = True
+            raise ServiceUnavailable('Timed out waiting for the write to be committed')
+        if write.error is not None:
+            raise write.error
+
+    def _start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _batch(self):
+        writes = [self.queue.get()]
+        deadline = time.time() + self.app.config['FLASKY_GROUP_COMMIT_WINDOW']
+        while len(writes) < self.app.config['FLASKY_GROUP_COMMIT_MAX']:
+            left = deadline - time.time()
+            try:
+                writes.append(self.queue.get(timeout=left) if left > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return writes
+
+    def _run(self):
+        try:
+            while True:
+                writes = [write for write in self._batch() if not write.abandoned]
+                if not writes:
+                    continue
+                try:
+                    with self.app.app_context():
+                        self._commit_batch(writes)
+                except Exception:
+                    self.app.logger.exception('Group commit writer error')
+                finally:
+                    for write in writes:
+                        if not write.committed and write.error is None:
+                            write.error = ServiceUnavailable('The write could not be committed')
+                        write.done.set()
+        finally:
+            with self.lock:
+                self.thread = None
+                if not self.queue.empty():  # rows queued by requests that saw this thread still there
+                    self._start()
+
+    def _commit_batch(self, writes):
+        try:
+            self._commit(writes)
+        except Exception as e:
+            if len(writes) == 1:
+                writes[0].error = e
+            else:
+                for write in writes:
+                    try:
+                        self._commit([write])
+                    except Exception as e:
+                        write.error = e
+
+    def _commit(self, writes):
+        session = db.create_session({'expire_on_commit': False})  # the requests read the rows once they're back
+        try:
+            session.add_all([write.row for write in writes])
+            session.commit()
+            self.batches += 1
+            for write in writes:
+                write.committed = True
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()  # detaches the rows, so the requests can add them to their own sessions
+
+
+def _committer(app):
+    committer = app.extensions.get('group_commit')
+    if committer is None:
+        committer = app.extensions.setdefault('group_commit', GroupCommitter(app))
+    return committer
+
+
+def insert(row):
+    """
+    Inserts and commits a new row, together with other requests' if FLASKY_GROUP_COMMIT is on.
+    :return: row, committed and attached to db.session
+    """
+    if not current_app.config['FLASKY_GROUP_COMMIT']:
+        db.session.add(row)
+        db.session.commit()
+        return row
+    # end the request's own transaction first: on sqlite without WAL its read lock would keep the writer from
+    # committing, and we'd wait on each other
+    db.session.commit()
+    _committer(current_app._get_current_object()).submit(row)
+    db.session.add(row)
+    return row
@@ -0,0 +1,177 @@
+__author__ = 'Stuart'
+"""
+Server-sent events telling open pages and API clients that new posts exist, so they stop re-fetching / and
+/api/v1.0/posts/ on a timer just to find out. The index page shows "N new posts" and the reader reloads when they
+want to. Served at /live and /api/v1.0/posts/live/, ?followed=1 for only the posts of the authors the user follows.
+
+Each worker has one Broadcaster. While anyone is connected it runs one background thread that reads the timeline's
+post events from the local store every FLASKY_LIVE_POLL secs (timelinecache.log, which every commit with a new post
+already appends to, so posts from other workers show up too) and hands them to the connections. One local store
+read per worker per interval, however many clients are listening, and no db queries at all past the connect.
+
+Each message carries the log's seq as its id. Browsers send it back as Last-Event-ID when they reconnect, and the
+posts committed in between are replayed from the log, as long as they're still in it.
+
+Limits:
+    FLASKY_LIVE_MAX_CONNECTIONS per worker, the rest get a 503 with Retry-After (EventSource retries by itself)
+    a comment line every FLASKY_LIVE_HEARTBEAT secs, so proxies don't time the stream out and we find out about
+    clients that went away (the write fails)
+    streams end after FLASKY_LIVE_MAX_AGE secs and the client reconnects, under gunicorn's timeout
+All of it is off unless FLASKY_LIVE_EVENTS is set, which it is by default only for the gevent preset (app/serving.py):
+a sync worker, or the dev server, would spend itself on one stream at a time. Off, the index page leaves the script
+out and the streams answer 204, which EventSource takes as "don't reconnect".
+"""
+
+import json
+import threading
+import time
+from flask import Response, current_app
+from . import db
+from .models import Follow
+from .ratelimit import ConcurrencyGate
+from .timelinecache import log
+
+
+class Subscriber(object):
+    def __init__(self, authors=None, seq=0):
+        """
+        :param authors: ids of the authors whose posts to pass on, None for everyone's
+        :param seq: last event the client has seen
+        """
+        self.authors = authors
+        self.seq = seq
+        self.posts = []
+        self.condition = threading.Condition()
+
+    def push(self, events):
+        """
+        :param events: timeline log events, those already seen are skipped
+        """
+        with self.condition:
+            for args in events:
+                if args[0] <= self.seq:
+                    continue
+                self.seq = args[0]
+                if args[1] == 'post' and (self.authors is None or args[2] in self.authors):
+                    self.posts.append(args[3][1])
+            if self.posts:
+                self.condition.notify()
+
+    def wait(self, timeout):
+        """
+        :return: (seq, ids of the new posts), the ids being empty if none came within timeout secs
+        """
+        with self.condition:
+            if not self.posts:
+                self.condition.wait(timeout)
+            posts, self.posts = self.posts, []
+            return self.seq, posts
+
+
+class Broadcaster(object):
+    def __init__(self, app):
+        self.app = app
+        self.gate = ConcurrencyGate(app.config['FLASKY_LIVE_MAX_CONNECTIONS'])
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.seq = None
+
+    def subscribe(self, authors=None, since=None):
+        """
+        :param since: Last-Event-ID of a reconnecting client, to replay what it missed
+        :return: a Subscriber, or None if this worker has as many connections as it takes
+        """
+        if not self.gate.try_enter():
+            return None
+        subscriber = Subscriber(authors, log.last(self.app))
+        if since is not None and since < subscriber.seq:
+            seq, events = log.read(self.app, since)
+            subscriber.seq = since
+            subscriber.push(events or [])  # None: gone from the log, the client will have to reload some time
+            subscriber.seq = max(subscriber.seq, seq)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.seq = subscriber.seq
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber not in self.subscribers:
+                return
+            self.subscribers.discard(subscriber)
+        self.gate.leave()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['FLASKY_LIVE_POLL'])
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+                subscribers = list(self.subscribers)
+            seq, events = log.read(self.app, self.seq)
+            self.seq = seq
+            if events:
+                for subscriber in subscribers:
+                    subscriber.push(events)
+
+
+def get_broadcaster(app):
+    broadcaster = app.extensions.get('live')
+    if broadcaster is None:
+        broadcaster = app.extensions.setdefault('live', Broadcaster(app))
+    return broadcaster
+
+
+def _messages(subscriber, heartbeat, max_age):
+    yield 'retry: 1000\n\n'
+    deadline = time.time() + max_age
+    while True:
+        left = deadline - time.time()
+        if left <= 0:
+            return
+        seq, posts = subscriber.wait(min(heartbeat, left))
+        if posts:
+            yield 'id: {}\nevent: posts\ndata: {}\n\n'.format(seq, json.dumps({'posts': posts}))
+        else:
+            yield ': ping\n\n'
+
+
+def stream(user=None, since=None):
+    """
+    The event stream response for a view.
+    :param user: only the posts of the authors this user follows, None for all posts
+    :param since: Last-Event-ID sent by the client, if any
+    :return: the response, or None if this worker has no room for another connection
+    """
+    app = current_app._get_current_object()
+    authors = None
+    if user is not None:
+        authors = set(id for id, in db.session.query(Follow.followed_id).filter_by(follower_id=user.id))
+    db.session.remove()  # the stream outlives the request, don't keep a connection checked out meanwhile
+    broadcaster = get_broadcaster(app)
+    subscriber = broadcaster.subscribe(authors, since)
+    if subscriber is None:
+        return None
+    response = Response(_messages(subscriber, app.config['FLASKY_LIVE_HEARTBEAT'], app.config['FLASKY_LIVE_MAX_AGE']),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx would otherwise hold the events back
+    response.call_on_close(lambda: broadcaster.unsubscribe(subscriber))
+    return response
+
+
+def last_event_id(request):
+    """
+    Seq the client has seen, from Last-Event-ID on a reconnect or ?since= the page was rendered with, else None.
+    """
+    value = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
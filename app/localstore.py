@@ -0,0 +1,171 @@
+__author__ = 'Stuart'
+"""
+A tiny key/value store for state that all the worker processes on one machine need to share: rate limit buckets and
+the like. Not for anything that must survive a reboot or be seen by other machines, that belongs in the real db.
+
+Two backends, picked by URL (FLASKY_LOCAL_STORE):
+    memory://                 a dict in this process. Fine for tests and the dev server, not shared between workers
+    sqlite:////path/file      a sqlite file. gunicorn workers on the same host see the same data. Each operation is
+                              one short transaction; fsync is off since losing this state on power loss is harmless
+
+Values are anything JSON can handle. Keys can expire.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import sys
+import time
+if 'gevent.monkey' in sys.modules:  # we've been patched. Don't import gevent otherwise, it's slow to import
+    from gevent.monkey import get_original
+    _thread_local = get_original('threading', 'local')  # per OS thread even when gevent has patched threading
+else:
+    _thread_local = threading.local
+
+
+class MemoryStore(object):
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._live(key, time.time())
+            return default if item is None else item[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def update(self, key, fn, ttl=None):
+        """
+        Atomic read-modify-write. fn gets the current value (None if missing) and returns (new_value, result).
+        :return: result
+        """
+        with self._lock:
+            item = self._live(key, time.time())
+            value, result = fn(None if item is None else item[0])
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            return result
+
+    def items(self, prefix=''):
+        with self._lock:
+            now = time.time()
+            return [(k, v[0]) for k, v in list(self._data.items())
+                    if k.startswith(prefix) and self._live(k, now) is not None]
+
+    def purge(self):
+        with self._lock:
+            now = time.time()
+            for key in list(self._data):
+                self._live(key, now)
+
+
+class SQLiteStore(object):
+    """
+    One connection per thread (sqlite3 objects can't be shared between threads) and per process, so a connection
+    opened before gunicorn forks is never reused by the children. Under gevent, greenlets of one thread share a
+    connection: nothing in here yields, so they can't interleave inside a transaction.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._local = _thread_local()
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)  # autocommit, we BEGIN ourselves
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _select(self, conn, key, now):
+        row = conn.execute('SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                           (key, now)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get(self, key, default=None):
+        value = self._select(self._conn(), key, time.time())
+        return default if value is None else value
+
+    def set(self, key, value, ttl=None):
+        self._conn().execute('INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)',
+                             (key, json.dumps(value), time.time() + ttl if ttl else None))
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def update(self, key, fn, ttl=None):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')  # takes the write lock up front, so nobody changes the row under us
+        try:
+            now = time.time()
+            value, result = fn(self._select(conn, key, now))
+            conn.execute('INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)',
+                         (key, json.dumps(value), now + ttl if ttl else None))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def items(self, prefix=''):
+        rows = self._conn().execute(
+            'SELECT key, value FROM kv WHERE key >= ? AND key < ? AND (expires IS NULL OR expires > ?)',
+            (prefix, prefix + '\uffff', time.time())).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def purge(self):
+        self._conn().execute('DELETE FROM kv WHERE expires <= ?', (time.time(),))
+
+
+_sqlite_stores = {}
+_sqlite_stores_lock = threading.Lock()
+
+
+def open_store(url):
+    """
+    Store for a FLASKY_LOCAL_STORE url. sqlite stores are shared per file within the process. Memory stores are
+    always new, so two apps (e.g. two test cases) never see each other's data.
+    """
+    if url == 'memory://':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        with _sqlite_stores_lock:
+            if path not in _sqlite_stores:
+                _sqlite_stores[path] = SQLiteStore(path)
+            return _sqlite_stores[path]
+    raise ValueError('Unsupported local store: {}'.format(url))
+
+
+def get_store(app):
+    """
+    The app's store, opened on first use.
+    """
+    store = app.extensions.get('local_store')
+    if store is None:
+        store = app.extensions.setdefault('local_store', open_store(app.config['FLASKY_LOCAL_STORE']))
+    return store
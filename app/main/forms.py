@@ -4,6 +4,7 @@ from flask.ext.pagedown.fields import PageDownField
 from wtforms import StringField, SubmitField, TextAreaField, BooleanField, SelectField, ValidationError
 from wtforms.validators import Required, DataRequired, InputRequired, Length, Email, Regexp
 from ..models import Role, User
+from .. import usercache
 
 class NameForm(Form):
     name = StringField('What is your name?', validators=[DataRequired()])  # Required()
@@ -60,7 +61,7 @@ class EditProfileAdminForm(Form):
         :return:
         """
         if field.data != self.user.username and \
-                User.query.filter_by(username=field.data).first():
+                usercache.lookup(field.data, trust_negative=False):
             raise ValidationError('Username already in use')
 
 class PostForm(Form):
@@ -3,12 +3,13 @@ __author__ = 'Stuart'
 from datetime import datetime
 from flask import render_template, redirect, url_for, abort, flash, request, current_app, make_response
 from flask.ext.login import login_required, current_user
-from flask.ext.sqlalchemy import get_debug_queries
 from . import main
 from .forms import EditProfileForm, EditProfileAdminForm, PostForm, CommentForm
-from .. import db
-from ..models import User, Permission, Role, Post, Comment
-from ..decorators import admin_required, permission_required
+from .. import db, usercache, timelinecache, trending, live
+from ..archive import get_post_or_404, comment_model
+from ..models import User, Permission, Role, Post, Comment, prefetch_authors
+from ..decorators import admin_required, permission_required, use_primary
+from ..pagination import paginate
 
 @main.route('/', methods = ['GET','POST'])
 def index():
@@ -26,22 +27,52 @@ def index():
             # called show_followed. When set to nonempty string means only followed posts should be shown.
             # Cookies are stored in request obj as a request.cookies dict.
             # String val of cookie converted to Boolean
-    if show_followed:
-        query = current_user.followed_posts  # uses user's followed posts property.
+    if show_followed and page == 1:
+        pagination = timelinecache.first_page(current_user, current_app.config['FLASKY_POSTS_PER_PAGE'])
     else:
-        query = Post.query
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'], error_out=False)  # paginate obj takes page num
+        if show_followed:
+            query = current_user.followed_posts  # uses user's followed posts property.
+        else:
+            query = Post.query
+        pagination = paginate(query.order_by(Post.timestamp.desc()), page,
+                              current_app.config['FLASKY_POSTS_PER_PAGE'])  # paginate obj takes page num
     # as first required arg, then optional per_page defaults to 20 or whatever is config'd. Error_out: True issues 404
     # if a page outside valid range requested, error_out:Flase returns empty list. looks like ?page=2.
     #posts = Post.query.order_by(Post.timestamp.desc()).all()  # loads all posts
-    posts = pagination.items
+    posts = Post.prefetch(pagination.items)
     return render_template('index.html',
                            form=form,
                            pagination=pagination,
                            posts  = posts,
                            current_time = datetime.utcnow(),
-                           show_followed=show_followed)
+                           show_followed=show_followed,
+                           live_since=timelinecache.log.last(current_app._get_current_object())
+                           if current_app.config['FLASKY_LIVE_EVENTS'] else None)
+
+@main.route('/live')
+def live_posts():
+    """
+    Event stream of new post ids for the index page, so it can say "N new posts" instead of being reloaded to find
+    out. ?followed=1 for the posts of the authors the user follows, see app/live.py.
+    """
+    if not current_app.config['FLASKY_LIVE_EVENTS']:
+        return '', 204  # tells EventSource not to reconnect
+    user = None
+    if request.args.get('followed') and current_user.is_authenticated():
+        user = current_user._get_current_object()
+    response = live.stream(user, live.last_event_id(request))
+    if response is None:
+        response = make_response('Too many live connections', 503)
+        response.headers['Retry-After'] = '30'
+    return response
+
+@main.route('/hot')
+def hot():
+    """
+    The posts with the most comment activity lately, see app/trending.py. No pagination, just the top of the ranking.
+    """
+    posts = Post.prefetch(trending.hot_posts(current_app.config['FLASKY_POSTS_PER_PAGE']))
+    return render_template('hot.html', posts=posts)
 
 @main.route('/admin')
 @login_required
@@ -110,10 +141,10 @@ def user(username):
     :param username:
     :return:
     """
-    user = User.query.filter_by(username=username).first()
+    user = usercache.lookup(username)
     if user is None:
         abort(404)
-    posts = user.posts.order_by(Post.timestamp.desc()).all()
+    posts = Post.prefetch(user.posts.order_by(Post.timestamp.desc()).all())
     return render_template('user.html', user=user, posts=posts)
 
 @main.route('/edit/<int:id>', methods = ['GET','POST'])
@@ -139,10 +170,11 @@ def edit(id):
     return render_template('edit_post.html', form=form)
 
 @main.route('/follow/<username>')
+@use_primary
 @login_required
 @permission_required(Permission.FOLLOW)
 def follow(username):
-    user = User.query.filter_by(username=username).first()
+    user = usercache.lookup(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
@@ -154,10 +186,11 @@ def follow(username):
     return redirect(url_for('.user', username=username))
 
 @main.route('/unfollow/<username>')
+@use_primary
 @login_required
 @permission_required(Permission.FOLLOW)
 def unfollow(username):
-    user = User.query.filter_by(username=username).first()
+    user = usercache.lookup(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
@@ -170,16 +203,12 @@ def unfollow(username):
 
 @main.route('/followers/<username>')
 def followers(username):
-    user = User.query.filter_by(username=username).first()
+    user = usercache.lookup(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
     page = request.args.get('page',1, type=int)
-    pagination = user.followers.paginate(
-        page,
-        per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False
-    )
+    pagination = paginate(user.followers, page, current_app.config['FLASKY_FOLLOWERS_PER_PAGE'])
     follows = [{'user':item.follower, 'timestamp':item.timestamp}
                for item in pagination.items]
     return render_template('followers.html', user=user, title='Followers of',
@@ -187,16 +216,12 @@ def followers(username):
 
 @main.route('/followed-by/<username>')
 def followed_by(username):
-    user = User.query.filter_by(username=username).first()
+    user = usercache.lookup(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
     page = request.args.get('page', 1, type=int)
-    pagination = user.followed.paginate(
-        page,
-        per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False
-    )
+    pagination = paginate(user.followed, page, current_app.config['FLASKY_FOLLOWERS_PER_PAGE'])
     follows = [{'user':item.followed, 'timestamp':item.timestamp} for item in pagination.items]
     return render_template('followers.html', user=user, title="Followed by",
                            endpoint = '.followed_by', pagination=pagination, follows=follows)
@@ -236,9 +261,9 @@ def post(id):
     :param id:
     :return:
     """
-    post = Post.query.get_or_404(id)
+    post = get_post_or_404(id)  # falls back to the archive, see app/archive.py
     form = CommentForm()
-    if form.validate_on_submit():
+    if not post.archived and form.validate_on_submit():
         comment = Comment(body = form.body.data,
                           post = post,
                           author = current_user._get_current_object())
@@ -248,11 +273,9 @@ def post(id):
     page = request.args.get('page',1, type=int)
     if page == -1:
         page = (post.comments.count() - 1) / current_app.config['FLASKY_COMMENTS_PER_PAGE'] + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page,
-        per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
-    comments = pagination.items
+    pagination = paginate(post.comments.order_by(comment_model(post).timestamp.asc()), page,
+                          current_app.config['FLASKY_COMMENTS_PER_PAGE'])
+    comments = prefetch_authors(pagination.items)
     return render_template('post.html', posts=[post], form=form,
                            comments = comments, pagination=pagination)
 
@@ -261,15 +284,14 @@ def post(id):
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate():
     page = request.args.get('page',1,type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page,
-        per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
-    comments = pagination.items
+    pagination = paginate(Comment.query.order_by(Comment.timestamp.desc()), page,
+                          current_app.config['FLASKY_COMMENTS_PER_PAGE'])
+    comments = prefetch_authors(pagination.items)
     return render_template('moderate.html', comments=comments,
                            pagination=pagination, page=page)
 
 @main.route('/moderate/enable/<int:id>')
+@use_primary
 @login_required
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate_enable(id):
@@ -286,6 +308,7 @@ def moderate_enable(id):
                             page = request.args.get('page',1,type=int)))
 
 @main.route('/moderate/disable/<int:id>')
+@use_primary
 @login_required
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate_disable(id):
@@ -313,28 +336,3 @@ def server_shutdown():
         abort(500)
     shutdown()
     return 'Shutting down'
-
-@main.after_app_request
-def after_request(response):
-    """
-    Doesn't modify the response, just gets query timings recorded by flask-sqla & logs slow ones.
-    get_debug_queries returns q's issued during request as a list.
-
-    Walks the list & logs any that last longer than our defined time.
-    Logging is issued at the warning level. Changing level to error would cause all slow query occurrences to be emailed
-    as well.
-
-    Get debug queries enabled only in debug by default. But performance issues rare during development since small db's
-    are used. So, it's usefull to have this in production.
-    :param response:
-    :return:
-    """
-    for query in get_debug_queries():
-        if query.duration >= current_app.config['FLASKY_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning(
-                'Slow query: {}\n'
-                'Parameters: {}\n'
-                'Duration: {}\n,'
-                'Context: {}\n'.format(query.statement, query.parameters, query.duration, query.context))
-            # not included: query.start_time, query.end_time
-    return response
\ No newline at end of file
@@ -0,0 +1,248 @@
+__author__ = 'Stuart'
+"""
+Runtime metrics in the Prometheus text format, on FLASKY_METRICS_PATH (/metrics).
+
+Recorded for every request:
+    flasky_http_requests_total{endpoint,method,status}      counter
+    flasky_http_request_duration_seconds{endpoint}          histogram
+    flasky_db_queries_total{endpoint}                       counter, statements sent to any engine
+    flasky_db_query_duration_seconds_total{endpoint}        counter
+    flasky_template_render_seconds{template}                histogram, top level templates only
+    flasky_cache_requests_total{cache,result}               counter, from code calling metrics.cache_hit/miss()
+And by `manage.py scheduler` (app/scheduler.py), for each job it runs:
+    flasky_job_runs_total{job,result}                       counter, result ok or error
+    flasky_job_duration_seconds{job}                        histogram
+Hit ratio of a cache is then rate(...{result="hit"}) / rate(...) on the Prometheus side.
+
+Each gunicorn worker counts in memory, and every FLASKY_METRICS_FLUSH secs (checked at the end of a request) adds
+what it counted since to the totals in the local store (app/localstore.py). Whichever worker answers the scrape
+reads the totals, so the numbers cover all the workers on the host. Everything is stored as plain counters: a
+histogram is one counter per bucket, plus _sum and _count.
+
+If FLASKY_METRICS_TOKEN is set, scrapes need `Authorization: Bearer <token>` (bearer_token in prometheus.yml).
+Without one, only a prometheus on the same host may scrape, everyone else gets a 404. A request that came through a
+proxy (X-Forwarded-For) doesn't count as local, even if the proxy is.
+"""
+
+import hmac
+import os
+import threading
+import time
+from flask import g, request, current_app, has_request_context, Response, abort
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .localstore import get_store
+
+
+STORE_KEY = 'metrics'
+LOCAL_ADDRS = ('127.0.0.1', '::1')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+FAMILIES = {
+    'flasky_http_requests_total': ('counter', 'Requests handled, by endpoint, method and status code'),
+    'flasky_http_request_duration_seconds': ('histogram', 'Time to handle a request, by endpoint'),
+    'flasky_db_queries_total': ('counter', 'SQL statements executed while handling requests, by endpoint'),
+    'flasky_db_query_duration_seconds_total': ('counter', 'Time spent in SQL statements, by endpoint'),
+    'flasky_template_render_seconds': ('histogram', 'Time to render a template, includes extended templates'),
+    'flasky_cache_requests_total': ('counter', 'Cache lookups, by cache and hit/miss'),
+    'flasky_job_runs_total': ('counter', 'Scheduled job runs, by job and ok/error'),
+    'flasky_job_duration_seconds': ('histogram', 'Time a scheduled job took, by job'),
+}
+
+
+def _labels(labels, le=None):
+    """
+    {'a': 'x', 'b': 'y'} -> 'a="x",b="y"', escaped like Prometheus wants. This string is the series key.
+    A histogram bucket's le always goes last, _series_order() relies on it.
+    """
+    pairs = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for k, v in sorted(labels.items())]
+    if le is not None:
+        pairs.append('le="{}"'.format(le))
+    return ','.join(pairs)
+
+
+def _family(name):
+    """
+    flasky_x_bucket -> flasky_x for histograms, other names are their own family.
+    """
+    base, _, suffix = name.rpartition('_')
+    if suffix in ('bucket', 'sum', 'count') and FAMILIES.get(base, ('',))[0] == 'histogram':
+        return base
+    return name
+
+
+class _Registry(object):
+    """
+    What one process counted since its last flush. {(name, labels string): value}
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.values = {}
+        self.lock = threading.Lock()
+        self.flushed = time.time()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def take(self):
+        with self.lock:
+            values, self.values = self.values, {}
+        self.flushed = time.time()
+        return values
+
+
+class TimedTemplate(Template):
+    """
+    jinja_env.template_class, so every render_template() is timed. {% extends %} and {% include %} don't go
+    through render(), their time is part of the template that pulled them in.
+    """
+    def render(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            if has_request_context():
+                current_app.extensions['metrics'].observe(
+                    'flasky_template_render_seconds', time.time() - start, template=self.name or '?')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    start = starts.pop() if starts else time.time()
+    if has_request_context():
+        g.metrics_queries = getattr(g, 'metrics_queries', 0) + 1
+        g.metrics_query_time = getattr(g, 'metrics_query_time', 0.0) + time.time() - start
+
+
+class Metrics(object):
+    """
+    Flask extension, create_app() calls init_app(). The recording methods work on current_app.
+    """
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_METRICS_PATH', '/metrics')
+        app.config.setdefault('FLASKY_METRICS_FLUSH', 5)
+        app.config.setdefault('FLASKY_METRICS_TOKEN', None)
+        app.extensions['metrics'] = self
+        app.jinja_env.template_class = TimedTemplate
+
+        @app.before_request
+        def start_timer():
+            g.metrics_start = time.time()
+
+        @app.after_request
+        def remember_status(response):
+            g.metrics_status = response.status_code
+            return response
+
+        @app.teardown_request
+        def record_request(exc):
+            if not hasattr(g, 'metrics_start'):
+                return
+            endpoint = request.endpoint or 'unknown'
+            status = 500 if exc is not None else getattr(g, 'metrics_status', 500)
+            self.inc('flasky_http_requests_total', endpoint=endpoint, method=request.method, status=status)
+            self.observe('flasky_http_request_duration_seconds', time.time() - g.metrics_start, endpoint=endpoint)
+            self.inc('flasky_db_queries_total', getattr(g, 'metrics_queries', 0), endpoint=endpoint)
+            self.inc('flasky_db_query_duration_seconds_total', getattr(g, 'metrics_query_time', 0.0),
+                     endpoint=endpoint)
+            if time.time() - self._registry(app).flushed > app.config['FLASKY_METRICS_FLUSH']:
+                self.flush(app)
+
+        app.add_url_rule(app.config['FLASKY_METRICS_PATH'], 'metrics', self.scrape)
+
+    def _registry(self, app=None):
+        app = app or current_app
+        registry = app.extensions.get('metrics_registry')
+        if registry is None or registry.pid != os.getpid():  # forked: start from zero, the parent flushes its own
+            registry = app.extensions['metrics_registry'] = _Registry()
+        return registry
+
+    def inc(self, name, amount=1, **labels):
+        self._registry().inc(name, _labels(labels), amount)
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Adds one observation to a histogram. Buckets are cumulative, as Prometheus wants them. Buckets the value
+        doesn't fall in get +0, so every series has all its buckets from the start.
+        """
+        registry = self._registry()
+        for bound in buckets:
+            registry.inc(name + '_bucket', _labels(labels, le=bound), 1 if value <= bound else 0)
+        registry.inc(name + '_bucket', _labels(labels, le='+Inf'))
+        registry.inc(name + '_sum', _labels(labels), value)
+        registry.inc(name + '_count', _labels(labels))
+
+    def cache_hit(self, cache):
+        self.inc('flasky_cache_requests_total', cache=cache, result='hit')
+
+    def cache_miss(self, cache):
+        self.inc('flasky_cache_requests_total', cache=cache, result='miss')
+
+    def flush(self, app=None):
+        """
+        Adds this process' counts to the totals in the local store.
+        """
+        app = app or current_app
+        values = self._registry(app).take()
+        if not values:
+            return
+
+        def merge(totals):
+            totals = totals or {}
+            for (name, labels), amount in values.items():
+                series = totals.setdefault(name, {})
+                series[labels] = series.get(labels, 0) + amount
+            return totals, None
+        get_store(app).update(STORE_KEY, merge)
+
+    def totals(self, app=None):
+        """
+        {metric name: {labels string: value}} for all workers, including this one's latest counts.
+        """
+        app = app or current_app
+        self.flush(app)
+        return get_store(app).get(STORE_KEY, {})
+
+    def render(self, totals):
+        lines = []
+        for family in sorted(set(_family(name) for name in totals)):
+            kind, help_text = FAMILIES.get(family, ('untyped', ''))
+            if help_text:
+                lines.append('# HELP {} {}'.format(family, help_text))
+            lines.append('# TYPE {} {}'.format(family, kind))
+            names = [family + suffix for suffix in ('_bucket', '_sum', '_count')] if kind == 'histogram' else [family]
+            for name in names:
+                for labels, value in sorted(totals.get(name, {}).items(), key=_series_order):
+                    lines.append('{}{{{}}} {}'.format(name, labels, value) if labels else '{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def scrape(self):
+        token = current_app.config['FLASKY_METRICS_TOKEN']
+        if not token and (request.remote_addr not in LOCAL_ADDRS or 'X-Forwarded-For' in request.headers):
+            abort(404)
+        if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                             ('Bearer ' + token).encode('utf-8')):  # in constant time
+            abort(403)
+        return Response(self.render(self.totals()), mimetype='text/plain; version=0.0.4')
+
+
+def _series_order(item):
+    """
+    Keeps histogram buckets in increasing order of le within a series, +Inf last.
+    """
+    labels = item[0]
+    if not labels.endswith('"') or 'le="' not in labels:
+        return labels, 0
+    rest, _, le = labels.rpartition('le="')
+    le = le[:-1]
+    return rest, float('inf') if le == '+Inf' else float(le)
@@ -3,13 +3,71 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask.ext.login import UserMixin, AnonymousUserMixin
 from flask import current_app, request, url_for
-from markdown import markdown
-import bleach
 import datetime
 import hashlib
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 from . import db, login_manager
 from app.exceptions import ValidationError
 
+
+# HTML tags that survive in rendered bodies. Change these and run `python manage.py rerender` to bring the body_html
+# of existing rows in line, see app/rerender.py
+POST_ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+                     'h1', 'h2', 'h3', 'p']
+COMMENT_ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']  # comments are shorter, fewer tags
+
+
+def render_body(body, allowed_tags):
+    """
+    Markdown body -> the HTML we store in body_html.
+    1) markdown() does initial conversion to html.
+    2) result passed to clean() plus list of allowed HTML tags. Removes any tags not approved.
+    3) linkify converts any URLs written in plaintext to <a> links. Automatic link generation isn't officially
+    included in Markdown specs. Pagedown supportsit as an extension, so linkify() used in the server
+    to match.
+
+    markdown and bleach are imported here rather than at the top: they take a while to import and most processes
+    (the outbox worker, most manage.py commands) never render a body. Imported once, then it's a dict lookup.
+    """
+    if body is None:
+        return None
+    from markdown import markdown
+    import bleach
+    return bleach.linkify(bleach.clean(markdown(body, output_format='html'), tags=allowed_tags, strip=True))
+
+
+def prefetch_authors(items):
+    """
+    Loads the authors of a page of posts or comments in one query, instead of one per author as each item.author is
+    touched while rendering. The users are put straight on the items' author attribute, so nothing lazy loads later.
+    :param items: posts or comments
+    :return: items
+    """
+    ids = set(item.author_id for item in items if 'author' not in item.__dict__ and item.author_id is not None)
+    users = {}
+    for id in ids:  # e.g. the user whose profile page this is, or current_user
+        user = db.session.identity_map.get(identity_key(User, id))
+        if user is not None:
+            users[id] = user
+    missing = ids.difference(users)
+    if missing:
+        users.update((u.id, u) for u in User.query.filter(User.id.in_(missing)))
+    for item in items:
+        if item.author_id in users:
+            set_committed_value(item, 'author', users[item.author_id])
+    return items
+
+def pick_fields(fields, getters):
+    """
+    For to_json(fields): only the getters of the wanted fields are called, so a field the client didn't ask for costs
+    no query and no url_for.
+    :param fields: set of field names, None for all of them
+    :param getters: [(name, function returning the value)]
+    :return: dict
+    """
+    return dict((name, get()) for name, get in getters if fields is None or name in fields)
+
 class Follow(db.Model):
     """
     Association table that includes timestamp. The many-many relationship must be decomped into 2 1-many relats for
@@ -23,16 +81,13 @@ class Follow(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
 
-class Post(db.Model):
-    __tablename__ = 'posts'
-    id = db.Column(db.Integer, primary_key=True)
-    body = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    body_html = db.Column(db.Text)
-    comments = db.relationship('Comment', backref='post', lazy='dynamic')
+class PostMixin(object):
+    """
+    What Post and ArchivedPost have in common, besides the columns.
+    """
+    JSON_FIELDS = ('url', 'body', 'body_html', 'timestamp', 'author', 'comments', 'comment_count')
 
-    def to_json(self):
+    def to_json(self, fields=None):
         """
         When writing a web service, frequently need to convert internal repr of resource to/from JSON.
         url, author, comments need to return URLs for their resources. The routes defined in API blueprint.
@@ -40,19 +95,68 @@ class Post(db.Model):
 
         This shows it's possible to return 'made up' attrs in representation of a resource. Comment_count returns
         num comments that exist for post, even though that isn't a real attribute. It's conveneint for client.
+        :param fields: only these of JSON_FIELDS, e.g. from ?fields=url,body_html. None for all
         :return:
         """
-        json_post = {
-            'url':url_for('api.get_post', id=self.id, _external=True),
-            'body': self.body,
-            'body_html': self.body_html,
-            'timestamp': self.timestamp,
-            'author': url_for('api.get_user', id=self.author_id, _external=True),
-            'comments': url_for('api.get_post_comments', id=self.id, _external=True),
-            'comment_count': self.comments.count()
-        }
+        json_post = pick_fields(fields, [
+            ('url', lambda: url_for('api.get_post', id=self.id, _external=True)),
+            ('body', lambda: self.body),
+            ('body_html', lambda: self.body_html),
+            ('timestamp', lambda: self.timestamp),
+            ('author', lambda: url_for('api.get_user', id=self.author_id, _external=True)),
+            ('comments', lambda: url_for('api.get_post_comments', id=self.id, _external=True)),
+            ('comment_count', lambda: self.comment_count)
+        ])
         return json_post
 
+    @property
+    def comment_count(self):
+        """
+        From prefetch() if it ran for this post, otherwise a COUNT query of its own.
+        """
+        count = self.__dict__.get('_comment_count')
+        if count is None:
+            count = self.comments.count()
+        return count
+
+
+class Post(db.Model, PostMixin):
+    __tablename__ = 'posts'
+    __table_args__ = {'sqlite_autoincrement': True}  # never hand out an id again once archive.py moved it away
+    id = db.Column(db.Integer, primary_key=True)
+    body = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    body_html = db.Column(db.Text)
+    comments = db.relationship('Comment', backref='post', lazy='dynamic')
+    archived = False
+
+    @staticmethod
+    def prefetch(posts):
+        """
+        Everything _posts.html and to_json() touch on a page of posts, in 2 queries whatever the page size: the
+        authors and the comment counts. Without it each post costs a COUNT and, per new author, a SELECT.
+        :param posts: list of Post
+        :return: posts
+        """
+        prefetch_authors(posts)
+        return Post.prefetch_comment_counts(posts)
+
+    @staticmethod
+    def prefetch_comment_counts(posts):
+        """
+        Just the comment counts, for the API where authors are only urls.
+        :param posts: list of Post
+        :return: posts
+        """
+        ids = [post.id for post in posts]
+        if ids:
+            counts = dict(db.session.query(Comment.post_id, db.func.count(Comment.id)).
+                          filter(Comment.post_id.in_(ids)).group_by(Comment.post_id))
+            for post in posts:
+                post._comment_count = counts.get(post.id, 0)
+        return posts
+
     @staticmethod
     def from_json(json_post):
         """
@@ -95,20 +199,9 @@ class Post(db.Model):
     @staticmethod
     def on_changed_body(target,value, oldvalue, initiator):
         """
-        Renders HTML vers of body and stores in body_html, making conversion automatic
-        1) markdown() does initial conversion to html.
-        2) result passed to clean() plus list of allowed HTML tags. Removes any tags not approved.
-        3) linkify converts any URLs written in plaintext to <a> links. Automatic link generation isn't officially
-        included in Markdown specs. Pagedown supportsit as an extension, so linkify() used in the server
-        to match.
-        4)replaces post.body with post.body_html
-        """
-        allowed_tags = ['a','abbr','acronym','b','blockquote','code','em',
-                        'i','li','ol','pre','strong','ul','h1','h2','h3','p']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value,output_format='html'),
-            tags = allowed_tags, strip=True
-        ))
+        Renders HTML vers of body and stores in body_html, making conversion automatic. See render_body().
+        """
+        target.body_html = render_body(value, POST_ALLOWED_TAGS)
 
 db.event.listen(Post.body,'set',Post.on_changed_body)  # regist'd as listener of SQLAlch's 'set' event for body. It will
     # automatically be invoked whenever the body field on any instance of the class is set to a new value
@@ -349,7 +442,11 @@ class User(db.Model, UserMixin):
         :param password:
         :return:
         """
-        self.password_hash = generate_password_hash(password)
+        method = current_app.config.get('FLASKY_PASSWORD_HASH_METHOD') if current_app else None
+        if method:
+            self.password_hash = generate_password_hash(password, method)
+        else:
+            self.password_hash = generate_password_hash(password)
 
     def verify_password(self,password):
         """
@@ -453,21 +550,50 @@ class User(db.Model, UserMixin):
                 db.session.add(user)
                 db.session.commit()
 
-    def to_json(self):
+    JSON_FIELDS = ('url', 'username', 'member_since', 'last_seen', 'posts', 'followed_posts', 'post_count')
+
+    def to_json(self, fields=None):
         """
         Omit email and role for privacy.
-        """
-        json_user = {
-            'url':url_for('api.get_user', id=self.id, _external=True),  # may be api.get_post
-            'username': self.username,
-            'member_since': self.member_since,
-            'last_seen': self.last_seen,
-            'posts': url_for('api.get_user_posts', id=self.id, _external=True),
-            'followed_posts': url_for('api.get_user_followed_posts', id=self.id, _external=True),
-            'post_count': self.posts.count()
-        }
+        :param fields: only these of JSON_FIELDS, None for all
+        """
+        json_user = pick_fields(fields, [
+            ('url', lambda: url_for('api.get_user', id=self.id, _external=True)),  # may be api.get_post
+            ('username', lambda: self.username),
+            ('member_since', lambda: self.member_since),
+            ('last_seen', lambda: self.last_seen),
+            ('posts', lambda: url_for('api.get_user_posts', id=self.id, _external=True)),
+            ('followed_posts', lambda: url_for('api.get_user_followed_posts', id=self.id, _external=True)),
+            ('post_count', lambda: self.post_count)
+        ])
         return json_user
 
+    @property
+    def post_count(self):
+        """
+        From prefetch() if it ran for this user, otherwise a COUNT query of its own.
+        """
+        count = self.__dict__.get('_post_count')
+        if count is None:
+            count = self.posts.count()
+        return count
+
+    @staticmethod
+    def prefetch(users):
+        """
+        The post counts of a list of users in one query, for to_json() on each, e.g. the expanded authors of a page of
+        posts in the API.
+        :param users: list of User
+        :return: users
+        """
+        ids = [user.id for user in users]
+        if ids:
+            counts = dict(db.session.query(Post.author_id, db.func.count(Post.id)).
+                          filter(Post.author_id.in_(ids)).group_by(Post.author_id))
+            for user in users:
+                user._post_count = counts.get(user.id, 0)
+        return users
+
     @staticmethod
     def generate_fake(count=100):
         """
@@ -511,12 +637,32 @@ login_manager.anonymous_user = AnonymousUser
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-class Comment(db.Model):
+class CommentMixin(object):
+    """
+    What Comment and ArchivedComment have in common, besides the columns.
+    """
+    JSON_FIELDS = ('url', 'post', 'body', 'body_html', 'timestamp', 'author')
+
+    def to_json(self, fields=None):
+        json_comment = pick_fields(fields, [
+            ('url', lambda: url_for('api.get_comment', id=self.id, _external=True)),
+            ('post', lambda: url_for('api.get_post', id=self.post_id, _external=True)),
+            ('body', lambda: self.body),
+            ('body_html', lambda: self.body_html),
+            ('timestamp', lambda: self.timestamp),
+            ('author', lambda: url_for('api.get_user', id=self.author_id,
+                                       _external=True)),
+        ])
+        return json_comment
+
+
+class Comment(db.Model, CommentMixin):
     """
     Nearly same as Post.
     Disabled field is boolean used by mods to suppress offensive/inappropriate comments.
     """
     __tablename__ = 'comments'
+    __table_args__ = {'sqlite_autoincrement': True}  # see Post
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
@@ -525,18 +671,6 @@ class Comment(db.Model):
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
 
-    def to_json(self):
-        json_comment = {
-            'url': url_for('api.get_comment', id=self.id, _external=True),
-            'post': url_for('api.get_post', id=self.post_id, _external=True),
-            'body': self.body,
-            'body_html': self.body_html,
-            'timestamp': self.timestamp,
-            'author': url_for('api.get_user', id=self.author_id,
-                              _external=True),
-        }
-        return json_comment
-
     @staticmethod
     def from_json(json_comment):
         body = json_comment.get('body')
@@ -551,9 +685,82 @@ class Comment(db.Model):
         Fewer tags allowed than in a Post, since they tend to be shorter.
         :return:
         """
-        allowed_tags = ['a','abbr','acronym','b','code','em','i','strong']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value,output_format = 'html'),
-            tags = allowed_tags, strip=True
-        ))
-db.event.listen(Comment.body, 'set', Comment.on_changed_body)
\ No newline at end of file
+        target.body_html = render_body(value, COMMENT_ALLOWED_TAGS)
+db.event.listen(Comment.body, 'set', Comment.on_changed_body)
+
+
+class ArchivedPost(db.Model, PostMixin):
+    """
+    Posts older than FLASKY_ARCHIVE_AFTER_DAYS, moved out of posts by `manage.py archive` (see app/archive.py), with
+    all their comments. Same columns and ids as in posts, so permalinks and API urls keep working. Read only: no
+    body event, no edits, no new comments.
+    """
+    __tablename__ = 'posts_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    body = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    body_html = db.Column(db.Text)
+    archived_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    author = db.relationship('User')  # no backref, User.posts is the hot posts only
+    comments = db.relationship('ArchivedComment', backref='post', lazy='dynamic')
+    archived = True
+
+
+class ArchivedComment(db.Model, CommentMixin):
+    """
+    Comments of archived posts, see ArchivedPost.
+    """
+    __tablename__ = 'comments_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    body = db.Column(db.Text)
+    body_html = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime)
+    disabled = db.Column(db.Boolean)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    post_id = db.Column(db.Integer, db.ForeignKey('posts_archive.id'), index=True)
+    archived_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    author = db.relationship('User')
+
+
+class Outbox(db.Model):
+    """
+    Side effects (emails etc) waiting to be carried out by the `manage.py worker` process. A row is added in the same
+    db transaction as the change that caused it (see app/outbox.py), so either both are committed or neither is.
+    locked_until is the lease a worker takes on a row while it works on it. If the worker dies, the lease runs out
+    and another worker picks the row up again.
+    """
+    __tablename__ = 'outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64))  # which handler runs it, e.g. 'email'
+    payload = db.Column(db.Text)  # JSON
+    status = db.Column(db.String(16), default='pending', index=True)  # pending, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    locked_until = db.Column(db.DateTime)
+    done_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    def __repr__(self):
+        return '<Outbox {} {} {}>'.format(self.id, self.kind, self.status)
+
+class ScheduledJob(db.Model):
+    """
+    Schedule and lock of one periodic job of `manage.py scheduler` (app/scheduler.py). Every scheduler process goes by
+    the same row, so however many are running, a job runs once per due time: the one that sets locked_until first
+    runs it, and sets next_run_at when it's done. If that process dies, the lock runs out and another one takes over.
+    """
+    __tablename__ = 'scheduled_jobs'
+    name = db.Column(db.String(128), primary_key=True)  # job name, plus @host for jobs run on every host
+    schedule = db.Column(db.String(64))  # as registered, a change resets next_run_at
+    next_run_at = db.Column(db.DateTime)
+    locked_until = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(128))  # host:pid
+    last_started_at = db.Column(db.DateTime)
+    last_duration = db.Column(db.Float)  # secs
+    last_error = db.Column(db.Text)  # None if the last run went fine
+    runs = db.Column(db.Integer, default=0)
+
+    def __repr__(self):
+        return '<ScheduledJob {} {}>'.format(self.name, self.next_run_at)
@@ -0,0 +1,157 @@
+__author__ = 'Stuart'
+"""
+Transactional outbox.
+
+Instead of doing a side effect (sending an email...) in the middle of a request, the view calls enqueue(), which
+just adds an Outbox row to the current db session. It gets committed together with whatever the request changed, so
+a user is never created without their confirmation email being on its way, and an email never goes out for a user
+that got rolled back. The request doesn't wait on SMTP at all.
+
+`manage.py worker` runs run_worker(), which keeps draining the table: it claims a batch of due rows by taking a lease
+on them, runs their handlers on a small thread pool, and records the outcome. Failures are retried with exponential
+backoff until FLASKY_OUTBOX_MAX_ATTEMPTS, then the row is left as 'failed' for a human to look at.
+
+Delivery is at-least-once: if the worker dies after the handler ran but before it recorded that, the lease expires and
+the row gets run again. Handlers should be ok with that (an email sent twice is acceptable, a double charge isn't).
+
+To add a new kind of side effect:
+    @outbox.handler('thumbnail')
+    def make_thumbnail(image_id):
+        ...
+    outbox.enqueue('thumbnail', image_id=image.id)
+Payloads go through JSON, so keyword args must be JSON-able.
+"""
+
+import datetime
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import or_
+from . import db, scheduler
+from .models import Outbox
+
+_handlers = {}
+
+
+def handler(kind):
+    """
+    Registers the function that carries out outbox rows of the given kind. It is called with the payload as keyword
+    arguments, inside an app context. Raising means failure and the row will be retried.
+    """
+    def decorator(f):
+        _handlers[kind] = f
+        return f
+    return decorator
+
+
+def enqueue(kind, **payload):
+    """
+    Adds a side effect to the current db session. Doesn't commit: it goes out with the rest of the transaction.
+    :return: the Outbox row
+    """
+    message = Outbox(kind=kind, payload=json.dumps(payload))
+    db.session.add(message)
+    return message
+
+
+def claim_batch(size, lease):
+    """
+    Takes a lease on up to `size` rows that are due. The conditional UPDATE is what makes this safe with several
+    workers: if another worker got a row between our SELECT and UPDATE, rowcount is 0 and we skip it.
+    The attempt is counted here rather than after running, so a row that crashes the worker still gets retired
+    eventually.
+    """
+    now = datetime.datetime.utcnow()
+    not_leased = or_(Outbox.locked_until == None, Outbox.locked_until < now)
+    candidates = db.session.query(Outbox.id).filter(
+        Outbox.status == 'pending', Outbox.next_attempt_at <= now, not_leased).order_by(
+        Outbox.next_attempt_at).limit(size).all()
+    claimed = []
+    for (id,) in candidates:
+        result = db.session.execute(Outbox.__table__.update().where(Outbox.id == id).where(
+            Outbox.status == 'pending').where(not_leased).values(
+            locked_until=now + datetime.timedelta(seconds=lease), attempts=Outbox.attempts + 1))
+        if result.rowcount == 1:
+            claimed.append(id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return Outbox.query.filter(Outbox.id.in_(claimed)).order_by(Outbox.id).all()
+
+
+def _run(app, kind, payload):
+    with app.app_context():
+        _handlers[kind](**payload)
+
+
+def _record_failure(message, error):
+    config = current_app.config
+    message.last_error = '{}: {}'.format(type(error).__name__, error)
+    message.locked_until = None
+    if message.attempts >= config['FLASKY_OUTBOX_MAX_ATTEMPTS']:
+        message.status = 'failed'
+        current_app.logger.error('Outbox message {} ({}) failed for good: {}'.format(
+            message.id, message.kind, message.last_error))
+    else:
+        delay = min(config['FLASKY_OUTBOX_RETRY_DELAY'] * 2 ** (message.attempts - 1), 3600)
+        message.next_attempt_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+
+
+def drain_once(executor):
+    """
+    Claims one batch, runs it on the executor and records the results in a single commit.
+    Must be called inside an app context.
+    :return: number of rows processed, 0 when there was nothing due
+    """
+    app = current_app._get_current_object()
+    messages = claim_batch(app.config['FLASKY_OUTBOX_BATCH'], app.config['FLASKY_OUTBOX_LEASE'])
+    futures = [(message, executor.submit(_run, app, message.kind, json.loads(message.payload)))
+               for message in messages]
+    for message, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            _record_failure(message, e)
+        else:
+            message.status = 'done'
+            message.done_at = datetime.datetime.utcnow()
+            message.locked_until = None
+            message.last_error = None
+    db.session.commit()
+    return len(messages)
+
+
+def run_worker(app, concurrency=None, poll_interval=1.0, once=False):
+    """
+    Worker loop. Runs until interrupted, or with once=True until nothing is due.
+    concurrency caps how many handlers run at the same time in this process (so we don't open 50 SMTP connections).
+    """
+    concurrency = concurrency or app.config['FLASKY_OUTBOX_CONCURRENCY']
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            with app.app_context():
+                try:
+                    processed = drain_once(executor)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('Outbox worker error, retrying shortly')
+                    processed = 0
+                finally:
+                    db.session.remove()
+            if processed == 0:
+                if once:
+                    return
+                time.sleep(poll_interval)
+
+
+@scheduler.job('purge-outbox', cron='15 4 * * *', jitter=600)
+def purge(days=7):
+    """
+    Deletes rows that were done more than `days` ago. Failed rows are kept until someone deals with them.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    deleted = Outbox.query.filter(Outbox.status == 'done', Outbox.done_at < cutoff).delete(
+        synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,113 @@
+__author__ = 'Stuart'
+"""
+paginate(query, page, per_page) for the listings of main/views.py and the API, instead of Flask-SQLAlchemy's
+query.paginate(), which runs a separate SELECT COUNT(*) on every page just for pagination.total.
+
+How the total is got depends on the mode, FLASKY_PAGE_TOTALS by default:
+    exact: folded into the page query as COUNT(*) OVER (), so one round trip instead of two. The db still counts
+    every matching row, but the count is always right. dbs without window functions (sqlite before 3.25) get the
+    separate COUNT
+    cached: the separate COUNT, but its result is kept in the local store for FLASKY_PAGE_TOTALS_TTL secs per query
+    (and parameters), so a popular listing is counted once per TTL on each host. The total can be that many secs
+    stale, which the page widget and "N comments" can live with
+    none: no total at all. One row more than the page is fetched to know if there is a next page. pagination.total
+    and the API's count are None, and the page widget only offers the pages up to the next one
+API clients pick with ?count=exact|cached|none, see count_arg().
+"""
+
+import hashlib
+from flask import current_app, request
+from flask.ext.sqlalchemy import Pagination
+from . import db
+from .exceptions import ValidationError
+from .localstore import get_store
+
+EXACT, CACHED, NONE = 'exact', 'cached', 'none'
+MODES = (EXACT, CACHED, NONE)
+TOTAL_KEY = 'total:{}'
+
+
+class Page(Pagination):
+    """
+    Pagination that may not know its total (mode none): then has_next comes from the extra row and pages stops at
+    the next page.
+    """
+    def __init__(self, query, page, per_page, total, items, more=None):
+        super(Page, self).__init__(query, page, per_page, total, items)
+        self.more = more
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return self.page + 1 if self.more else self.page
+        return super(Page, self).pages
+
+    @property
+    def has_next(self):
+        if self.total is None:
+            return self.more
+        return super(Page, self).has_next
+
+
+def _window_functions():
+    dialect = db.engine.dialect
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 25)
+    return dialect.name in ('postgresql', 'oracle', 'mssql')
+
+
+def count(query):
+    return query.order_by(None).count()
+
+
+def cached_count(query):
+    """
+    count(query), from the local store if it was counted less than FLASKY_PAGE_TOTALS_TTL secs ago.
+    """
+    compiled = query.order_by(None).statement.compile()
+    key = TOTAL_KEY.format(hashlib.sha1((str(compiled) + repr(sorted(compiled.params.items())))
+                                        .encode('utf-8')).hexdigest())
+    store = get_store(current_app._get_current_object())
+    total = store.get(key)
+    if total is None:
+        total = count(query)
+        store.set(key, total, ttl=current_app.config['FLASKY_PAGE_TOTALS_TTL'])
+    return total
+
+
+def paginate(query, page, per_page, mode=None):
+    """
+    :param query: ordered query of one model
+    :param page: 1 based, anything below is page 1
+    :param mode: exact, cached or none, defaults to FLASKY_PAGE_TOTALS
+    :return: Page, with the same attributes as query.paginate()'s Pagination
+    """
+    mode = mode or current_app.config['FLASKY_PAGE_TOTALS']
+    page = max(page, 1)
+    offset = (page - 1) * per_page
+    if mode == NONE:
+        items = query.limit(per_page + 1).offset(offset).all()
+        return Page(query, page, per_page, None, items[:per_page], more=len(items) > per_page)
+    if mode == EXACT and _window_functions():
+        rows = query.add_columns(db.func.count().over()).limit(per_page).offset(offset).all()
+        if rows:
+            return Page(query, page, per_page, rows[0][-1], [row[0] for row in rows])
+        return Page(query, page, per_page, count(query) if page > 1 else 0, [])  # past the end, no row to tell
+    items = query.limit(per_page).offset(offset).all()
+    if mode == CACHED:
+        total = cached_count(query)
+    elif page == 1 and len(items) < per_page:
+        total = len(items)  # it all fit on the first page
+    else:
+        total = count(query)
+    return Page(query, page, per_page, total, items)
+
+
+def count_arg():
+    """
+    For the API: the mode in ?count=, None (the default) if there is none. ValidationError (400) for anything else.
+    """
+    mode = request.args.get('count')
+    if mode and mode not in MODES:
+        raise ValidationError('count must be one of ' + ', '.join(MODES))
+    return mode or None
@@ -0,0 +1,61 @@
+__author__ = 'Stuart'
+"""
+Admission control building blocks: token buckets for rate limiting and a gate for capping concurrent requests.
+Used by the API blueprint, see app/api_1_0/admission.py.
+"""
+
+import threading
+import time
+
+
+class TokenBucketLimiter(object):
+    """
+    One bucket per (client, endpoint class). A bucket holds up to `burst` tokens and refills at `rate` tokens a
+    second; every request takes one. So a client can fire `burst` requests at once, then settles at `rate` per second.
+    Buckets live in a local store (app/localstore.py), so with the sqlite store all gunicorn workers on the host
+    draw from the same bucket and a client can't get N times the limit by landing on N workers.
+    """
+    def __init__(self, store, rules):
+        """
+        :param store: MemoryStore or SQLiteStore
+        :param rules: {endpoint_class: (rate, burst)}. Classes not in here are unlimited
+        """
+        self.store = store
+        self.rules = rules
+
+    def hit(self, client, endpoint_class):
+        """
+        Takes a token if there is one.
+        :return: (allowed, seconds until a token will be available)
+        """
+        rule = self.rules.get(endpoint_class)
+        if rule is None:
+            return True, 0
+        rate, burst = rule
+
+        def take(state):
+            now = time.time()
+            tokens, stamp = state if state is not None else (burst, now)
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens >= 1:
+                return [tokens - 1, now], (True, 0)
+            return [tokens, now], (False, (1 - tokens) / rate)
+
+        # a bucket left alone for burst/rate secs is full again, same as no bucket at all, so let it expire
+        return self.store.update('ratelimit:{}:{}'.format(endpoint_class, client), take, ttl=burst / rate + 1)
+
+
+class ConcurrencyGate(object):
+    """
+    Caps requests in progress in this process. try_enter() never waits: when we are full it is better to tell the
+    client to come back than to queue it behind everyone else and time out anyway.
+    """
+    def __init__(self, limit):
+        self._semaphore = threading.BoundedSemaphore(limit) if limit else None
+
+    def try_enter(self):
+        return self._semaphore is None or self._semaphore.acquire(False)
+
+    def leave(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
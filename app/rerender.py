@@ -0,0 +1,124 @@
+__author__ = 'Stuart'
+"""
+Bulk re-rendering of body_html, for `python manage.py rerender` after a change to POST_ALLOWED_TAGS /
+COMMENT_ALLOWED_TAGS (or to markdown/bleach).
+
+Loading every Post as an ORM object and setting its body again works, but it is slow three times over: full
+objects with change tracking, markdown rendering on one core, and one UPDATE per row. Here:
+    rows are read as plain (id, body, body_html) tuples, `chunk` at a time, by id (WHERE id > last ORDER BY id
+    LIMIT n), so memory stays flat and every chunk is a cheap index range scan
+    chunks are rendered in a pool of processes, a few chunks in flight per process so the pool never waits on the db
+    only rows whose HTML actually changed are written, with one executemany UPDATE and one commit per chunk, and
+    only if their body is still the one rendered: a row edited meanwhile already got its new HTML from the edit
+After each commit the last id done is saved in the local store, until the run completes. `rerender --resume`
+starts after it, so an interrupted run loses at most the chunks that were in flight.
+"""
+
+import multiprocessing
+from collections import deque
+from sqlalchemy import bindparam, select
+from . import db
+from .database import _is_memory_sqlite
+from .localstore import get_store
+from .models import Post, Comment, POST_ALLOWED_TAGS, COMMENT_ALLOWED_TAGS, render_body
+
+
+MODELS = {
+    'posts': (Post, POST_ALLOWED_TAGS),
+    'comments': (Comment, COMMENT_ALLOWED_TAGS),
+}
+CHECKPOINT_KEY = 'rerender:{}'
+
+
+def render_chunk(args):
+    """
+    Runs in the pool. Gets plain tuples, returns plain tuples: nothing to do with the db or the session.
+    :return: (last id of the chunk, rows seen, [(id, body, new html)] for the rows whose html changed)
+    """
+    rows, allowed_tags = args
+    changed = []
+    for id, body, body_html in rows:
+        html = render_body(body, allowed_tags)
+        if html != body_html:
+            changed.append((id, body, html))
+    return rows[-1][0], len(rows), changed
+
+
+def _chunks(table, start_id, chunk):
+    last = start_id
+    while True:
+        rows = db.session.execute(select([table.c.id, table.c.body, table.c.body_html]).
+                                  where(table.c.id > last).order_by(table.c.id).limit(chunk)).fetchall()
+        db.session.commit()  # don't sit in a read transaction while the pool works
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield [tuple(row) for row in rows]
+
+
+def rerender(app, name, start_id=0, chunk=500, processes=None, progress=None):
+    """
+    :param name: 'posts' or 'comments'
+    :param start_id: only rows with a greater id
+    :param processes: size of the pool, default one per CPU. 1 renders in this process
+    :param progress: called after every chunk with (rows done, rows total, rows changed, last id)
+    :return: (rows done, rows changed)
+    """
+    model, allowed_tags = MODELS[name]
+    table = model.__table__
+    update = table.update().where(table.c.id == bindparam('row_id')).where(table.c.body == bindparam('old_body')).\
+        values(body_html=bindparam('html'))
+    total = db.session.query(db.func.count(table.c.id)).filter(table.c.id > start_id).scalar()
+    store = get_store(app)
+    done = changed = 0
+
+    def write(result):
+        last_id, seen, rows = result
+        written = 0
+        if rows:
+            result = db.session.execute(update, [{'row_id': id, 'old_body': body, 'html': html}
+                                                 for id, body, html in rows])
+            written = result.rowcount if db.engine.dialect.supports_sane_multi_rowcount else len(rows)
+        db.session.commit()
+        store.set(CHECKPOINT_KEY.format(name), last_id)
+        return last_id, seen, written
+
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1:
+        pool = None
+    else:
+        if not _is_memory_sqlite(db.engine.url):  # an in-memory db would go with its connection
+            db.engine.dispose()  # the children get a copy of the pool's connections otherwise
+        pool = multiprocessing.Pool(processes)
+    try:
+        in_flight = deque()
+        chunks = _chunks(table, start_id, chunk)
+        while True:
+            for rows in chunks:
+                if pool is None:
+                    in_flight.append(render_chunk((rows, allowed_tags)))
+                    break
+                in_flight.append(pool.apply_async(render_chunk, ((rows, allowed_tags),)))
+                if len(in_flight) >= processes * 2:
+                    break
+            if not in_flight:
+                break
+            result = in_flight.popleft()  # oldest first, so the checkpoint only ever moves past finished rows
+            last_id, seen, n = write(result if pool is None else result.get())
+            done += seen
+            changed += n
+            if progress:
+                progress(done, total, changed, last_id)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    store.delete(CHECKPOINT_KEY.format(name))  # finished, a later --resume starts from the beginning
+    return done, changed
+
+
+def checkpoint(app, name):
+    """
+    Last id a previous run finished, 0 if none.
+    """
+    return get_store(app).get(CHECKPOINT_KEY.format(name), 0)
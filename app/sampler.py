@@ -0,0 +1,205 @@
+__author__ = 'Stuart'
+"""
+Statistical profiler that is cheap enough to leave on in production.
+
+`manage.py profile` uses werkzeug's ProfilerMiddleware, which traces every function call of every request. That
+makes requests several times slower, so it is for the dev server only. This instead picks a fraction of requests, and
+while one of them runs a background thread looks at its stack every FLASKY_SAMPLER_INTERVAL secs
+(sys._current_frames()). Functions that show up in many samples are where the time goes. The request thread itself
+does no extra work beyond two dict operations, so the overhead is the sampling thread's, roughly
+(frames in the stack) per tick.
+
+Samples are counted per endpoint as "collapsed stacks", one line per distinct stack:
+    main.index;flask.app:full_dispatch_request;app.main.views:index;sqlalchemy.orm.query:all 42
+which is the format flamegraph.pl, speedscope and friends read. Each worker adds its counts to the local store
+(app/localstore.py) every FLASKY_SAMPLER_FLUSH secs, so `manage.py sampler export` sees all the workers on the host.
+
+Turn it on and off without a restart with `manage.py sampler start --rate 0.05` / `manage.py sampler stop`, which set
+the rate in the local store. Workers pick it up within FLASKY_SAMPLER_POLL secs. Only works across processes with the
+sqlite local store, of course.
+
+One sampling thread per process looks at OS threads. With gevent workers, all requests share one thread and we
+only ever see the greenlet that is running, so samples can land on the wrong endpoint. Use it with sync workers.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from flask import request
+from .localstore import get_store
+
+
+RATE_KEY = 'sampler:rate'
+STACKS_PREFIX = 'sampler:stacks:'
+
+
+def collapse(frame, limit=100):
+    """
+    'module:function' names from the outermost frame to `frame`, joined with ';'.
+    """
+    names = []
+    while frame is not None and len(names) < limit:
+        names.append('{}:{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _State(object):
+    """
+    Per app and process: which threads are being sampled, and what we counted since the last flush.
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.active = {}  # thread ident -> endpoint
+        self.counts = {}  # endpoint -> Counter of collapsed stacks
+        self.lock = threading.Lock()
+        self.thread = None
+        self.rate = 0.0
+        self.rate_checked = 0
+
+
+class StackSampler(object):
+    """
+    Flask extension, create_app() calls init_app().
+    """
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_SAMPLER_RATE', 0.0)
+        app.config.setdefault('FLASKY_SAMPLER_INTERVAL', 0.01)
+        app.config.setdefault('FLASKY_SAMPLER_FLUSH', 10)
+        app.config.setdefault('FLASKY_SAMPLER_POLL', 5)
+        app.extensions['sampler'] = _State()
+
+        @app.before_request
+        def start_sampling():
+            state = self._state(app)
+            if random.random() < self.rate(app, state):
+                state.active[threading.current_thread().ident] = request.endpoint or 'unknown'
+                self._ensure_thread(app, state)
+
+        @app.teardown_request
+        def stop_sampling(exc):
+            self._state(app).active.pop(threading.current_thread().ident, None)
+
+    def _state(self, app):
+        state = app.extensions['sampler']
+        if state.pid != os.getpid():  # forked: threads don't survive a fork, and the counts are the parent's
+            state = app.extensions['sampler'] = _State()
+        return state
+
+    def rate(self, app, state=None):
+        """
+        Fraction of requests to sample. From the local store if someone ran `manage.py sampler start`, else the config.
+        """
+        state = state or self._state(app)
+        now = time.time()
+        if now - state.rate_checked > app.config['FLASKY_SAMPLER_POLL']:
+            state.rate_checked = now
+            state.rate = get_store(app).get(RATE_KEY, app.config['FLASKY_SAMPLER_RATE'])
+        return state.rate
+
+    def _ensure_thread(self, app, state):
+        if state.thread is not None:
+            return
+        with state.lock:
+            if state.thread is None:
+                state.thread = threading.Thread(target=self._run, args=(app, state), name='stack-sampler')
+                state.thread.daemon = True
+                state.thread.start()
+
+    def _run(self, app, state):
+        interval = app.config['FLASKY_SAMPLER_INTERVAL']
+        flushed = time.time()
+        while True:
+            time.sleep(interval)
+            if state.active:
+                self.sample(state)
+            if time.time() - flushed > app.config['FLASKY_SAMPLER_FLUSH']:
+                flushed = time.time()
+                try:
+                    self.flush(app, state)
+                except Exception:
+                    app.logger.exception('Could not save profiler samples')
+
+    def sample(self, state):
+        frames = sys._current_frames()
+        for ident, endpoint in list(state.active.items()):
+            frame = frames.get(ident)
+            if frame is not None:
+                stack = collapse(frame)
+                with state.lock:
+                    state.counts.setdefault(endpoint, Counter())[stack] += 1
+
+    def flush(self, app, state=None):
+        """
+        Adds what this process counted since the last flush to the totals in the local store.
+        """
+        state = state or self._state(app)
+        with state.lock:
+            counts, state.counts = state.counts, {}
+        store = get_store(app)
+        for endpoint, stacks in counts.items():
+            def merge(total, stacks=stacks):
+                total = total or {}
+                for stack, n in stacks.items():
+                    total[stack] = total.get(stack, 0) + n
+                return total, None
+            store.update(STACKS_PREFIX + endpoint, merge)
+
+    def start(self, app, rate):
+        get_store(app).set(RATE_KEY, rate)
+
+    def stop(self, app):
+        get_store(app).set(RATE_KEY, 0.0)
+
+    def reset(self, app):
+        store = get_store(app)
+        for key, value in store.items(STACKS_PREFIX):
+            store.delete(key)
+
+    def export(self, app, endpoint=None):
+        """
+        Collapsed stack lines for every endpoint, or one, each stack prefixed by its endpoint so a flame graph of
+        everything splits by endpoint at the root.
+        """
+        lines = []
+        for key, stacks in sorted(get_store(app).items(STACKS_PREFIX)):
+            name = key[len(STACKS_PREFIX):]
+            if endpoint is None or endpoint == name:
+                lines += ['{};{} {}'.format(name, stack, n) for stack, n in sorted(stacks.items())]
+        return lines
+
+
+def read_collapsed(path):
+    counts = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, n = line.rstrip('\n').rpartition(' ')
+            if stack:
+                counts[stack] += int(n)
+    return counts
+
+
+def diff(before, after):
+    """
+    Compares two collapsed stack exports, e.g. from the last release and this one.
+    :return: (lines as "stack before after", which flamegraph.pl draws as a differential flame graph,
+              [(change in share of all samples, function)] for functions anywhere on the stack, biggest first)
+    """
+    lines = ['{} {} {}'.format(stack, before.get(stack, 0), after.get(stack, 0))
+             for stack in sorted(set(before) | set(after))]
+
+    def shares(counts):
+        total = float(sum(counts.values())) or 1.0
+        functions = Counter()
+        for stack, n in counts.items():
+            for name in set(stack.split(';')):
+                functions[name] += n / total
+        return functions
+
+    old, new = shares(before), shares(after)
+    changes = sorted(((new.get(name, 0) - old.get(name, 0), name) for name in set(old) | set(new)),
+                     key=lambda change: -abs(change[0]))
+    return lines, changes
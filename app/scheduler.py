@@ -0,0 +1,272 @@
+__author__ = 'Stuart'
+"""
+Periodic jobs, run by `python manage.py scheduler`.
+
+Modules register their jobs where the code they run lives:
+
+    @scheduler.job('purge-outbox', cron='15 4 * * *', jitter=600)
+    def purge_outbox():
+        ...
+
+every=secs runs a job at a fixed interval, cron= takes the usual 5 fields (minute hour day month weekday, with *, a-b,
+a,b and */n), in UTC like every other time in the db. jitter=secs pushes each run back by a random amount up to
+that, so jobs due at the same moment don't all hit the db at once. Jobs run in an app context, one at a time.
+
+Any number of scheduler processes can run, for redundancy. The schedule lives in the scheduled_jobs table (ScheduledJob
+in models.py), one row per job, and a run starts with a conditional UPDATE taking a lease on the row, like the outbox
+worker claims messages: only one process gets it. Whoever ran the job sets the next due time. A process that dies
+mid-job leaves the lease to run out, after `lease` secs, and the job is run again by whoever comes next.
+per_host=True jobs are for things kept on each host (the local store), they get a row per host.
+
+Each run is counted in flasky_job_runs_total{job,result} and timed in flasky_job_duration_seconds{job}, see
+metrics.py. `manage.py scheduler --show` lists the jobs with their last run.
+"""
+
+import datetime
+import importlib
+import os
+import random
+import socket
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from . import db, metrics
+from .localstore import get_store
+from .models import ScheduledJob
+
+MODULES = ('app.archive', 'app.outbox')  # imported by the scheduler so their jobs get registered
+DURATION_BUCKETS = (0.1, 1, 5, 10, 30, 60, 300, 900, 3600)
+_jobs = OrderedDict()
+
+
+def _parse_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            first, last = low, high
+        elif '-' in part:
+            first, last = [int(value) for value in part.split('-')]
+        else:
+            first = int(part)
+            last = high if step > 1 else first  # 5/15 means 5, 20, 35...
+        if first < low or last > high or first > last or step < 1:
+            raise ValueError('Bad cron field: {}'.format(field))
+        values.update(range(first, last + 1, step))
+    return values
+
+
+class Cron(object):
+    def __init__(self, spec):
+        fields = spec.split()
+        if len(fields) != 5:
+            raise ValueError('A cron schedule has 5 fields, got: {}'.format(spec))
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = set(day % 7 for day in _parse_field(fields[4], 0, 7))  # 0 and 7 are both Sunday
+        self.either_day = fields[2] != '*' and fields[4] != '*'  # cron's rule: then either may match
+
+    def _day_matches(self, t):
+        day, weekday = t.day in self.days, t.isoweekday() % 7 in self.weekdays
+        return day or weekday if self.either_day else day and weekday
+
+    def next(self, after):
+        """
+        :return: first minute strictly after `after` that matches
+        """
+        t = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        give_up = t + datetime.timedelta(days=5 * 366)
+        while t < give_up:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError('Cron schedule never matches')
+
+
+class Job(object):
+    def __init__(self, name, fn, every=None, cron=None, jitter=0, lease=3600, per_host=False):
+        """
+        :param every: secs between runs
+        :param cron: 5 field cron schedule, instead of every
+        :param jitter: up to this many secs added to each due time
+        :param lease: secs after which a run is presumed dead and the job may be started again
+        :param per_host: run on every host rather than once overall
+        """
+        if (every is None) == (cron is None):
+            raise ValueError('Job {} needs either every or cron'.format(name))
+        self.name = name
+        self.fn = fn
+        self.every = every
+        self.cron = Cron(cron) if cron else None
+        self.schedule = 'every {}s'.format(every) if every else cron
+        if jitter:
+            self.schedule += ' ~{}s'.format(jitter)
+        self.jitter = jitter
+        self.lease = lease
+        self.per_host = per_host
+
+    @property
+    def row_name(self):
+        return '{}@{}'.format(self.name, socket.gethostname()) if self.per_host else self.name
+
+    def next_run(self, now):
+        due = now + datetime.timedelta(seconds=self.every) if self.every else self.cron.next(now)
+        return due + datetime.timedelta(seconds=random.uniform(0, self.jitter))
+
+
+def job(name, every=None, cron=None, jitter=0, lease=3600, per_host=False):
+    """
+    Registers the decorated function as a periodic job, see Job for the arguments.
+    """
+    def decorator(f):
+        if name in _jobs:
+            raise ValueError('Job {} is already registered'.format(name))
+        _jobs[name] = Job(name, f, every=every, cron=cron, jitter=jitter, lease=lease, per_host=per_host)
+        return f
+    return decorator
+
+
+def load_jobs():
+    """
+    :return: every registered Job
+    """
+    for module in MODULES:
+        importlib.import_module(module)
+    return list(_jobs.values())
+
+
+def _owner():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def _rows(jobs, now):
+    """
+    Rows of the jobs, created for new jobs and rescheduled for jobs whose schedule changed.
+    :return: {row name: ScheduledJob}
+    """
+    rows = dict((row.name, row) for row in ScheduledJob.query.filter(
+        ScheduledJob.name.in_([job.row_name for job in jobs])))
+    for job in jobs:
+        row = rows.get(job.row_name)
+        if row is None:
+            rows[job.row_name] = ScheduledJob(name=job.row_name, schedule=job.schedule, next_run_at=job.next_run(now),
+                                              runs=0)
+            db.session.add(rows[job.row_name])
+        elif row.schedule != job.schedule:
+            row.schedule = job.schedule
+            row.next_run_at = job.next_run(now)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # another scheduler added the same rows, theirs do just as well
+        return _rows(jobs, now)
+    return rows
+
+
+def claim(job, now):
+    """
+    Takes the lease on a job that is due. Like the outbox's claim_batch(), the WHERE does the locking.
+    :return: True if this process is to run it
+    """
+    table = ScheduledJob.__table__
+    result = db.session.execute(table.update().where(table.c.name == job.row_name).where(
+        table.c.next_run_at <= now).where(or_(table.c.locked_until == None, table.c.locked_until < now)).values(
+        locked_until=now + datetime.timedelta(seconds=job.lease), locked_by=_owner(), last_started_at=now))
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def run_job(job):
+    """
+    Runs a job claimed with claim(), records how it went and when it's due next.
+    """
+    app = current_app._get_current_object()
+    started = time.time()
+    error = None
+    try:
+        job.fn()
+    except Exception as e:
+        db.session.rollback()
+        error = '{}: {}'.format(type(e).__name__, e)
+        app.logger.exception('Scheduled job {} failed'.format(job.name))
+    duration = time.time() - started
+    metrics.inc('flasky_job_runs_total', job=job.name, result='error' if error else 'ok')
+    metrics.observe('flasky_job_duration_seconds', duration, buckets=DURATION_BUCKETS, job=job.name)
+    metrics.flush(app)
+    table = ScheduledJob.__table__
+    db.session.execute(table.update().where(table.c.name == job.row_name).where(table.c.locked_by == _owner()).values(
+        next_run_at=job.next_run(datetime.datetime.utcnow()), locked_until=None, locked_by=None,
+        last_duration=duration, last_error=error, runs=table.c.runs + 1))
+    db.session.commit()
+    return error is None
+
+
+def run_due(jobs):
+    """
+    Runs the jobs that are due and that no other scheduler got to first. Must be called inside an app context.
+    :return: (names of the jobs run, when the next one is due)
+    """
+    ran = []
+    due = dict((name, row.next_run_at) for name, row in _rows(jobs, datetime.datetime.utcnow()).items())
+    for job in jobs:
+        now = datetime.datetime.utcnow()
+        if due[job.row_name] <= now and claim(job, now):
+            run_job(job)
+            ran.append(job.name)
+    rows = _rows(jobs, datetime.datetime.utcnow())
+    return ran, min([row.next_run_at for row in rows.values()] or [None])
+
+
+def run(app, once=False):
+    """
+    Scheduler loop. Runs until interrupted, or with once=True until nothing is due.
+    Wakes up when the next job is due, or every FLASKY_SCHEDULER_POLL secs to see what other schedulers did.
+    """
+    jobs = load_jobs()
+    while True:
+        with app.app_context():
+            try:
+                ran, next_due = run_due(jobs)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Scheduler error, retrying shortly')
+                ran, next_due = [], None
+            finally:
+                db.session.remove()
+        if once:
+            return ran
+        wait = app.config['FLASKY_SCHEDULER_POLL']
+        if next_due is not None:
+            wait = min(wait, (next_due - datetime.datetime.utcnow()).total_seconds())
+        time.sleep(max(wait, 1))
+
+
+def status(jobs):
+    """
+    :return: [(Job, its ScheduledJob row)], for `manage.py scheduler --show`
+    """
+    rows = _rows(jobs, datetime.datetime.utcnow())
+    return [(job, rows[job.row_name]) for job in jobs]
+
+
+@job('purge-local-store', every=3600, jitter=300, per_host=True)
+def purge_local_store():
+    """
+    Drops expired entries (sessions, cached page totals...) from this host's local store. Workers also purge now and
+    then as they serve requests, this covers quiet hosts.
+    """
+    get_store(current_app).purge()
@@ -0,0 +1,82 @@
+__author__ = 'Stuart'
+"""
+Serving presets for gunicorn, used by `python manage.py serve`.
+
+    sync     gunicorn's default worker. One request per process at a time, so a worker waiting on SMTP or the db does
+             nothing else meanwhile. Predictable, and the right choice for CPU heavy work
+    gevent   green threads. Each worker process juggles up to worker_connections requests, switching whenever one
+             waits on a socket. Needs gevent installed (requirements/production.txt)
+
+Pick one with `manage.py serve --mode gevent` or FLASKY_SERVE_MODE.
+
+What has to hold for the app to be safe under gevent, and why it does:
+- gunicorn's gevent worker monkey patches the stdlib before it imports manage.py (we don't --preload), so sockets,
+  smtplib, time.sleep, threading.Thread and threading.local all yield to other greenlets instead of blocking
+- Flask's request/app contexts, and so g, current_user and Flask-SQLAlchemy's scoped session, are keyed by
+  greenlet when greenlet is importable (werkzeug.local), so each request still gets its own db session
+- psycopg2 is a C extension the monkey patching can't reach. psycogreen makes it wait on the gevent hub instead of
+  blocking the whole process, see post_worker_init below. sqlite calls still block, but they're short
+- send_email's fallback Thread becomes a greenlet, the outbox path doesn't do any I/O in the request at all
+- caches shared between requests (app/localstore.py) use a lock or one connection per OS thread, never per
+  greenlet, so a thousand connections don't mean a thousand sqlite handles
+- password hashing is CPU bound and blocks the worker while it runs. If the API is mostly token-less basic auth,
+  more workers with fewer connections each is better than the other way round
+
+This file is also handed to gunicorn as its config file (-c), so it must not import the app or anything heavy at the
+top: gunicorn reads it in the master process, before any monkey patching.
+"""
+
+import multiprocessing
+import os
+
+
+PRESETS = {
+    'sync': {
+        'worker_class': 'sync',
+        'workers': multiprocessing.cpu_count() * 2 + 1,
+        'timeout': 30,
+    },
+    'gevent': {
+        'worker_class': 'gevent',
+        'workers': multiprocessing.cpu_count(),  # one per core is enough, each handles many connections
+        'worker_connections': 1000,
+        'timeout': 30,
+    },
+}
+
+
+def gunicorn_argv(mode, app_path='manage:app', workers=None, bind=None, connections=None):
+    """
+    Command line to start gunicorn with a preset.
+    :param mode: key of PRESETS
+    :param app_path: module:variable of the WSGI app
+    :param workers: overrides the preset
+    :param bind: e.g. '0.0.0.0:8000'. None leaves it to gunicorn, which listens on $PORT if set (heroku)
+    :param connections: overrides worker_connections, gevent only
+    :return: list of args, argv[0] being 'gunicorn'
+    """
+    if mode not in PRESETS:
+        raise ValueError('Unknown serving mode: {}, pick one of {}'.format(mode, ', '.join(sorted(PRESETS))))
+    preset = PRESETS[mode]
+    argv = ['gunicorn', '-c', os.path.abspath(__file__),
+            '--worker-class', preset['worker_class'],
+            '--workers', str(workers or preset['workers']),
+            '--timeout', str(preset['timeout'])]
+    if 'worker_connections' in preset:
+        argv += ['--worker-connections', str(connections or preset['worker_connections'])]
+    if bind:
+        argv += ['--bind', bind]
+    return argv + [app_path]
+
+
+def post_worker_init(worker):
+    """
+    gunicorn hook, runs in each worker after the gevent worker has monkey patched.
+    """
+    if 'gevent' not in worker.cfg.worker_class_str:
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        return  # no psycogreen, fine for sqlite. With postgres, queries will block the worker
+    patch_psycopg()
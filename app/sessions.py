@@ -0,0 +1,105 @@
+__author__ = 'Stuart'
+"""
+Server side sessions, kept in the local store (app/localstore.py), for FLASKY_SERVER_SESSIONS = True.
+
+Flask's stock session is the whole session dict in a signed cookie: every request base64-decodes it, checks the HMAC
+and parses the JSON. Every response that touches it serializes and signs it again, and the browser sends all of
+it back on every request, static files included. Here the cookie is just an opaque random id (24 chars). Loading
+a session is one keyed lookup in the store, and a request that doesn't change the session writes nothing.
+
+Sessions idle for FLASKY_SESSION_IDLE secs are evicted: each one is stored with that as its TTL, and the TTL is
+pushed back when the session is used, at most once every FLASKY_SESSION_IDLE / 10 secs so busy users don't write
+on every request. Expired rows are deleted by a store purge that every worker runs every FLASKY_SESSION_PURGE secs.
+Flask-Login's remember-me cookie is separate and still logs people back in after eviction.
+
+Some details:
+    Flask-Login puts its client identifier (`_id`, for session_protection='strong') in every visitor's session.
+    A session holding nothing else isn't stored, or each crawler hit would leave a row behind. Flask-Login simply
+    recomputes it next time, it's a hash of the IP and user agent
+    When user_id changes (login, logout), the session gets a new id and the old one is deleted, so an id planted
+    in a browser before login (session fixation) is useless afterwards
+    Values must be JSON serializable, as for anything in the local store
+    The local store is per host. With several app servers, either route a user to the same one (sticky sessions) or
+    keep the cookie sessions
+"""
+
+import base64
+import os
+import time
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from .localstore import get_store
+
+
+KEY_PREFIX = 'session:'
+NOT_WORTH_STORING = set(['_id'])  # Flask-Login's identifier, recomputed for free when missing
+
+
+def new_sid():
+    return base64.urlsafe_b64encode(os.urandom(18)).decode('ascii')  # 144 random bits, no padding needed
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, touched=0):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = sid is None
+        self.touched = touched  # when the store last got this session
+        self.modified = False
+        self.loaded_user_id = self.get('user_id')
+
+
+class LocalStoreSessionInterface(SessionInterface):
+    session_class = ServerSession
+
+    def __init__(self):
+        self.purged = time.time()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            entry = get_store(app).get(KEY_PREFIX + sid)
+            if entry is not None:
+                return self.session_class(entry['data'], sid=sid, touched=entry['touched'])
+        return self.session_class()
+
+    def save_session(self, app, session, response):
+        store = get_store(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+        idle = app.config['FLASKY_SESSION_IDLE']
+        if now - self.purged > app.config['FLASKY_SESSION_PURGE']:
+            self.purged = now
+            store.purge()
+
+        if not set(session).difference(NOT_WORTH_STORING):
+            if session.sid is not None:
+                store.delete(KEY_PREFIX + session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+        rotate = session.sid is not None and session.get('user_id') != session.loaded_user_id
+        if session.sid is not None and not rotate and not session.modified and now - session.touched < idle / 10.0:
+            return
+
+        if rotate:
+            store.delete(KEY_PREFIX + session.sid)
+        sid = new_sid() if session.sid is None or rotate else session.sid
+        store.set(KEY_PREFIX + sid, {'data': dict(session), 'touched': now}, ttl=idle)
+        response.set_cookie(app.session_cookie_name, sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app))
+
+
+class ServerSessions(object):
+    """
+    Flask extension, create_app() calls init_app(). Does nothing unless FLASKY_SERVER_SESSIONS is on.
+    """
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_SERVER_SESSIONS', False)
+        app.config.setdefault('FLASKY_SESSION_IDLE', 7 * 24 * 3600)
+        app.config.setdefault('FLASKY_SESSION_PURGE', 600)
+        if app.config['FLASKY_SERVER_SESSIONS']:
+            app.session_interface = LocalStoreSessionInterface()
@@ -0,0 +1,174 @@
+__author__ = 'Stuart'
+"""
+Slow query log, grouped by query shape.
+
+Every statement that takes FLASKY_SLOW_DB_QUERY_TIME or longer is normalized into a fingerprint: literals and bind
+parameters become ?, IN lists collapse, whitespace and comments go. So "... WHERE id = 5" and "... WHERE id = 7"
+are the same problem and counted together instead of flooding the log one line each.
+
+Per fingerprint we keep, in the local store (app/localstore.py, so all workers on the host add up):
+    count, total and max time, a duration histogram for percentiles, first/last seen, the endpoint it was last seen
+    in, and the query plan, captured with EXPLAIN (postgres) / EXPLAIN QUERY PLAN (sqlite) the first time the
+    fingerprint is slow
+The app log gets one warning when a fingerprint is first seen, then again at its 10th, 100th... occurrence.
+
+`python manage.py slowlog` prints the worst offenders by total time, with their plans.
+
+Statements are timed with engine events, so this works whatever SQLALCHEMY_RECORD_QUERIES says and doesn't keep
+every query of every request in memory the way get_debug_queries() does.
+"""
+
+import hashlib
+import re
+import time
+from flask import current_app, request, has_app_context, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .localstore import get_store
+from .database import _is_memory_sqlite
+
+
+STORE_PREFIX = 'slowlog:'
+BUCKETS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 60)  # secs, upper bounds. Percentiles are only as exact as these
+
+_normalizers = [
+    (re.compile(r'--[^\n]*|/\*.*?\*/', re.S), ' '),                     # comments
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                               # string literals
+    (re.compile(r'%\(\w+\)s|%s|(?<!:):\w+|\$\d+'), '?'),                # bind parameters, but not ::casts
+    (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b', re.I), '?'),  # numbers, but not in names like t1
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?+)'),                # IN (?, ?, ?) and VALUES (?, ?)
+    (re.compile(r'\(\?\+\)(?:\s*,\s*\(\?\+\))+'), '(?+)+'),             # multi row VALUES
+]
+
+
+def normalize(statement):
+    for pattern, replacement in _normalizers:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def fingerprint(statement):
+    """
+    :return: (short hash, normalized statement)
+    """
+    normalized = normalize(statement)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16], normalized
+
+
+def percentile(entry, pct):
+    """
+    Estimated from the histogram: the upper bound of the bucket the pct-th query falls in, capped at the max seen.
+    """
+    rank = entry['count'] * pct / 100.0
+    seen = 0
+    for bound, n in zip(BUCKETS, entry['buckets']):
+        seen += n
+        if seen >= rank:
+            return min(bound, entry['max'])
+    return entry['max']
+
+
+def explain(engine, statement, parameters):
+    """
+    The plan of a statement, as a list of lines. Runs on a connection of its own so a failing EXPLAIN can't break
+    the transaction of the request, and on the raw DBAPI connection so it doesn't go through our own events.
+    """
+    dialect = engine.dialect.name
+    if _is_memory_sqlite(engine.url):
+        return ['no EXPLAIN for in-memory sqlite, there is no second connection to run it on']
+    if dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect in ('postgresql', 'mysql'):
+        prefix = 'EXPLAIN '  # no ANALYZE, that would run the query again
+    else:
+        return ['no EXPLAIN for {}'.format(dialect)]
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+        cursor.close()
+    except Exception as e:
+        return ['EXPLAIN failed: {}'.format(e)]
+    finally:
+        conn.close()  # the pool rolls back whatever the driver started
+    return [' '.join(str(col) for col in row) for row in rows]
+
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('slowlog_query_start', []).append(time.time())
+
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('slowlog_query_start')
+    if not starts:
+        return
+    duration = time.time() - starts.pop()
+    if not has_app_context() or 'slowlog' not in current_app.extensions:
+        return
+    if duration < current_app.config['FLASKY_SLOW_DB_QUERY_TIME']:
+        return
+    current_app.extensions['slowlog'].record(conn.engine, statement, parameters, duration,
+                                             explainable=not executemany)
+
+event.listen(Engine, 'before_cursor_execute', _query_started)
+event.listen(Engine, 'after_cursor_execute', _query_finished)
+
+
+class SlowQueryLog(object):
+    """
+    Flask extension, create_app() calls init_app().
+    """
+    def init_app(self, app):
+        app.config.setdefault('FLASKY_SLOW_DB_QUERY_TIME', 0.5)
+        app.extensions['slowlog'] = self
+
+    def record(self, engine, statement, parameters, duration, explainable=True):
+        app = current_app._get_current_object()
+        key, normalized = fingerprint(statement)
+        endpoint = request.endpoint if has_request_context() else None
+        now = time.time()
+
+        def add(entry):
+            entry = entry or {'statement': normalized, 'count': 0, 'total': 0.0, 'max': 0.0,
+                              'buckets': [0] * len(BUCKETS), 'first_seen': now, 'plan': None}
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['buckets'][next((i for i, b in enumerate(BUCKETS) if duration <= b), len(BUCKETS) - 1)] += 1
+            entry['last_seen'] = now
+            entry['endpoint'] = endpoint
+            wants_plan = entry['plan'] is None and explainable and normalized.lower().startswith(('select', 'with'))
+            if wants_plan:
+                entry['plan'] = []  # claimed, so other workers don't explain it too
+            return entry, (entry['count'], wants_plan)
+        store = get_store(app)
+        count, wants_plan = store.update(STORE_PREFIX + key, add)
+
+        if str(count).strip('0') == '1':  # 1st, 10th, 100th...
+            app.logger.warning('Slow query {} ({:.3f}s, seen {} times{}): {}'.format(
+                key, duration, count, ', in ' + endpoint if endpoint else '', normalized))
+        if wants_plan:
+            plan = explain(engine, statement, parameters)
+
+            def save_plan(entry):
+                if entry is not None:  # None if someone ran `slowlog --reset` meanwhile
+                    entry['plan'] = plan
+                return entry, None
+            store.update(STORE_PREFIX + key, save_plan)
+
+    def report(self, app=None):
+        """
+        :return: entries with their 'fingerprint' added, worst total time first
+        """
+        app = app or current_app
+        entries = []
+        for key, entry in get_store(app).items(STORE_PREFIX):
+            entries.append(dict(entry, fingerprint=key[len(STORE_PREFIX):]))
+        return sorted(entries, key=lambda e: -e['total'])
+
+    def reset(self, app=None):
+        store = get_store(app or current_app)
+        for key, entry in store.items(STORE_PREFIX):
+            store.delete(key)
@@ -0,0 +1,111 @@
+__author__ = 'Stuart'
+"""
+Where does start up time go? Two halves:
+1) importing modules: flask, sqlalchemy, the extensions, our own code. ImportTimer measures every first import
+2) create_app(): init_app() of each extension and registering blueprints. create_app() times each step with
+   timed() and leaves the results in app.extensions['startup_timings']
+
+`python manage.py startup-report` runs this file as a script in a fresh interpreter and prints the slowest of each.
+As a script, so that not even flask (imported by app/__init__.py) is loaded before the timer starts.
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+
+@contextmanager
+def timed(timings, name):
+    """
+    Appends (name, secs) to timings once the block is done.
+    """
+    start = time.time()
+    yield
+    timings.append((name, time.time() - start))
+
+
+class ImportTimer(object):
+    """
+    Wraps __import__ while active and records, for each module imported for the first time, how long the import took
+    including everything it imported in turn (cumulative) and without that (self).
+    Works on any python 3, unlike -X importtime which needs 3.7. Submodules pulled in by `from package import module`
+    don't go through __import__, their time counts toward the package.
+    """
+    def __init__(self):
+        self.cumulative = {}
+        self.self_time = {}
+        self._children = [0.0]  # time spent in nested imports, per level of the stack
+
+    def __enter__(self):
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc):
+        builtins.__import__ = self._original
+
+    def _resolve(self, name, globals, level):
+        if level == 0:
+            return name
+        package = (globals or {}).get('__package__') or ''
+        base = package.rsplit('.', level - 1)[0] if level > 1 else package
+        return base + '.' + name if name else base
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        full_name = self._resolve(name, globals, level)
+        if full_name in sys.modules:
+            return self._original(name, globals, locals, fromlist, level)
+        self._children.append(0.0)
+        start = time.time()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            children = self._children.pop()
+            self._children[-1] += elapsed
+            if full_name not in self.cumulative:
+                self.cumulative[full_name] = elapsed
+                self.self_time[full_name] = elapsed - children
+
+    def by_package(self):
+        """
+        Self time summed per top level package, i.e. what each distribution costs us in total.
+        """
+        totals = {}
+        for name, secs in self.self_time.items():
+            top = name.split('.')[0]
+            totals[top] = totals.get(top, 0.0) + secs
+        return totals
+
+
+def report(config_name, limit=20, out=sys.stdout):
+    """
+    Imports manage.py under the ImportTimer and prints where the time went. Meant for a fresh interpreter.
+    FLASK_CONFIG wins over config_name if set, same as in manage.py.
+    """
+    os.environ.setdefault('FLASK_CONFIG', config_name)
+    start = time.time()
+    with ImportTimer() as timer:
+        import manage
+    total = time.time() - start
+
+    def table(title, rows, limit=limit):
+        out.write('\n{}\n'.format(title))
+        for name, secs in rows[:limit]:
+            out.write('  {:>8.1f} ms  {}\n'.format(secs * 1000, name))
+
+    out.write('import manage.py took {:.1f} ms in total\n'.format(total * 1000))
+    table('Slowest imports (cumulative)', sorted(timer.cumulative.items(), key=lambda i: -i[1]))
+    table('Import time by package (self)', sorted(timer.by_package().items(), key=lambda i: -i[1]))
+    table('create_app() steps', manage.app.extensions.get('startup_timings', []), limit=None)
+
+
+if __name__ == '__main__':
+    # python app/startup.py <config name> <limit>
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # the project, not app/
+    report(sys.argv[1], limit=int(sys.argv[2]))
@@ -0,0 +1,231 @@
+__author__ = 'Stuart'
+"""
+Cache of the newest post ids of each user's followed timeline (user.followed_posts), for page 1 of the "Followed"
+tab of the index and of /api/v1.0/users/<id>/timeline/, which are asked for far more often than they change.
+
+Each process keeps an LRU of FLASKY_TIMELINE_CACHE_SIZE users. An entry is the (timestamp, id) of the user's newest
+FLASKY_POSTS_PER_PAGE + 1 posts (one more than a page, to know if there is a page 2) and the ids of the authors the
+user follows. A hit costs one query: the posts by primary key. Only ids are cached, so edited posts show as edited.
+A miss costs the usual page query plus one for the followed ids, both on the primary (see database.on_primary).
+The total for the page's count (modes exact and cached) is counted the first time it's asked for and kept with the
+entry, new posts add to it. A post committed while that count runs may be counted twice, the entry is off by one
+until it's dropped.
+
+Entries are kept right rather than thrown away wholesale like the user cache does:
+    a new post is put at the top of the cached timelines of the author's followers, found with a reverse index
+    (author id -> ids of the cached users following them), so a popular author posting doesn't empty the cache
+    following or unfollowing someone drops the follower's entry
+    a post deleted or moved to another author/time drops the entries of its author's followers
+    `manage.py archive` moves posts with plain SQL, and clears everything
+Commits append these changes to a log in the local store (the last FLASKY_TIMELINE_CACHE_EVENTS, see eventlog.py).
+Every lookup first checks the log's sequence number, one read of the local store, and applies what it hasn't seen
+yet, so all workers on the host see a post as soon as it is committed. A worker that fell further behind than the
+log reaches back clears its cache.
+"""
+
+import threading
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import event, inspect
+from . import db, metrics
+from .database import on_primary
+from .eventlog import EventLog
+from .models import Post, Follow
+from .pagination import Page, paginate, count, NONE
+
+log = EventLog('timeline', 'FLASKY_TIMELINE_CACHE_EVENTS')
+
+
+class _State(object):
+    def __init__(self):
+        # user id -> [[(timestamp, post id)] newest first, set of followed author ids, their total or None]
+        self.entries = OrderedDict()
+        self.followers = {}  # author id -> ids of the cached users that follow them
+        self.seq = None  # last event applied
+        self.lock = threading.Lock()
+
+    def drop(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is not None:
+            for author_id in entry[1]:
+                followers = self.followers.get(author_id)
+                followers.discard(user_id)
+                if not followers:
+                    del self.followers[author_id]
+
+    def put(self, user_id, posts, authors, size):
+        self.drop(user_id)
+        self.entries[user_id] = [posts, authors, None]
+        for author_id in authors:
+            self.followers.setdefault(author_id, set()).add(user_id)
+        while len(self.entries) > size:
+            self.drop(next(iter(self.entries)))
+
+    def clear(self):
+        self.entries.clear()
+        self.followers.clear()
+
+    def apply(self, event, length):
+        kind = event[1]
+        if kind == 'post':
+            author_id, post = event[2], tuple(event[3])
+            for user_id in self.followers.get(author_id, ()):
+                entry = self.entries[user_id]
+                posts = entry[0]
+                if post in posts:
+                    continue  # already read from the db
+                if entry[2] is not None:
+                    entry[2] += 1
+                if len(posts) == length and post < posts[-1]:
+                    continue  # older than anything cached, so on a later page
+                posts.append(post)
+                posts.sort(reverse=True)
+                del posts[length:]
+        elif kind == 'follow':
+            self.drop(event[2])
+        elif kind == 'author':
+            for user_id in list(self.followers.get(event[2], ())):
+                self.drop(user_id)
+        else:
+            self.clear()
+
+
+def _state(app):
+    state = app.extensions.get('timelinecache')
+    if state is None:
+        state = app.extensions.setdefault('timelinecache', _State())
+    return state
+
+
+def _length(app):
+    return app.config['FLASKY_POSTS_PER_PAGE'] + 1
+
+
+def _sync(app, state):
+    """
+    Applies the events other processes (and this one) committed since the last lookup. Called with the lock held.
+    """
+    seq, events = log.read(app, state.seq)
+    if events is None:
+        state.clear()  # first lookup, or missed events that have left the log
+    else:
+        for args in events:
+            state.apply(args, _length(app))
+    state.seq = seq
+
+
+def _key(timestamp):
+    return timestamp.strftime('%Y-%m-%dT%H:%M:%S.%f')  # fixed width, so the strings sort like the times
+
+
+def recent_ids(user):
+    """
+    Ids of the newest FLASKY_POSTS_PER_PAGE + 1 posts of user.followed_posts, newest first.
+    """
+    return _recent(user)[0]
+
+
+def _recent(user):
+    """
+    :return: (recent_ids(user), the posts if they had to be loaded, else [])
+    """
+    app = current_app._get_current_object()
+    state = _state(app)
+    with state.lock:
+        _sync(app, state)
+        entry = state.entries.get(user.id)
+        if entry is not None:
+            state.entries.move_to_end(user.id)
+            metrics.cache_hit('timelines')
+            return [id for _, id in entry[0]], []
+        seq = state.seq
+    metrics.cache_miss('timelines')
+    with on_primary(db.session()):  # the events up to seq are applied, the replica may not have those rows yet
+        loaded = user.followed_posts.order_by(Post.timestamp.desc()).limit(_length(app)).all()
+        authors = set(id for id, in db.session.query(Follow.followed_id).filter_by(follower_id=user.id))
+    posts = [(_key(post.timestamp), post.id) for post in loaded]
+    with state.lock:
+        _sync(app, state)
+        if state.seq == seq:  # nothing committed while we were reading, what we have is current
+            state.put(user.id, posts, authors, app.config['FLASKY_TIMELINE_CACHE_SIZE'])
+    return [id for _, id in posts], loaded
+
+
+def _total(user, query):
+    """
+    count(query) of a cached user's timeline, kept with their entry.
+    """
+    app = current_app._get_current_object()
+    state = _state(app)
+    with state.lock:
+        _sync(app, state)
+        entry = state.entries.get(user.id)
+        if entry is not None and entry[2] is not None:
+            return entry[2]
+        seq = state.seq
+    with on_primary(db.session()):
+        total = count(query)
+    with state.lock:
+        _sync(app, state)
+        entry = state.entries.get(user.id)
+        if entry is not None and state.seq == seq:
+            entry[2] = total
+    return total
+
+
+def first_page(user, per_page, mode=None):
+    """
+    Page 1 of user.followed_posts, newest first, as pagination.paginate() would give it, from the cached ids.
+    """
+    mode = mode or current_app.config['FLASKY_PAGE_TOTALS']
+    query = user.followed_posts.order_by(Post.timestamp.desc())
+    if per_page + 1 != _length(current_app):  # not the page size the cache is for
+        return paginate(query, 1, per_page, mode)
+    ids, loaded = _recent(user)
+    found = dict((post.id, post) for post in loaded)  # after a miss, no need to load them again
+    missing = set(ids[:per_page]).difference(found)
+    if missing:
+        found.update((post.id, post) for post in Post.query.filter(Post.id.in_(missing)))
+    items = [found[id] for id in ids[:per_page] if id in found]
+    if mode == NONE:
+        return Page(query, 1, per_page, None, items, more=len(ids) > per_page)
+    if len(ids) <= per_page:
+        total = len(ids)  # it all fits on page 1
+    else:
+        total = _total(user, query)
+    return Page(query, 1, per_page, total, items)
+
+
+def invalidate(app=None):
+    """
+    Empties every process' cache, for changes made without the ORM.
+    """
+    log.publish(app or current_app._get_current_object(), [('clear',)])
+
+
+@event.listens_for(Post, 'after_insert')
+def _post_inserted(mapper, connection, target):
+    if target.author_id is not None:
+        log.record(target, 'post', target.author_id, (_key(target.timestamp), target.id))
+
+
+@event.listens_for(Post, 'after_update')
+def _post_updated(mapper, connection, target):
+    state = inspect(target)
+    for key in ('timestamp', 'author_id'):
+        history = state.attrs[key].history
+        if history.has_changes():
+            for author_id in set([target.author_id] + list(history.deleted if key == 'author_id' else ())):
+                log.record(target, 'author', author_id)
+            return
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, target):
+    log.record(target, 'author', target.author_id)
+
+
+@event.listens_for(Follow, 'after_insert')
+@event.listens_for(Follow, 'after_delete')
+def _follow_changed(mapper, connection, target):
+    log.record(target, 'follow', target.follower_id)
@@ -0,0 +1,186 @@
+__author__ = 'Stuart'
+"""
+Copies every table of the app from one database to another, for `python manage.py transfer`, typically from the
+sqlite file we started on to the postgres of DATABASE_URL.
+
+    tables are copied in primary key order, `chunk` rows at a time (WHERE pk > last ORDER BY pk LIMIT n), so neither
+    side ever holds a whole table in memory and the source reads are index range scans
+    rows go in with executemany INSERTs, or COPY ... FROM STDIN when the target is postgres (psycopg2), which is
+    several times faster again
+    ids are copied as they are, and afterwards every postgres sequence is set past the highest id, so new rows don't
+    collide with copied ones
+    tables are grouped by foreign keys: roles first, then users, then posts and follows... All the tables of one
+    group are copied at the same time, one process each, and a group starts when the one before is done
+    at the end, both sides are read again and each table's row count and checksum (sha1 over all rows in primary
+    key order) compared
+
+The target tables must exist (`manage.py db upgrade` against the target, or they are created from the models) and be
+empty: copying into a table with rows would mix two sets of ids.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import csv
+import io
+from sqlalchemy import create_engine, select, func, and_, or_
+from . import db
+
+
+def _engine(url):
+    if url.startswith('sqlite'):
+        return create_engine(url, connect_args={'timeout': 60})  # processes copying other tables hold the lock
+    return create_engine(url)
+
+
+def table_levels(metadata):
+    """
+    Tables grouped so that every table only references tables of earlier groups.
+    :return: [[table name, ...], ...]
+    """
+    remaining = dict((t.name, set(fk.column.table.name for fk in t.foreign_keys) - set([t.name]))
+                     for t in metadata.sorted_tables)
+    levels = []
+    while remaining:
+        done = set(name for level in levels for name in level)
+        level = sorted(name for name, refs in remaining.items() if refs <= done)
+        if not level:
+            raise ValueError('Foreign key cycle between ' + ', '.join(sorted(remaining)))
+        levels.append(level)
+        for name in level:
+            del remaining[name]
+    return levels
+
+
+def _after(pk, last):
+    """
+    (a, b) > (x, y) spelled out, works for single and composite primary keys on any db.
+    """
+    clause = None
+    for column, value in reversed(list(zip(pk, last))):
+        clause = column > value if clause is None else or_(column > value, and_(column == value, clause))
+    return clause
+
+
+def read_chunks(conn, table, chunk):
+    pk = list(table.primary_key.columns)
+    query = select([table]).order_by(*pk).limit(chunk)
+    last = None
+    while True:
+        rows = conn.execute(query if last is None else query.where(_after(pk, last))).fetchall()
+        if not rows:
+            return
+        last = [rows[-1][c.name] for c in pk]
+        yield rows
+
+
+def _copy_into_postgres(conn, table, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC)  # strings quoted, so "" is '' and an empty field is NULL
+    for row in rows:
+        writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row])
+    buf.seek(0)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert('COPY {} ({}) FROM STDIN WITH CSV'.format(
+        table.name, ', '.join('"{}"'.format(c.name) for c in table.columns)), buf)
+
+
+def copy_table(args):
+    """
+    Runs in a pool process, with engines of its own.
+    :return: (table name, rows copied)
+    """
+    source_url, target_url, name, chunk = args
+    source, target = _engine(source_url), _engine(target_url)
+    table = db.metadata.tables[name]
+    copied = 0
+    try:
+        with source.connect() as reader:
+            for rows in read_chunks(reader, table, chunk):
+                with target.begin() as writer:
+                    if target.dialect.name == 'postgresql':
+                        _copy_into_postgres(writer, table, rows)
+                    else:
+                        writer.execute(table.insert(), [dict(row) for row in rows])
+                copied += len(rows)
+    finally:
+        source.dispose()
+        target.dispose()
+    return name, copied
+
+
+def checksum(args):
+    """
+    :return: (table name, row count, sha1 of every row in primary key order)
+    """
+    url, name, chunk = args
+    engine = _engine(url)
+    table = db.metadata.tables[name]
+    digest = hashlib.sha1()
+    count = 0
+    try:
+        with engine.connect() as conn:
+            for rows in read_chunks(conn, table, chunk):
+                for row in rows:
+                    digest.update(json.dumps(list(row), default=str).encode('utf-8'))
+                count += len(rows)
+    finally:
+        engine.dispose()
+    return name, count, digest.hexdigest()
+
+
+def reset_sequences(engine):
+    """
+    After copying ids into postgres, every serial's sequence still starts at 1.
+    """
+    if engine.dialect.name != 'postgresql':
+        return
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            pk = list(table.primary_key.columns)
+            if len(pk) == 1 and pk[0].autoincrement is True:
+                conn.execute("SELECT setval(pg_get_serial_sequence('{0}', '{1}'), COALESCE(MAX({1}), 1), "
+                             "MAX({1}) IS NOT NULL) FROM {0}".format(table.name, pk[0].name))
+
+
+def verify(source_url, target_url, chunk=1000, pool=None):
+    """
+    :return: [(table name, source count, target count, checksums match)]
+    """
+    names = [t.name for t in db.metadata.sorted_tables]
+    jobs = [(url, name, chunk) for url in (source_url, target_url) for name in names]
+    results = (pool.map if pool is not None else map)(checksum, jobs)
+    sums = dict(((url, name), (count, digest)) for (url, _, _), (name, count, digest) in zip(jobs, results))
+    return [(name, sums[source_url, name][0], sums[target_url, name][0],
+             sums[source_url, name] == sums[target_url, name]) for name in names]
+
+
+def transfer(source_url, target_url, chunk=1000, processes=4, progress=None):
+    """
+    :param progress: called with a line of text as things happen
+    :return: the verify() report
+    """
+    progress = progress or (lambda line: None)
+    target = _engine(target_url)
+    try:
+        db.metadata.create_all(bind=target)  # only creates what's missing
+        with target.connect() as conn:
+            busy = [t.name for t in db.metadata.sorted_tables
+                    if conn.execute(select([func.count()]).select_from(t)).scalar()]
+        if busy:
+            raise ValueError('Target tables not empty: ' + ', '.join(busy))
+        pool = multiprocessing.Pool(processes) if processes > 1 else None
+        try:
+            for level in table_levels(db.metadata):
+                jobs = [(source_url, target_url, name, chunk) for name in level]
+                for name, copied in (pool.imap_unordered if pool is not None else map)(copy_table, jobs):
+                    progress('{}: {} rows'.format(name, copied))
+            reset_sequences(target)
+            progress('verifying')
+            return verify(source_url, target_url, chunk, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    finally:
+        target.dispose()
@@ -0,0 +1,173 @@
+__author__ = 'Stuart'
+"""
+"Hot" posts, ranked by comment activity with recent activity counting more, for /hot and /api/v1.0/posts/hot/.
+
+A post's score is the sum over its events (being posted, and each comment on it) of 2 ** -(age / half life),
+FLASKY_HOT_HALF_LIFE. All scores decay by the same factor as time passes, so the ranking only changes when an event
+happens, and only for that post. So scores are kept as of a fixed point in time, in log space to stay finite:
+an event at time t adds rate * t (rate = ln 2 / half life) with logaddexp, and the score now is
+exp(stored - rate * now). Nothing is ever rescored.
+
+Each process keeps the scores in a dict, plus a heap of (-score, post id) for the top N:
+    an event pushes the post's new score and leaves the old entry where it is (lazy deletion)
+    top(n) pops entries until it has n whose score is still their post's, and pushes those back: O(n log size)
+    when the heap has twice as many entries as there are posts, or there are twice FLASKY_HOT_SIZE posts, the heap
+    is rebuilt from the dict, keeping only the best FLASKY_HOT_SIZE posts
+The first time, the scores are filled from the posts and comments of the last WINDOW half lives (older events count
+for less than 1/1000). After that, post and comment inserts committed by any worker come in through an event log
+in the local store, see eventlog.py. Nothing scans the comments table per request.
+"""
+
+import calendar
+import datetime
+import heapq
+import math
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event
+from . import db, metrics
+from .database import on_primary
+from .eventlog import EventLog
+from .models import Post, Comment
+
+WINDOW = 10  # half lives of history read when the scores are built
+log = EventLog('trending', 'FLASKY_HOT_EVENTS')
+
+
+def epoch(timestamp):
+    """
+    Secs since 1970 of a naive UTC datetime.
+    """
+    return calendar.timegm(timestamp.utctimetuple()) + timestamp.microsecond / 1e6
+
+
+class HotIndex(object):
+    def __init__(self, half_life, size):
+        self.rate = math.log(2) / half_life
+        self.size = size
+        self.scores = {}  # post id -> log score
+        self.heap = []  # (-log score, post id), including outdated entries
+        self.seq = None
+        self.lock = threading.Lock()
+
+    def add(self, post_id, at):
+        """
+        :param at: time of the event, secs since 1970
+        """
+        score = self.rate * at
+        old = self.scores.get(post_id)
+        if old is not None:
+            score = max(old, score) + math.log1p(math.exp(-abs(old - score)))  # logaddexp
+        self.scores[post_id] = score
+        heapq.heappush(self.heap, (-score, post_id))
+        if len(self.heap) > 2 * max(len(self.scores), 100) or len(self.scores) > 2 * self.size:
+            self.compact()
+
+    def remove(self, post_id):
+        self.scores.pop(post_id, None)  # its heap entries are skipped from now on
+
+    def compact(self):
+        if len(self.scores) > self.size:
+            self.scores = dict(heapq.nlargest(self.size, self.scores.items(), key=lambda item: item[1]))
+        self.heap = [(-score, post_id) for post_id, score in self.scores.items()]
+        heapq.heapify(self.heap)
+
+    def clear(self):
+        self.scores.clear()
+        del self.heap[:]
+
+    def top(self, n):
+        """
+        :return: [(post id, score now)], best first
+        """
+        found = []
+        while self.heap and len(found) < n:
+            entry = heapq.heappop(self.heap)
+            if self.scores.get(entry[1]) == -entry[0] and (not found or found[-1] != entry):
+                found.append(entry)
+        for entry in found:
+            heapq.heappush(self.heap, entry)
+        now = self.rate * time.time()
+        return [(post_id, math.exp(-negative - now)) for negative, post_id in found]
+
+
+def _index(app):
+    index = app.extensions.get('trending')
+    if index is None:
+        index = app.extensions.setdefault('trending', HotIndex(app.config['FLASKY_HOT_HALF_LIFE'],
+                                                               app.config['FLASKY_HOT_SIZE']))
+    return index
+
+
+def _build(app, index):
+    """
+    Scores from the db, for a new process or one that missed events. Read on the primary: the events up to index.seq
+    count as applied, the replica may not have all of those rows yet.
+    """
+    index.clear()
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=WINDOW * app.config['FLASKY_HOT_HALF_LIFE'])
+    with on_primary(db.session()):
+        for model, post_id in ((Post, Post.id), (Comment, Comment.post_id)):
+            for id, timestamp in db.session.query(post_id, model.timestamp).filter(model.timestamp > cutoff).\
+                    yield_per(1000):
+                if id is not None:
+                    index.add(id, epoch(timestamp))
+
+
+def _sync(app, index):
+    seq, events = log.read(app, index.seq)
+    if events is None or any(args[1] == 'clear' for args in events):
+        metrics.cache_miss('hot')
+        _build(app, index)
+    else:
+        metrics.cache_hit('hot')
+        for args in events:
+            if args[1] == 'remove':
+                index.remove(args[2])
+            else:
+                index.add(args[2], args[3])
+    index.seq = seq
+
+
+def top(n):
+    """
+    :return: [(post id, score now)] of the n hottest posts, best first
+    """
+    app = current_app._get_current_object()
+    index = _index(app)
+    with index.lock:
+        _sync(app, index)
+        return index.top(n)
+
+
+def hot_posts(n):
+    """
+    The n hottest posts, best first, loaded in one query.
+    """
+    ids = [post_id for post_id, _ in top(n)]
+    found = dict((post.id, post) for post in Post.query.filter(Post.id.in_(ids))) if ids else {}
+    return [found[id] for id in ids if id in found]
+
+
+def invalidate(app=None):
+    """
+    Every process builds its scores again, for changes made without the ORM.
+    """
+    log.publish(app or current_app._get_current_object(), [('clear',)])
+
+
+@event.listens_for(Post, 'after_insert')
+def _post_inserted(mapper, connection, target):
+    log.record(target, 'post', target.id, epoch(target.timestamp))
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, target):
+    log.record(target, 'remove', target.id)
+
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_inserted(mapper, connection, target):
+    if target.post_id is not None:
+        log.record(target, 'comment', target.post_id, epoch(target.timestamp))
@@ -0,0 +1,154 @@
+__author__ = 'Stuart'
+"""
+Cache for username -> User lookups, used by the profile views (/user/<username>, follow, followers...) and the
+username validators of the registration and admin profile forms.
+
+Each process keeps an LRU of FLASKY_USER_CACHE_SIZE usernames. A hit gives back a User that is attached to the
+session without any SQL: the cached column values are put on a fresh instance, which is then merge(load=False)'d,
+so relationships (posts, followers) and the columns we don't cache load lazily as usual when touched.
+Not cached: last_seen, which changes on every request the user makes, and password_hash, which no profile view needs
+and has no business sitting in memory.
+
+Unknown usernames are cached too ("negative caching"), for FLASKY_USER_CACHE_NEGATIVE_TTL secs, so crawlers
+hammering /user/<random> don't reach the db. The form validators don't trust those: a name not being taken is
+exactly the thing they must get right, so they only short cut when the cache knows the name IS taken.
+
+Invalidation is all or nothing: when a commit adds, deletes or changes a user (other than last_seen), a generation
+counter in the local store goes up and every worker on the host drops its whole cache on its next lookup. Profile
+changes are rare enough that this costs nothing, and it avoids any window where one worker still has the old name.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from . import db, metrics
+from .database import RoutingSession
+from .localstore import get_store
+from .models import User
+
+
+GENERATION_KEY = 'usercache:generation'
+NOT_CACHED = ('last_seen', 'password_hash')
+_MISSING = object()
+
+
+class _State(object):
+    def __init__(self):
+        self.entries = OrderedDict()  # username -> (expires, column values or None for unknown usernames)
+        self.generation = None
+        self.lock = threading.Lock()
+
+
+def _state(app):
+    state = app.extensions.get('usercache')
+    if state is None:
+        state = app.extensions.setdefault('usercache', _State())
+    return state
+
+
+def _cached(app, state, username):
+    """
+    The cached values, None for a cached unknown username, _MISSING if we know nothing.
+    """
+    generation = get_store(app).get(GENERATION_KEY, 0)
+    with state.lock:
+        if generation != state.generation:
+            state.entries.clear()
+            state.generation = generation
+        entry = state.entries.get(username)
+        if entry is None:
+            return _MISSING, generation
+        if entry[0] < time.time():
+            del state.entries[username]
+            return _MISSING, generation
+        state.entries.move_to_end(username)
+        return entry[1], generation
+
+
+def _remember(app, state, generation, username, values):
+    ttl = app.config['FLASKY_USER_CACHE_TTL' if values is not None else 'FLASKY_USER_CACHE_NEGATIVE_TTL']
+    with state.lock:
+        if generation != state.generation:  # invalidated while we were reading, what we have may be stale
+            return
+        state.entries[username] = (time.time() + ttl, values)
+        state.entries.move_to_end(username)
+        while len(state.entries) > app.config['FLASKY_USER_CACHE_SIZE']:
+            state.entries.popitem(last=False)
+
+
+def _values(user):
+    return dict((attr.key, getattr(user, attr.key)) for attr in inspect(User).column_attrs
+                if attr.key not in NOT_CACHED)
+
+
+def _attach(values):
+    user = inspect(User).class_manager.new_instance()  # skips User.__init__, which would look up roles
+    for key, value in values.items():
+        set_committed_value(user, key, value)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def lookup(username, trust_negative=True):
+    """
+    Same as User.query.filter_by(username=username).first(), mostly without the query.
+    :param trust_negative: False to always check the db for usernames the cache thinks don't exist
+    :return: User or None
+    """
+    app = current_app._get_current_object()
+    state = _state(app)
+    values, generation = _cached(app, state, username)
+    if values is not None and values is not _MISSING:
+        metrics.cache_hit('users')
+        return _attach(values)
+    if values is None and trust_negative:
+        metrics.cache_hit('users')
+        return None
+    metrics.cache_miss('users')
+    user = User.query.filter_by(username=username).first()
+    _remember(app, state, generation, username, _values(user) if user is not None else None)
+    return user
+
+
+def invalidate(app=None):
+    def bump(generation):
+        generation = (generation or 0) + 1
+        return generation, generation
+    get_store(app or current_app).update(GENERATION_KEY, bump)
+
+
+def _mark(session):
+    session.info['usercache_dirty'] = True
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper, connection, target):
+    _mark(object_session(target))  # could be a name we have cached as unknown
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    _mark(object_session(target))
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[attr.key].history.has_changes() for attr in mapper.column_attrs
+           if attr.key != 'last_seen'):
+        _mark(object_session(target))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('usercache_dirty', False) and has_app_context():
+        invalidate()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('usercache_dirty', None)
@@ -0,0 +1,5 @@
+__author__ = 'Stuart'
+"""
+Benchmarks. Not part of the test suite, run them by hand from the project root, e.g.:
+    python -m benchmarks.db_profiles
+"""
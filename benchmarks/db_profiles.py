@@ -0,0 +1,132 @@
+__author__ = 'Stuart'
+"""
+Compares database engine profiles (config.db_profiles) under several processes hitting the same sqlite file at once,
+which is what happens with `gunicorn -w N manage:app`: each worker builds its own app and engine, and they all
+compete for the one database lock.
+
+Every worker process runs a mix of "index page" reads (newest 20 posts) and post inserts for a fixed time. Per
+profile we report throughput, latency percentiles and how many requests died with "database is locked".
+
+    python -m benchmarks.db_profiles --workers 4 --seconds 10 --write-ratio 0.2
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+
+def make_app(db_uri, profile):
+    from app import create_app
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_uri  # engines are built lazily, so this still takes effect
+    app.config['FLASKY_DB_PROFILE'] = profile
+    return app
+
+
+def seed(db_uri, profile, users=10, posts=200):
+    from app import db
+    from app.models import Role, User, Post
+    app = make_app(db_uri, profile)
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        authors = [User(email='bench{}@example.com'.format(i), username='bench{}'.format(i), password='cat',
+                        confirmed=True) for i in range(users)]
+        db.session.add_all(authors)
+        db.session.commit()
+        for i in range(posts):
+            db.session.add(Post(body='seed post {}'.format(i), author=authors[i % users]))
+        db.session.commit()
+        return [u.id for u in authors]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def worker(db_uri, profile, seconds, write_ratio, author_ids, results):
+    from sqlalchemy.exc import OperationalError
+    from app import db
+    from app.models import Post
+    app = make_app(db_uri, profile)
+    reads, writes, errors = [], [], 0
+    rng = random.Random(os.getpid())
+    with app.app_context():
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            is_write = rng.random() < write_ratio
+            start = time.time()
+            try:
+                if is_write:
+                    db.session.add(Post(body='benchmark *post*', author_id=rng.choice(author_ids)))
+                    db.session.commit()
+                else:
+                    Post.query.order_by(Post.timestamp.desc()).limit(20).all()
+                    db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+                continue
+            finally:
+                db.session.remove()  # same as the end of a request
+            (writes if is_write else reads).append(time.time() - start)
+    results.put((reads, writes, errors))
+
+
+def run_profile(profile, workers, seconds, write_ratio):
+    tmpdir = tempfile.mkdtemp(prefix='flasky-bench-')
+    try:
+        db_uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.sqlite')
+        author_ids = seed(db_uri, profile)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=worker,
+                                         args=(db_uri, profile, seconds, write_ratio, author_ids, results))
+                 for _ in range(workers)]
+        for p in procs:
+            p.start()
+        reads, writes, errors = [], [], 0
+        for _ in procs:
+            r, w, e = results.get()
+            reads += r
+            writes += w
+            errors += e
+        for p in procs:
+            p.join()
+        return {
+            'profile': profile,
+            'ops': (len(reads) + len(writes)) / float(seconds),
+            'writes': len(writes) / float(seconds),
+            'read_p50': percentile(reads, 50) * 1000,
+            'read_p95': percentile(reads, 95) * 1000,
+            'write_p95': percentile(writes, 95) * 1000,
+            'errors': errors,
+        }
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare database engine profiles under concurrent workers.')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--profiles', default='default,sqlite-tuned')
+    args = parser.parse_args()
+
+    rows = [run_profile(name, args.workers, args.seconds, args.write_ratio) for name in args.profiles.split(',')]
+    print('{:<16}{:>10}{:>10}{:>12}{:>12}{:>13}{:>9}'.format(
+        'profile', 'ops/s', 'writes/s', 'read p50ms', 'read p95ms', 'write p95ms', 'locked'))
+    for row in rows:
+        print('{profile:<16}{ops:>10.0f}{writes:>10.0f}{read_p50:>12.2f}{read_p95:>12.2f}{write_p95:>13.2f}'
+              '{errors:>9}'.format(**row))
+
+
+if __name__ == '__main__':
+    main()
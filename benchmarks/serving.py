@@ -0,0 +1,165 @@
+__author__ = 'Stuart'
+"""
+Load test for the serving presets in app/serving.py: how many requests at once can ONE gunicorn worker keep going
+when every request spends most of its time waiting, e.g. on SMTP or a slow query.
+
+For each mode we start gunicorn with a single worker on a seeded sqlite db. Every request to --path first waits
+--io-delay secs in a middleware (time.sleep, which gevent turns into a yield), then renders normally. Then
+--clients threads hammer it for --seconds. A sync worker finishes about 1/io-delay requests a second no matter how
+many clients there are; a gevent worker overlaps the waits and should get close to clients/io-delay until the CPU
+runs out. The index page costs enough CPU to run out early, /auth/login shows the waiting alone.
+
+    python -m benchmarks.serving --clients 100 --seconds 10 --io-delay 0.1 --modes sync,gevent --path /
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+
+class SlowIO(object):
+    """
+    WSGI middleware that makes every request wait before it is handled, standing in for network I/O.
+    """
+    def __init__(self, app, delay):
+        self.app = app
+        self.delay = delay
+
+    def __call__(self, environ, start_response):
+        time.sleep(self.delay)
+        return self.app(environ, start_response)
+
+
+_application = None
+
+
+def application(environ, start_response):
+    """
+    What gunicorn serves (benchmarks.serving:application). Built on the first request, in the worker, after gevent
+    has patched things, same as manage:app.
+    """
+    global _application
+    if _application is None:
+        from .db_profiles import make_app
+        app = make_app(os.environ['FLASKY_BENCH_DB'], 'auto')
+        _application = SlowIO(app.wsgi_app, float(os.environ['FLASKY_BENCH_IO_DELAY']))
+    return _application(environ, start_response)
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError('gunicorn did not come up on port {}'.format(port))
+
+
+def gunicorn_command(mode, port, connections):
+    from app.serving import gunicorn_argv
+    argv = gunicorn_argv(mode, app_path='benchmarks.serving:application', workers=1,
+                         bind='127.0.0.1:{}'.format(port), connections=connections)
+    local = os.path.join(os.path.dirname(sys.executable), 'gunicorn')  # the one in our virtualenv, if any
+    if os.path.exists(local):
+        argv[0] = local
+    return argv
+
+
+def load(url, clients, seconds):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def client():
+        mine, failed = [], 0
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                urlopen(url, timeout=30).read()
+            except Exception:
+                failed += 1
+                continue
+            mine.append(time.time() - start)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    started = time.time()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0], time.time() - started  # includes draining the requests queued at the deadline
+
+
+def run_mode(mode, db_uri, path, clients, seconds, io_delay):
+    from .db_profiles import percentile
+    port = free_port()
+    env = dict(os.environ, FLASKY_BENCH_DB=db_uri, FLASKY_BENCH_IO_DELAY=str(io_delay))
+    server = subprocess.Popen(gunicorn_command(mode, port, connections=clients * 2), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        url = 'http://127.0.0.1:{}{}'.format(port, path)
+        urlopen(url, timeout=30).read()  # warm up: builds the app
+        latencies, errors, elapsed = load(url, clients, seconds)
+    finally:
+        server.terminate()
+        server.wait()
+    throughput = len(latencies) / elapsed
+    return {
+        'mode': mode,
+        'rps': throughput,
+        'concurrency': throughput * io_delay,  # Little's law: requests waiting at once, on average
+        'p50': percentile(latencies, 50) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'errors': errors,
+    }
+
+
+def main():
+    from .db_profiles import seed
+    parser = argparse.ArgumentParser(description='Compare gunicorn serving presets with one worker under I/O wait.')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--io-delay', type=float, default=0.1)
+    parser.add_argument('--modes', default='sync,gevent')
+    parser.add_argument('--path', default='/', help='page to request, / lists posts from the db')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='flasky-bench-')
+    try:
+        db_uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.sqlite')
+        seed(db_uri, 'auto')
+        rows = [run_mode(mode, db_uri, args.path, args.clients, args.seconds, args.io_delay)
+                for mode in args.modes.split(',')]
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    print('{:<10}{:>10}{:>14}{:>10}{:>10}{:>9}'.format('mode', 'req/s', 'in flight', 'p50 ms', 'p99 ms', 'errors'))
+    for row in rows:
+        print('{mode:<10}{rps:>10.1f}{concurrency:>14.1f}{p50:>10.0f}{p99:>10.0f}{errors:>9}'.format(**row))
+
+
+if __name__ == '__main__':
+    main()
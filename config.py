@@ -15,12 +15,67 @@ class Config:
     FLASKY_MAIL_SUBJECT_PREFIX = '[Flasky]'
     FLASKY_MAIL_SENDER = 'Flasky Admin <flasky@example.com>'
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')  # email addy that when recognized is auto-promoted to admin
+    FLASKY_MAIL_OUTBOX = True  # queue emails in the outbox table for `manage.py worker` instead of sending in-request
+    FLASKY_OUTBOX_BATCH = 20  # rows a worker claims at a time
+    FLASKY_OUTBOX_CONCURRENCY = 4  # handlers running at once per worker process
+    FLASKY_OUTBOX_LEASE = 300  # secs a claimed row is reserved before another worker may retry it
+    FLASKY_OUTBOX_MAX_ATTEMPTS = 8
+    FLASKY_OUTBOX_RETRY_DELAY = 30  # secs before the 1st retry, doubling after each failure (capped at an hour)
     FLASKY_POSTS_PER_PAGE = 20
     FLASKY_COMMENTS_PER_PAGE = 30
     FLASKY_FOLLOWERS_PER_PAGE = 50
-    SQlALCHEMY_RECORD_QUERIES = True  # enable recording of q stats
-    FLASKY_SLOW_DB_QUERY_TIME = 0.5  # timeout of half sec
+    FLASKY_PAGE_TOTALS = 'exact'  # how listings get their total: exact, cached or none, see app/pagination.py
+    FLASKY_PAGE_TOTALS_TTL = 60  # secs a cached total may be stale
+    FLASKY_SLOW_DB_QUERY_TIME = 0.5  # statements slower than this go in the slow query log, see app/slowlog.py
+    FLASKY_DB_PROFILE = os.environ.get('FLASKY_DB_PROFILE') or 'auto'  # name from db_profiles below, or 'auto' to
+        # pick the tuned profile matching the database URL's dialect
     SSL_DISABLE = True
+    FLASKY_USER_CACHE_SIZE = 10000  # usernames each worker keeps in its username -> user cache, app/usercache.py
+    FLASKY_USER_CACHE_TTL = 300  # secs a cached user is used for. Changes invalidate it anyway, this is a backstop
+    FLASKY_USER_CACHE_NEGATIVE_TTL = 30  # secs we remember that a username doesn't exist
+    FLASKY_TIMELINE_CACHE_SIZE = 10000  # users whose newest followed post ids each worker keeps, app/timelinecache.py
+    FLASKY_TIMELINE_CACHE_EVENTS = 1000  # changes kept in the local store for workers to catch up on
+    FLASKY_HOT_HALF_LIFE = 6 * 3600  # secs after which a comment counts half as much for /hot, see app/trending.py
+    FLASKY_HOT_SIZE = 10000  # posts each worker keeps scores for
+    FLASKY_HOT_EVENTS = 1000  # post and comment inserts kept in the local store for workers to catch up on
+    FLASKY_LIVE_MAX_CONNECTIONS = 500  # new post event streams each worker serves at once, see app/live.py
+    FLASKY_LIVE_HEARTBEAT = 15  # secs between keepalive comments on an idle stream
+    FLASKY_LIVE_MAX_AGE = 25  # secs before a stream is closed and the client reconnects. Under gunicorn's timeout
+    FLASKY_LIVE_POLL = 1  # secs between each worker's checks for new posts
+    FLASKY_METRICS_TOKEN = os.environ.get('FLASKY_METRICS_TOKEN')  # bearer token for /metrics, unset: localhost only
+    FLASKY_METRICS_FLUSH = 5  # secs between each worker adding its counts to the shared totals, app/metrics.py
+    FLASKY_SAMPLER_RATE = float(os.environ.get('FLASKY_SAMPLER_RATE') or 0)  # fraction of requests to profile,
+        # see app/sampler.py. `manage.py sampler start` overrides it at runtime
+    FLASKY_SAMPLER_INTERVAL = 0.01  # secs between stack samples of a profiled request
+    FLASKY_SERVE_MODE = os.environ.get('FLASKY_SERVE_MODE') or 'sync'  # preset for manage.py serve, see app/serving.py
+    FLASKY_LIVE_EVENTS = bool(os.environ.get('FLASKY_LIVE_EVENTS')) or FLASKY_SERVE_MODE == 'gevent'  # /live streams,
+        # app/live.py. Each open one holds a whole sync worker (or the dev server), so only on with gevent by default
+    FLASKY_LOCAL_STORE = os.environ.get('FLASKY_LOCAL_STORE') or \
+        'sqlite:///' + os.path.join(basedir, 'tmp', 'localstore.sqlite')  # state shared by workers, app/localstore.py
+    FLASKY_API_RATE_LIMITS = {  # per client: (requests/sec sustained, burst). See app/api_1_0/admission.py
+        'read': (10, 50),
+        'write': (1, 10),
+        'token': (0.1, 5),
+        'ip': (20, 100),  # every request from an address, checked before authentication (password guessing)
+    }
+    FLASKY_API_MAX_INFLIGHT = 16  # API requests one worker process runs at once, the rest get a 503
+    FLASKY_GROUP_COMMIT = bool(os.environ.get('FLASKY_GROUP_COMMIT'))  # commit API inserts from concurrent requests
+        # together, see app/groupcommit.py
+    FLASKY_GROUP_COMMIT_WINDOW = 0.005  # secs the writer waits for more rows after the first
+    FLASKY_GROUP_COMMIT_MAX = 50  # rows per commit
+    FLASKY_GROUP_COMMIT_TIMEOUT = 10  # secs a request waits for its row to be committed, then gets a 503
+    SQLALCHEMY_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URL')  # read replica, None sends everything to primary
+    FLASKY_REPLICA_MAX_LAG = 5  # secs after a client writes during which its reads stay on the primary
+    FLASKY_REPLICA_RETRY = 30  # secs a replica that failed stays benched before we try it again
+    FLASKY_COMPRESS_MIN_SIZE = 500  # bytes, smaller responses go out uncompressed, see app/compression.py
+    FLASKY_COMPRESS_LEVEL = 6
+    FLASKY_STATIC_BUILD = True  # serve the fingerprinted files from `manage.py assets`, see app/assets.py
+    FLASKY_STATIC_MAX_AGE = 365 * 24 * 3600  # Cache-Control max-age of fingerprinted static files
+    FLASKY_SERVER_SESSIONS = bool(os.environ.get('FLASKY_SERVER_SESSIONS'))  # sessions in the local store, cookie
+        # holds only an id. See app/sessions.py
+    FLASKY_SESSION_IDLE = 7 * 24 * 3600  # secs of inactivity after which a server side session is evicted
+    FLASKY_ARCHIVE_AFTER_DAYS = 365  # `manage.py archive` moves older posts to the archive tables, app/archive.py
+    FLASKY_SCHEDULER_POLL = 30  # secs between `manage.py scheduler` checks for jobs due, see app/scheduler.py
 
     @staticmethod
     def init_app(app):
@@ -32,6 +87,7 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    FLASKY_STATIC_BUILD = False  # so edits to static files show on reload, without a `manage.py assets`
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
 
@@ -40,6 +96,8 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir,'data-test.sqlite')
     WTF_CSRF_ENABLED = False  # since extracting and parsing the CSRF token in tests is a bitch, easier to disable
+    FLASKY_LOCAL_STORE = 'memory://'  # fresh for every app, so tests don't share rate limit buckets
+    FLASKY_PASSWORD_HASH_METHOD = 'pbkdf2:sha1:1'  # 1 round, not thousands: hashing was most of the suite's time
 
 class ProductionConfig(Config):
     """
@@ -54,7 +112,8 @@ class ProductionConfig(Config):
     Good for factory methods, like this.
     https://julien.danjou.info/blog/2013/guide-python-static-class-abstract-methods
     """
-    import psycopg2
+    # no `import psycopg2` here: sqlalchemy imports the driver when it builds the engine, and only if DATABASE_URL
+    # is postgres. Importing it here cost every process the import, and broke sqlite deployments without it
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir,'data.sqlite')
 
@@ -120,6 +179,42 @@ class UnixConfig(ProductionConfig):
         syslog_handler.setLevel(logging.WARNING)
         app.logger.addHandler(syslog_handler)
 
+# Named database engine profiles, picked with FLASKY_DB_PROFILE and applied by app/database.py when the engine is
+# built. SQLite settings are PRAGMAs run on every new DBAPI connection (connect event), since sqlite keeps most of them
+# per connection. Postgres settings are pool arguments for create_engine plus a server side statement timeout.
+#   journal_mode  - WAL lets readers carry on while one writer commits, instead of the rollback journal locking everyone
+#   synchronous   - NORMAL only fsyncs at checkpoints in WAL mode. Still safe against corruption, may lose the very
+#                   last commits on power loss (not on a process crash)
+#   cache_size    - negative means KiB, so -16000 is ~16MB of page cache per connection
+#   mmap_size     - bytes of the db file read through memory mapping instead of read() calls
+#   busy_timeout  - ms to wait for a lock before giving up with "database is locked"
+#   pre_ping      - test each pooled connection with SELECT 1 when checked out, so a restarted postgres doesn't
+#                   turn into a 500 for the first request on every stale connection
+#   statement_timeout - ms before postgres cancels a runaway query
+db_profiles = {
+    'default': {},  # whatever the driver does out of the box
+    'sqlite-tuned': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'busy_timeout': 5000,
+    },
+    'postgres-tuned': {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pre_ping': True,
+        'statement_timeout': 15000,
+    },
+}
+db_profiles_by_dialect = {
+    'sqlite': 'sqlite-tuned',
+    'postgresql': 'postgres-tuned',
+    'postgres': 'postgres-tuned',
+}
+
 config = {
     'development' : DevelopmentConfig,
     'testing' : TestingConfig,
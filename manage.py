@@ -19,37 +19,45 @@ if os.environ.get('FLASK_COVERAGE'):
 #         if len(var) == 2:
 #             os.environ[var[0]] = var[1]
 
+import sys
 from app import create_app, db
-from app.models import User, Role, Post, Follow, Permission, Comment
-from flask.ext.script import Manager,Shell
-from flask.ext.migrate import Migrate, MigrateCommand
+from flask.ext.script import Manager, Shell, Command
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 manager = Manager(app)
-migrate = Migrate(app,db)
 
 def make_shell_context():
+    from app.models import User, Role, Post, Follow, Permission, Comment
     return dict(app=app,db=db, User=User, Role=Role, Post=Post, Follow=Follow, Permission=Permission, Comment=Comment)
 manager.add_command("shell", Shell(make_context=make_shell_context))
-manager.add_command('db', MigrateCommand)
+
+def init_migrate():
+    """
+    Flask-Migrate pulls in alembic and mako, which is a good chunk of the import time of this file. gunicorn workers
+    import manage:app and never migrate, so only the commands that need it load it. See `manage.py startup-report`.
+    :return: the `db` command
+    """
+    from flask.ext.migrate import Migrate, MigrateCommand
+    Migrate(app, db)
+    return MigrateCommand
 
 @manager.command  # implements custom commands
-def test(coverage=False):
+def test(coverage=False, jobs=1):
     """
     Run the unit tests.
     To invoke: python manage.py test
+    python manage.py test --jobs 4 runs the test modules in 4 processes, see tests/runner.py
 
     Coverage tools measure how much of app is being tested, and reports on what parts are/aren't.
+    Coverage only sees this process, so with --coverage the tests run in it, one by one.
 
     :return:
     """
     if coverage and not os.environ.get('FLASK_COVERAGE'):
-        import sys
         os.environ['FLASK_COVERAGE'] = '1'
         os.execvp(sys.executable, [sys.executable] + sys.argv)
-    import unittest
-    tests = unittest.TestLoader().discover('tests')
-    unittest.TextTestRunner(verbosity=2).run(tests)
+    from tests.runner import run
+    passed = run('tests', jobs=1 if COV else int(jobs))
     if COV:
         COV.stop()
         COV.save()
@@ -60,6 +68,8 @@ def test(coverage=False):
         COV.html_report(directory=covdir)
         print('HTML version: file://{}/index.html'.format(covdir))
         COV.erase()
+    if not passed:
+        sys.exit(1)
 
 @manager.command
 def profile(length=25, profile_dir=None):
@@ -89,6 +99,229 @@ def profile(length=25, profile_dir=None):
     app.wsgi_app = ProfilerMiddleware(app.wsgi_app, restrictions=[length], profile_dir=profile_dir)
     app.run()
 
+@manager.command
+def serve(mode='', workers=0, bind='', connections=0):
+    """
+    Runs the app under gunicorn with one of the presets in app/serving.py. This is what the Procfile uses.
+    python manage.py serve --mode gevent --bind 0.0.0.0:8000
+
+    :param mode: sync or gevent, defaults to FLASKY_SERVE_MODE
+    :param workers: worker processes, defaults to the preset's
+    :param bind: address to listen on, gunicorn's default ($PORT or 127.0.0.1:8000) if not given
+    :param connections: greenlets per gevent worker
+    :return:
+    """
+    from app.serving import gunicorn_argv
+    argv = gunicorn_argv(mode or app.config['FLASKY_SERVE_MODE'], workers=int(workers), bind=bind,
+                         connections=int(connections))  # Flask-Script hands us strings
+    os.execvp(argv[0], argv)  # gunicorn imports manage:app itself, in each worker after patching
+
+@manager.command
+def worker(concurrency=0, interval=1.0, once=False):
+    """
+    Runs the outbox worker, which carries out side effects (emails...) queued by requests. See app/outbox.py.
+    Run as many of these as you like, they coordinate through row leases in the db.
+
+    :param concurrency: handlers running at the same time, defaults to FLASKY_OUTBOX_CONCURRENCY
+    :param interval: secs to sleep when there is nothing to do
+    :param once: exit when the outbox is empty instead of waiting for more
+    :return:
+    """
+    from app.outbox import run_worker
+    run_worker(app, concurrency=int(concurrency) or None, poll_interval=float(interval), once=once)
+
+@manager.command
+def scheduler(once=False, show=False):
+    """
+    Runs the periodic jobs (outbox purge, archiving, local store purge...) when they're due. See app/scheduler.py.
+    Several can run for redundancy, each job still runs once per due time, they lock through the db.
+
+    :param once: run what is due now and exit
+    :param show: list the jobs, when they run next and how their last run went, instead
+    :return:
+    """
+    from app import scheduler as jobs
+    if not show:
+        for name in jobs.run(app, once=once) or []:
+            print('{} done'.format(name))
+        return
+    for job, row in jobs.status(jobs.load_jobs()):
+        last = 'never run' if not row.runs else '{} runs, last {:%Y-%m-%d %H:%M} took {:.1f}s{}'.format(
+            row.runs, row.last_started_at, row.last_duration, ', ' + row.last_error if row.last_error else '')
+        print('{:<20} {:<22} next {:%Y-%m-%d %H:%M}  {}'.format(job.name, job.schedule, row.next_run_at, last))
+
+sampler_manager = Manager(usage='Control the sampling profiler, see app/sampler.py')
+manager.add_command('sampler', sampler_manager)
+
+@sampler_manager.command
+def start(rate=0.05):
+    """
+    Profile this fraction of requests from now on, in every worker on this host. Takes up to FLASKY_SAMPLER_POLL secs.
+    """
+    from app import sampler
+    sampler.start(app, float(rate))
+
+@sampler_manager.command
+def stop():
+    """
+    Stop profiling. What was collected stays until `sampler reset`.
+    """
+    from app import sampler
+    sampler.stop(app)
+
+@sampler_manager.command
+def reset():
+    """
+    Throw away the samples collected so far, e.g. before profiling a new release.
+    """
+    from app import sampler
+    sampler.reset(app)
+
+@sampler_manager.command
+def export(out='stacks.folded', endpoint=''):
+    """
+    Writes the samples as collapsed stacks, ready for `flamegraph.pl stacks.folded > flame.svg` or speedscope.
+
+    :param out: file to write
+    :param endpoint: only this endpoint, e.g. main.index
+    :return:
+    """
+    from app import sampler
+    lines = sampler.export(app, endpoint or None)
+    with open(out, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    print('{} stacks written to {}'.format(len(lines), out))
+
+@sampler_manager.command
+def diff(before, after, out='diff.folded'):
+    """
+    Compares two exports, e.g. of the previous and the current release. Writes a differential flame graph input
+    (`flamegraph.pl diff.folded > diff.svg`) and prints the functions whose share of samples changed most.
+    """
+    from app.sampler import read_collapsed, diff as diff_stacks
+    lines, changes = diff_stacks(read_collapsed(before), read_collapsed(after))
+    with open(out, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    for change, name in changes[:20]:
+        print('{:>+8.1%}  {}'.format(change, name))
+
+@manager.command
+def slowlog(limit=10, reset=False):
+    """
+    The slow queries that cost the most time in total, across all workers on this host, with their query plans.
+    See app/slowlog.py.
+
+    :param limit: how many fingerprints to show
+    :param reset: forget everything recorded so far instead
+    :return:
+    """
+    from app import slowlog as log
+    from app.slowlog import percentile
+    if reset:
+        log.reset(app)
+        return
+    for entry in log.report(app)[:int(limit)]:
+        print('{fingerprint}  {count} times, {total:.1f}s total, p50 {p50:.2f}s  p95 {p95:.2f}s  p99 {p99:.2f}s  '
+              'max {max:.2f}s, last in {endpoint}'.format(
+                  p50=percentile(entry, 50), p95=percentile(entry, 95), p99=percentile(entry, 99), **entry))
+        print('    ' + entry['statement'])
+        for line in entry['plan'] or []:
+            print('      | ' + line)
+        print('')
+
+def startup_report(limit=20):
+    """
+    Shows where start up time goes: the slowest imports, import time per package, and each step of create_app().
+    Measured in a fresh interpreter, since in this one everything is imported already.
+
+    :param limit: rows per table
+    :return:
+    """
+    import subprocess
+    from app import startup
+    script = os.path.splitext(startup.__file__)[0] + '.py'
+    subprocess.call([sys.executable, script, os.getenv('FLASK_CONFIG') or 'default', str(int(limit))])
+manager.add_command('startup-report', Command(startup_report))  # add_command, since the name has a dash
+
+@manager.command
+def rerender(model='all', chunk=500, processes=0, start_id=0, resume=False):
+    """
+    Renders body_html again for existing posts and comments, e.g. after changing POST_ALLOWED_TAGS in app/models.py.
+    See app/rerender.py.
+
+    :param model: posts, comments or all
+    :param chunk: rows per batch
+    :param processes: rendering processes, defaults to one per CPU
+    :param start_id: only rows with a greater id
+    :param resume: start after the last id a previous (interrupted) run finished
+    """
+    import time
+    from app import rerender as bulk
+    for name in sorted(bulk.MODELS) if model == 'all' else [model]:
+        first = bulk.checkpoint(app, name) if resume else int(start_id)
+        started = time.time()
+
+        def progress(done, total, changed, last_id):
+            rate = done / max(time.time() - started, 1e-6)
+            sys.stdout.write('\r{}: {}/{} rows, {} changed, {:.0f} rows/s, last id {}   '.format(
+                name, done, total, changed, rate, last_id))
+            sys.stdout.flush()
+        done, changed = bulk.rerender(app, name, start_id=first, chunk=int(chunk),
+                                      processes=int(processes) or None, progress=progress)
+        print('\n{}: {} rows in {:.1f}s, {} changed'.format(name, done, time.time() - started, changed))
+
+@manager.command
+def archive(days=0, chunk=1000):
+    """
+    Moves old posts and their comments to the archive tables. See app/archive.py.
+
+    :param days: archive posts older than this, defaults to FLASKY_ARCHIVE_AFTER_DAYS
+    :param chunk: posts per transaction
+    """
+    import datetime
+    from app.archive import archive as move
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=int(days) or app.config['FLASKY_ARCHIVE_AFTER_DAYS'])
+
+    def progress(posts, comments):
+        sys.stdout.write('\r{} posts, {} comments archived'.format(posts, comments))
+        sys.stdout.flush()
+    posts, comments = move(cutoff, chunk=int(chunk), progress=progress)
+    print('\n{} posts and {} comments older than {:%Y-%m-%d} archived'.format(posts, comments, cutoff))
+
+@manager.command
+def transfer(target, source='', chunk=1000, processes=4):
+    """
+    Copies all tables to another database, e.g. from the sqlite file to postgres, then compares row counts and
+    checksums of both sides. See app/transfer.py. Afterwards run `python manage.py db stamp head` against the target.
+
+    :param target: SQLAlchemy URL of the new database, its tables must be empty
+    :param source: SQLAlchemy URL to copy from, defaults to the app's database
+    :param chunk: rows per batch
+    :param processes: tables copied at the same time
+    """
+    from app.transfer import transfer as copy_all
+    try:
+        report = copy_all(source or app.config['SQLALCHEMY_DATABASE_URI'], target, chunk=int(chunk),
+                          processes=int(processes), progress=lambda line: print(line))
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    for name, source_rows, target_rows, ok in report:
+        print('{:<20} {:>10} {:>10}  {}'.format(name, source_rows, target_rows, 'ok' if ok else 'MISMATCH'))
+    if not all(ok for _, _, _, ok in report):
+        sys.exit(1)
+
+@manager.command
+def assets():
+    """
+    Fingerprints and gzips the static files into app/static/build/, see app/assets.py. Workers started after this
+    serve the new names.
+    """
+    from app.assets import build
+    manifest = build(app.static_folder)
+    for name, built in sorted(manifest.items()):
+        print('{} -> {}'.format(name, built))
+
 @manager.command
 def deploy():
     """
@@ -104,6 +337,7 @@ def deploy():
     """Run deployment tasks."""
     from flask.ext.migrate import upgrade
     from app.models import Role, User
+    init_migrate()
 
     # migrate DB to latest revision
     upgrade()
@@ -114,5 +348,10 @@ def deploy():
     #create self-follows for all users
     User.add_self_follows()
 
+    # fingerprinted, precompressed static files
+    assets()
+
 if __name__=="__main__":
+    if sys.argv[1:2] in (['db'], [], ['-?'], ['-h'], ['--help']):  # only pay for alembic when it can be used
+        manager.add_command('db', init_migrate())
     manager.run()
\ No newline at end of file
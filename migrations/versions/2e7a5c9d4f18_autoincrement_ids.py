@@ -0,0 +1,37 @@
+"""posts and comments ids never reused
+
+Revision ID: 2e7a5c9d4f18
+Revises: 8b4f2d6e9a13
+Create Date: 2015-08-24 09:31:12.640917
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2e7a5c9d4f18'
+down_revision = '8b4f2d6e9a13'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Without AUTOINCREMENT sqlite gives out max(id) + 1, so once archive.py moved the newest rows away their ids
+    # came back for new rows, and the archived ones became unreachable by id. Postgres sequences never go back,
+    # nothing to do there. sqlite can't ALTER that, the tables are rebuilt.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table, archived in (('posts', 'posts_archive'), ('comments', 'comments_archive')):
+        with op.batch_alter_table(table, recreate='always', table_kwargs={'sqlite_autoincrement': True}):
+            pass
+        op.execute("INSERT INTO sqlite_sequence (name, seq) SELECT '{0}', 0 WHERE NOT EXISTS "
+                   "(SELECT 1 FROM sqlite_sequence WHERE name = '{0}')".format(table))
+        op.execute("UPDATE sqlite_sequence SET seq = (SELECT MAX(id) FROM {1}) WHERE name = '{0}' "
+                   "AND seq < (SELECT MAX(id) FROM {1})".format(table, archived))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table in ('comments', 'posts'):
+        with op.batch_alter_table(table, recreate='always'):
+            pass
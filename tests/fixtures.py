@@ -0,0 +1,166 @@
+__author__ = 'Stuart'
+"""
+Base class for the tests, so each test case doesn't have to build its own app and database.
+
+Building the schema with create_all() and filling the roles for every single test, then drop_all(), on a sqlite file
+is most of the time the suite takes. Instead, the first test in a process builds that database once in memory and
+dumps it to SQL. Every test after that gets a fresh in-memory db loaded from the dump, which is a few ms, and it
+vanishes when the test is done. Tests can commit, roll back, whatever they like, nothing leaks into the next one.
+
+Some tests need a real file: WAL mode, a second connection, threads each with their own connection. Those set
+`database = 'file'` and get the old create_all(), on a file of their own per process so parallel runs
+(`manage.py test --jobs N`, see runner.py) don't trip over each other, removed again with its -wal/-shm when the
+test is done. With TEST_DATABASE_URL set (e.g. postgres),
+every test uses that, the old way.
+
+A test request context is pushed too, so url_for() works in the tests themselves.
+
+assertMaxQueries() puts a budget on the SQL a block of code (usually one test client request) may send:
+
+    with self.assertMaxQueries(4):
+        self.client.get(url_for('main.index'))
+
+Going over fails the test with every statement listed, repeated shapes counted together, so an N+1 shows up as
+"20x SELECT ... FROM comments WHERE ? = comments.post_id".
+"""
+
+import os
+import tempfile
+import unittest
+from base64 import b64encode
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import create_app, db
+from app.models import Role, User, Post, Comment
+from app.slowlog import normalize
+
+
+_template = None  # the schema and roles as an SQL script, built once per process
+
+
+def _template_sql():
+    global _template
+    if _template is None:
+        app = create_app('testing')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        with app.app_context():
+            db.create_all()
+            Role.insert_roles()
+            db.session.remove()
+            engine = db.get_engine(app)
+            conn = engine.raw_connection()
+            _template = '\n'.join(conn.connection.iterdump())
+            conn.close()
+            engine.dispose()
+    return _template
+
+
+class QueryCounter(object):
+    """
+    Records the statements sent to any engine while it's active.
+    """
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __len__(self):
+        return len(self.statements)
+
+    def summary(self):
+        """
+        One line per statement shape, most repeated first.
+        """
+        shapes = Counter(normalize(statement) for statement in self.statements)
+        return '\n'.join('{:>4}x {}'.format(n, shape) for shape, n in shapes.most_common())
+
+
+class FlaskyTestCase(unittest.TestCase):
+    database = 'memory'  # or 'file'
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.in_memory = self.database == 'memory' and not os.environ.get('TEST_DATABASE_URL')
+        self.db_file = None
+        if self.in_memory:
+            self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        elif not os.environ.get('TEST_DATABASE_URL'):
+            self.db_file = os.path.join(tempfile.gettempdir(), 'flasky-test-{}.sqlite'.format(os.getpid()))
+            self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.db_file
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        if self.in_memory:
+            conn = db.engine.raw_connection()  # the one connection the in-memory db lives in
+            conn.connection.executescript(_template_sql())
+            conn.close()
+        else:
+            db.create_all()
+            Role.insert_roles()
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+
+    def tearDown(self):
+        self.request_context.pop()
+        db.session.remove()
+        if self.in_memory:
+            db.get_engine(self.app).dispose()  # closes the connection, and with it the db
+        elif self.db_file:
+            db.get_engine(self.app).dispose()
+            for path in (self.db_file, self.db_file + '-wal', self.db_file + '-shm'):
+                if os.path.exists(path):
+                    os.remove(path)
+        else:
+            db.drop_all()
+        self.app_context.pop()
+
+    def add_site(self, users=5, posts=2, role='User'):
+        """
+        A small site for query budget tests: every user writes `posts` posts, comments once on every post and
+        follows everyone. Users are u0@example.com... with password cat, usernames u0...
+        :return: ids of the users
+        """
+        role = Role.query.filter_by(name=role).first()
+        authors = [User(email='u{}@example.com'.format(i), username='u{}'.format(i), password='cat', confirmed=True,
+                        role=role) for i in range(users)]
+        db.session.add_all(authors)
+        for author in authors:
+            for i in range(posts):
+                post = Post(body='post {} of {}'.format(i, author.username), author=author)
+                db.session.add_all([Comment(body='comment', author=a, post=post) for a in authors])
+        db.session.commit()
+        for author in authors:
+            for other in authors:
+                author.follow(other)
+        db.session.commit()
+        return [author.id for author in authors]
+
+    def get_api_headers(self, username, password):
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @contextmanager
+    def assertMaxQueries(self, budget, what='block'):
+        """
+        The session is cleared first, as a real request would start with an empty one, or objects the test itself
+        created would come out of the identity map for free and hide queries. Keep ids, not objects, across it.
+        """
+        db.session.remove()
+        with QueryCounter() as queries:
+            yield queries
+        if len(queries) > budget:
+            self.fail('{} sent {} SQL statements, budget is {}:\n{}'.format(
+                what, len(queries), budget, queries.summary()))
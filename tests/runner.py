@@ -0,0 +1,57 @@
+__author__ = 'Stuart'
+"""
+Runs the test modules in parallel, for `python manage.py test --jobs N`.
+
+Each test module is one job, handed to a pool of N processes as they free up, so one slow module doesn't hold up a
+whole shard. Every process builds its template db once (see fixtures.py) and reuses it for all its modules. Output
+of a module is printed in one piece when it's done, so it doesn't interleave.
+"""
+
+import fnmatch
+import io
+import multiprocessing
+import os
+import sys
+import time
+import unittest
+
+
+def _run_module(args):
+    start_dir, name, verbosity = args
+    if start_dir not in sys.path:
+        sys.path.insert(0, start_dir)
+    stream = io.StringIO()
+    suite = unittest.TestLoader().loadTestsFromName(name)
+    result = unittest.TextTestRunner(stream=stream, verbosity=verbosity).run(suite)
+    return name, stream.getvalue(), result.testsRun, len(result.failures), len(result.errors), len(result.skipped)
+
+
+def modules(start_dir, pattern='test*.py'):
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(start_dir) if fnmatch.fnmatch(f, pattern))
+
+
+def run(start_dir='tests', jobs=1, verbosity=2, pattern='test*.py'):
+    """
+    :return: True if everything passed
+    """
+    start_dir = os.path.abspath(start_dir)
+    if jobs <= 1:
+        tests = unittest.TestLoader().discover(start_dir, pattern=pattern)
+        return unittest.TextTestRunner(verbosity=verbosity).run(tests).wasSuccessful()
+
+    started = time.time()
+    totals = [0, 0, 0, 0]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for name, output, ran, failures, errors, skipped in pool.imap_unordered(
+                _run_module, [(start_dir, name, verbosity) for name in modules(start_dir, pattern)]):
+            sys.stdout.write('=== {}\n{}'.format(name, output))
+            for i, n in enumerate((ran, failures, errors, skipped)):
+                totals[i] += n
+    finally:
+        pool.close()
+        pool.join()
+    ran, failures, errors, skipped = totals
+    print('Ran {} tests in {:.2f}s with {} processes: {} failures, {} errors, {} skipped'.format(
+        ran, time.time() - started, jobs, failures, errors, skipped))
+    return failures == 0 and errors == 0
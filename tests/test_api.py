@@ -2,33 +2,17 @@ __author__ = 'Stuart'
 import unittest
 import json
 import re
-from base64 import b64encode
 from flask import url_for
-from app import create_app, db
+from app import db
 from app.models import User, Role, Post, Comment
+from fixtures import FlaskyTestCase
 
-class APITestCase(unittest.TestCase):
+
+class APITestCase(FlaskyTestCase):
     def setUp(self):
-        self.app = create_app('testing')
-        self.app_context = self.app.app_context()
-        self.app_context.push()
-        db.create_all()
-        Role.insert_roles()
+        super(APITestCase, self).setUp()
         self.client = self.app.test_client()
 
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-        self.app_context.pop()
-
-    def get_api_headers(self, username, password):
-        return {
-            'Authorization':'Basic ' + b64encode(
-                    (username + ':' + password).encode('utf-8')).decode('utf-8'),
-            'Accept': 'application/json',
-            'Content-Type':'application/json'
-        }
-
     def test_404(self):
         response = self.client.get(
             '/wrong/url',
@@ -274,4 +258,98 @@ class APITestCase(unittest.TestCase):
         self.assertTrue(response.status_code == 200)
         json_response = json.loads(response.data.decode('utf-8'))
         self.assertIsNotNone(json_response.get('posts'))
-        self.assertTrue(json_response.get('count', 0) == 2)
\ No newline at end of file
+        self.assertTrue(json_response.get('count', 0) == 2)
+
+    def test_query_budgets(self):
+        """
+        Same as test_client's page budgets: a list endpoint costs a fixed number of queries, not one or two per item.
+        """
+        ids = self.add_site()
+        post_id = Post.query.filter_by(author_id=ids[1]).first().id
+        headers = self.get_api_headers('u0@example.com', 'cat')
+        budgets = [
+            (url_for('api.get_posts'), 3),
+            (url_for('api.get_post', id=post_id), 3),
+            (url_for('api.get_user', id=ids[1]), 3),
+            (url_for('api.get_user_posts', id=ids[1]), 4),
+            (url_for('api.get_user_followed_posts', id=ids[1]), 5),  # a timeline cache miss, see timelinecache.py
+            (url_for('api.get_comments'), 2),
+            (url_for('api.get_post_comments', id=post_id), 3),
+        ]
+        for url, budget in budgets:
+            with self.assertMaxQueries(budget, url):
+                response = self.client.get(url, headers=headers)
+            self.assertTrue(response.status_code == 200)
+
+    def test_expand(self):
+        ids = self.add_site(users=3, posts=2)
+        headers = self.get_api_headers('u0@example.com', 'cat')
+
+        def get(url, budget):
+            with self.assertMaxQueries(budget, url):
+                response = self.client.get(url, headers=headers)
+            self.assertTrue(response.status_code == 200)
+            return json.loads(response.data.decode('utf-8'))
+
+        # 2 queries for the authors (users, post counts) and 1 for all the comments, on top of the plain list
+        posts = get(url_for('api.get_posts', expand='author,comments'), 4 + 3)['posts']
+        self.assertTrue(len(posts) == 6)
+        for post in posts:
+            self.assertTrue(post['author']['username'] in ('u0', 'u1', 'u2'))
+            self.assertTrue(post['author']['post_count'] == 2)
+            self.assertTrue(len(post['comments']) == 3 == post['comment_count'])
+            self.assertTrue(all(c['post'] == post['url'] for c in post['comments']))
+
+        comments = get(url_for('api.get_comments', expand='post,author'), 3 + 4)['posts']
+        self.assertTrue(len(comments) == 18)
+        self.assertTrue(all(c['post']['comment_count'] == 3 and 'username' in c['author'] for c in comments))
+
+        post_id = Post.query.filter_by(author_id=ids[1]).first().id
+        post = get(url_for('api.get_post', id=post_id, expand='author'), 3 + 2)
+        self.assertTrue(post['author']['username'] == 'u1')
+        self.assertTrue(post['comments'].startswith('http'))  # not asked for
+
+        # the next page is of the same list, still expanded
+        self.app.config['FLASKY_POSTS_PER_PAGE'] = 1
+        self.app.config['FLASKY_COMMENTS_PER_PAGE'] = 2
+        for endpoint, id in (('api.get_user_posts', ids[1]), ('api.get_user_followed_posts', ids[0]),
+                             ('api.get_post_comments', post_id)):
+            first = get(url_for(endpoint, id=id, expand='author'), 20)
+            self.assertTrue(first['next'] == url_for(endpoint, id=id, page=2, expand='author', _external=True))
+            second = get(first['next'], 20)
+            self.assertTrue(second['prev'] == url_for(endpoint, id=id, page=1, expand='author', _external=True))
+            self.assertTrue(second['count'] == first['count'] and 'username' in second['posts'][0]['author'])
+        user_posts = get(url_for('api.get_user_posts', id=ids[1], page=2), 20)['posts']
+        self.assertTrue(user_posts[0]['author'].endswith(url_for('api.get_user', id=ids[1])))
+
+        response = self.client.get(url_for('api.get_posts', expand='author,email'), headers=headers)
+        self.assertTrue(response.status_code == 400)
+
+    def test_fields(self):
+        ids = self.add_site(users=3, posts=2)
+        headers = self.get_api_headers('u0@example.com', 'cat')
+
+        def get(url, budget):
+            with self.assertMaxQueries(budget, url):
+                response = self.client.get(url, headers=headers)
+            self.assertTrue(response.status_code == 200)
+            return json.loads(response.data.decode('utf-8'))
+
+        # no comment counts: the page and the total only
+        posts = get(url_for('api.get_posts', fields='url,body_html,timestamp'), 2)['posts']
+        self.assertTrue(len(posts) == 6)
+        self.assertTrue(all(sorted(post) == ['body_html', 'timestamp', 'url'] for post in posts))
+
+        # a relation is only expanded if its field is wanted
+        posts = get(url_for('api.get_posts', fields='body,author', expand='author,comments'), 2 + 2)['posts']
+        self.assertTrue(all(sorted(post) == ['author', 'body'] and 'username' in post['author'] for post in posts))
+
+        user = get(url_for('api.get_user', id=ids[1], fields='username'), 2)
+        self.assertTrue(user == {'username': 'u1'})
+        comments = get(url_for('api.get_comments', fields='body'), 2)['posts']
+        self.assertTrue(len(comments) == 18 and all(list(c) == ['body'] for c in comments))
+
+        response = self.client.post(url_for('api.new_post', fields='url,password'), headers=headers,
+                                    data=json.dumps({'body': 'not written'}))
+        self.assertTrue(response.status_code == 400)
+        self.assertIsNone(Post.query.filter_by(body='not written').first())
@@ -0,0 +1,83 @@
+__author__ = 'Stuart'
+import unittest
+import datetime
+import json
+from flask import url_for
+from app import db
+from app.archive import archive, get_comment_or_404
+from app.models import Post, Comment, ArchivedPost, ArchivedComment
+from fixtures import FlaskyTestCase
+
+
+class ArchiveTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+        self.add_site(users=2, posts=3)
+        self.old_ids = [id for id, in db.session.query(Post.id).order_by(Post.id).limit(4)]
+        long_ago = datetime.datetime.utcnow() - datetime.timedelta(days=800)
+        Post.query.filter(Post.id.in_(self.old_ids)).update({'timestamp': long_ago}, synchronize_session=False)
+        db.session.commit()
+        self.cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=365)
+        self.client = self.app.test_client(use_cookies=True)
+
+    def api_get(self, url):
+        headers = self.get_api_headers('u0@example.com', 'cat')
+        response = self.client.get(url, headers=headers)
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def test_old_posts_move_with_their_comments(self):
+        moved = []
+        self.assertTrue(archive(self.cutoff, chunk=3, progress=lambda *args: moved.append(args)) == (4, 8))
+        self.assertTrue(moved == [(3, 6), (4, 8)])
+        self.assertTrue(Post.query.count() == 2 and Comment.query.count() == 4)
+        self.assertTrue(ArchivedPost.query.count() == 4 and ArchivedComment.query.count() == 8)
+        self.assertTrue(sorted(p.id for p in ArchivedPost.query) == self.old_ids)
+        self.assertTrue(all(c.post_id in self.old_ids for c in ArchivedComment.query))
+        self.assertTrue(archive(self.cutoff) == (0, 0))  # idempotent
+
+    def test_hot_listings_skip_archived_posts(self):
+        archive(self.cutoff)
+        status, posts = self.api_get(url_for('api.get_posts'))
+        self.assertTrue(posts['count'] == 2)
+        self.assertTrue(not set(self.old_ids) & set(int(p['url'].rstrip('/').split('/')[-1]) for p in posts['posts']))
+
+    def test_permalinks_resolve_archived_posts(self):
+        post_id = self.old_ids[0]
+        body_html = Post.query.get(post_id).body_html
+        archive(self.cutoff)
+        self.client.post(url_for('auth.login'), data={'email': 'u0@example.com', 'password': 'cat'})
+        response = self.client.get(url_for('main.post', id=post_id))
+        self.assertTrue(response.status_code == 200)
+        data = response.get_data(as_text=True)
+        self.assertTrue(body_html in data)
+        self.assertTrue('2 Comments' in data)
+        self.assertTrue('comment-form' not in data)  # read only
+        self.assertTrue(self.client.get(url_for('main.post', id=12345)).status_code == 404)
+
+    def test_api_details_resolve_archived_rows(self):
+        post_id = self.old_ids[0]
+        archive(self.cutoff)
+        status, post = self.api_get(url_for('api.get_post', id=post_id))
+        self.assertTrue(status == 200 and post['comment_count'] == 2)
+        self.assertTrue(post['url'].endswith(url_for('api.get_post', id=post_id)))
+        status, comments = self.api_get(url_for('api.get_post_comments', id=post_id))
+        self.assertTrue(status == 200 and len(comments['posts']) == 2)
+        comment_id = ArchivedComment.query.filter_by(post_id=post_id).first().id
+        status, comment = self.api_get(url_for('api.get_comment', id=comment_id))
+        self.assertTrue(status == 200 and comment['post'] == post['url'])
+
+    def test_archived_ids_are_not_handed_out_again(self):
+        old_post = Post.query.get(self.old_ids[0])
+        comment = Comment(body='late reply', post=old_post, author_id=old_post.author_id)
+        db.session.add(comment)
+        db.session.commit()
+        archived_id = comment.id
+        self.assertTrue(archived_id == db.session.query(db.func.max(Comment.id)).scalar())  # the newest comment
+        archive(self.cutoff)
+        hot_post = Post.query.first()
+        fresh = Comment(body='new reply', post=hot_post, author_id=hot_post.author_id)
+        db.session.add(fresh)
+        db.session.commit()
+        self.assertTrue(fresh.id > archived_id)
+        self.assertTrue(get_comment_or_404(archived_id).body == 'late reply')
+        self.assertTrue(get_comment_or_404(fresh.id).body == 'new reply')
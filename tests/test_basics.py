@@ -1,19 +1,14 @@
 __author__ = 'Stuart'
 import unittest
+import sys
 from flask import current_app
-from app import create_app, db
+from app import db
+from app.startup import ImportTimer
+from fixtures import FlaskyTestCase
 
-class BasicsTestCase(unittest.TestCase):
-    def setUp(self):
-        self.app = create_app('testing')
-        self.app_context = self.app.app_context()
-        self.app_context.push()
-        db.create_all()
 
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-        self.app_context.pop()
+class BasicsTestCase(FlaskyTestCase):
+    database = 'file'  # checks the sqlite file's journal mode
 
     def test_app_exists(self):  # any app that has a name beginning with test_ is executed as a test
         self.assertFalse(current_app is None)
@@ -21,3 +16,20 @@ class BasicsTestCase(unittest.TestCase):
     def test_app_is_testing(self):
         self.assertTrue(current_app.config['TESTING'])
 
+    def test_sqlite_engine_profile(self):
+        # testing db is a sqlite file, so 'auto' should have picked the tuned sqlite profile
+        conn = db.engine.connect()
+        self.assertTrue(conn.scalar('PRAGMA journal_mode') == 'wal')
+        self.assertTrue(conn.scalar('PRAGMA busy_timeout') == 5000)
+        conn.close()
+
+    def test_startup_timings(self):
+        steps = [name for name, secs in current_app.extensions['startup_timings']]
+        self.assertTrue('db' in steps and 'blueprint api' in steps)
+
+    def test_import_timer(self):
+        sys.modules.pop('colorsys', None)
+        with ImportTimer() as timer:
+            import colorsys
+        self.assertTrue('colorsys' in timer.cumulative)
+        self.assertTrue(timer.by_package()['colorsys'] >= 0)
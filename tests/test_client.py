@@ -2,10 +2,12 @@ __author__ = 'Stuart'
 
 from flask import url_for
 import unittest, re
-from app import create_app, db
-from app.models import User, Role
+from app import db
+from app.models import User, Post
+from fixtures import FlaskyTestCase
 
-class FlaskClientTestCase(unittest.TestCase):
+
+class FlaskClientTestCase(FlaskyTestCase):
     def setUp(self):
         """
         self.client instance is flask test client obj. This exposes methods that issue requests into app. When created
@@ -13,18 +15,9 @@ class FlaskClientTestCase(unittest.TestCase):
         user sessions. Can/must log in and out.
         :return:
         """
-        self.app = create_app('testing')
-        self.app_context = self.app.app_context()
-        self.app_context.push()
-        db.create_all()
-        Role.insert_roles()
+        super(FlaskClientTestCase, self).setUp()
         self.client = self.app.test_client(use_cookies=True)
 
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-        self.app_context.pop()
-
     def test_home_page(self):
         """
         Searches for stranger in the response.
@@ -72,3 +65,25 @@ class FlaskClientTestCase(unittest.TestCase):
         response = self.client.get(url_for('auth.logout'), follow_redirects = True)
         data = response.get_data(as_text=True)
         self.assertTrue('You have been logged out' in data)
+
+    def test_page_query_budgets(self):
+        """
+        Pages have to cost the same number of queries whatever is on them. If one of these fails after a change to a
+        view or template, look for a relationship or .count() touched per post/comment in a loop, the failure lists
+        every statement.
+        """
+        ids = self.add_site(role='Moderator')
+        post_id = Post.query.filter_by(author_id=ids[1]).first().id
+        self.client.post(url_for('auth.login'), data={'email': 'u0@example.com', 'password': 'cat'})
+        budgets = [
+            (url_for('main.index'), 6),
+            (url_for('main.user', username='u1'), 10),
+            (url_for('main.post', id=post_id), 7),
+            (url_for('main.followers', username='u1'), 4),
+            (url_for('main.followed_by', username='u1'), 4),
+            (url_for('main.moderate'), 5),
+        ]
+        for url, budget in budgets:
+            with self.assertMaxQueries(budget, url):
+                response = self.client.get(url)
+            self.assertTrue(response.status_code == 200)
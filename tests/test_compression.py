@@ -0,0 +1,88 @@
+__author__ = 'Stuart'
+import unittest
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from flask import url_for
+from app.assets import build
+from fixtures import FlaskyTestCase
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+
+class CompressionTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(CompressionTestCase, self).setUp()
+        self.client = self.app.test_client()
+
+    def test_json_is_gzipped_when_accepted(self):
+        self.add_site()
+        plain = self.client.get(url_for('api.get_posts'))
+        self.assertTrue('Content-Encoding' not in plain.headers)
+        self.assertTrue('Accept-Encoding' in plain.headers['Vary'])
+        gzipped = self.client.get(url_for('api.get_posts'), headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertTrue(gzipped.headers['Content-Encoding'] == 'gzip')
+        self.assertTrue(int(gzipped.headers['Content-Length']) < int(plain.headers['Content-Length']))
+        self.assertTrue(gunzip(gzipped.data) == plain.data)
+        refused = self.client.get(url_for('api.get_posts'), headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+        self.assertTrue('Content-Encoding' not in refused.headers and refused.data == plain.data)
+
+    def test_small_and_error_responses_are_left_alone(self):
+        response = self.client.get(url_for('api.get_posts'), headers={'Accept-Encoding': 'gzip'})  # no posts yet
+        self.assertTrue(len(response.data) < self.app.config['FLASKY_COMPRESS_MIN_SIZE'])
+        self.assertTrue('Content-Encoding' not in response.headers)
+        response = self.client.get('/no/such/page', headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.status_code == 404)
+        self.assertTrue('Content-Encoding' not in response.headers)
+
+
+class StaticAssetsTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(StaticAssetsTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.static = os.path.join(self.tmpdir, 'static')
+        shutil.copytree(self.app.static_folder, self.static)
+        self.app.static_folder = self.static
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        super(StaticAssetsTestCase, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_unbuilt_files_are_served_as_usual(self):
+        self.assertTrue(url_for('static', filename='styles.css') == '/static/styles.css')
+        response = self.client.get('/static/styles.css', headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue('immutable' not in response.headers.get('Cache-Control', ''))
+
+    def test_built_files_are_fingerprinted_and_precompressed(self):
+        manifest = build(self.static)
+        self.assertTrue(set(manifest) == set(['styles.css', 'favicon.ico']))
+        url = url_for('static', filename='styles.css')
+        self.assertTrue(url == '/static/' + manifest['styles.css'])
+        self.assertTrue(url != '/static/build/styles.css')
+        with open(os.path.join(self.static, 'styles.css'), 'rb') as f:
+            original = f.read()
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.headers['Content-Encoding'] == 'gzip')
+        self.assertTrue(response.mimetype == 'text/css')
+        self.assertTrue('max-age=31536000' in response.headers['Cache-Control'])
+        self.assertTrue('immutable' in response.headers['Cache-Control'])
+        self.assertTrue(gunzip(response.data) == original)
+        response.close()
+
+        response = self.client.get(url)
+        self.assertTrue('Content-Encoding' not in response.headers)
+        self.assertTrue(response.data == original)
+        response.close()
+
+        # new content, new name
+        with open(os.path.join(self.static, 'styles.css'), 'ab') as f:
+            f.write(b'\nbody { color: red; }\n')
+        self.assertTrue(build(self.static)['styles.css'] != manifest['styles.css'])
@@ -0,0 +1,93 @@
+__author__ = 'Stuart'
+import unittest
+import json
+import threading
+from flask import url_for
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.exceptions import ServiceUnavailable
+from app.groupcommit import _committer
+from app.models import Post
+from fixtures import FlaskyTestCase
+
+
+class GroupCommitTestCase(FlaskyTestCase):
+    database = 'file'  # the writer thread has its own connection
+
+    def setUp(self):
+        super(GroupCommitTestCase, self).setUp()
+        self.app.config['FLASKY_GROUP_COMMIT'] = True
+        self.app.config['FLASKY_GROUP_COMMIT_WINDOW'] = 0.5  # plenty for every thread to get its row in
+        self.ids = self.add_site(users=3, posts=1)
+        db.session.remove()  # no read lock held while the writer commits
+
+    def post(self, i, url, results):
+        headers = self.get_api_headers('u{}@example.com'.format(i % 3), 'cat')
+        response = self.app.test_client().post(url, headers=headers, data=json.dumps({'body': 'new {}'.format(i)}))
+        results.append((response.status_code, json.loads(response.data.decode('utf-8'))))
+
+    def test_concurrent_inserts_share_commits(self):
+        results = []
+        url = url_for('api.new_post')
+        threads = [threading.Thread(target=self.post, args=(i, url, results)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue([status for status, _ in results] == [201] * 6)
+        self.assertTrue(_committer(self.app).batches < 6)
+        bodies = set(post.body for post in Post.query.filter(Post.body.like('new %')))
+        self.assertTrue(bodies == set('new {}'.format(i) for i in range(6)))
+        self.assertTrue(all(data['author'].endswith(url_for('api.get_user', id=self.ids[int(data['body'][4:]) % 3]))
+                            for _, data in results))
+
+        url = url_for('api.new_post_comment', id=Post.query.first().id)
+        self.post(0, url, results)
+        self.assertTrue(results[-1][0] == 201 and results[-1][1]['body'] == 'new 0')
+
+    def test_a_bad_row_only_fails_itself(self):
+        committer = _committer(self.app)
+        errors = []
+
+        def submit(row):
+            try:
+                committer.submit(row)
+            except IntegrityError as e:
+                errors.append(e)
+        good = Post(body='good', author_id=self.ids[0])
+        bad = Post(id=Post.query.first().id, body='bad', author_id=self.ids[0])  # the id is taken
+        db.session.remove()
+        threads = [threading.Thread(target=submit, args=(row,)) for row in (good, bad)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(len(errors) == 1 and good.id is not None)
+        self.assertTrue(Post.query.get(good.id).body == 'good')
+
+    def test_a_dead_writer_is_replaced(self):
+        committer = _committer(self.app)
+        commit = committer._commit
+
+        def die(writes):
+            committer._commit = commit
+            raise SystemExit()
+        committer._commit = die
+        self.assertRaises(ServiceUnavailable, committer.submit, Post(body='lost', author_id=self.ids[0]))
+        post = Post(body='kept', author_id=self.ids[0])
+        committer.submit(post)
+        self.assertTrue(post.id is not None and Post.query.filter_by(body='lost').count() == 0)
+
+    def test_requests_stop_waiting(self):
+        self.app.config['FLASKY_GROUP_COMMIT_TIMEOUT'] = 0.1
+        committer = _committer(self.app)
+        commit, stuck = committer._commit, threading.Event()
+        committer._commit = lambda writes: stuck.wait()
+        results = []
+        try:
+            self.post(0, url_for('api.new_post'), results)
+        finally:
+            stuck.set()
+            committer._commit = commit
+        self.assertTrue(results[0][0] == 503 and results[0][1]['error'] == 'service unavailable')
+
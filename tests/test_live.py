@@ -0,0 +1,90 @@
+__author__ = 'Stuart'
+import unittest
+import json
+from flask import url_for
+from app import create_app, db, live
+from app.models import User, Post
+from fixtures import FlaskyTestCase
+
+
+class LiveTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(LiveTestCase, self).setUp()
+        self.app.config['FLASKY_LIVE_EVENTS'] = True
+        self.app.config['FLASKY_LIVE_POLL'] = 0.01
+        self.app.config['FLASKY_LIVE_HEARTBEAT'] = 0.2
+        self.ids = self.add_site(users=3, posts=1)
+        self.client = self.app.test_client(use_cookies=True)
+
+    def write(self, i, body):
+        post = Post(body=body, author=User.query.get(self.ids[i]))
+        db.session.add(post)
+        db.session.commit()
+        return post.id
+
+    def open(self, **kwargs):
+        response = self.client.get(url_for('main.live_posts', **kwargs), buffered=False)
+        return response, iter(response.response)
+
+    def next_event(self, messages):
+        """
+        :return: (id, post ids) of the next event, skipping heartbeats
+        """
+        for message in messages:
+            message = message.decode('utf-8') if isinstance(message, bytes) else message
+            if message.startswith('id:'):
+                lines = message.strip().split('\n')
+                return int(lines[0][4:]), json.loads(lines[2][6:])['posts']
+
+    def test_subscribers_get_what_they_follow(self):
+        subscriber = live.Subscriber(authors=set([1]), seq=5)
+        subscriber.push([[5, 'post', 1, ['t', 10]], [6, 'post', 2, ['t', 11]], [7, 'follow', 1], [8, 'post', 1, ['t', 12]]])
+        self.assertTrue(subscriber.wait(0) == (8, [12]))
+        self.assertTrue(subscriber.wait(0) == (8, []))
+
+    def test_new_posts_are_pushed(self):
+        response, messages = self.open()
+        self.assertTrue(response.status_code == 200 and response.mimetype == 'text/event-stream')
+        self.assertTrue(next(messages).startswith(b'retry:'))
+        post_id = self.write(1, 'hello')
+        seq, posts = self.next_event(messages)
+        self.assertTrue(posts == [post_id])
+        response.close()
+        self.assertTrue(not self.app.extensions['live'].subscribers)
+
+        # a reconnect gets what it missed
+        missed = self.write(2, 'while away')
+        response = self.client.get(url_for('main.live_posts'), headers={'Last-Event-ID': str(seq)}, buffered=False)
+        self.assertTrue(self.next_event(iter(response.response))[1] == [missed])
+        response.close()
+
+    def test_followed_only(self):
+        self.client.post(url_for('auth.login'), data={'email': 'u0@example.com', 'password': 'cat'})
+        user = User.query.get(self.ids[0])
+        user.unfollow(User.query.get(self.ids[1]))
+        db.session.commit()
+        response, messages = self.open(followed=1)
+        self.write(1, 'not followed')
+        followed = self.write(2, 'followed')
+        self.assertTrue(self.next_event(messages)[1] == [followed])
+        response.close()
+
+    def test_connections_are_capped(self):
+        self.app.config['FLASKY_LIVE_MAX_CONNECTIONS'] = 1
+        first, _ = self.open()
+        second, _ = self.open()
+        self.assertTrue(second.status_code == 503 and second.headers['Retry-After'])
+        first.close()
+        third, _ = self.open()
+        self.assertTrue(third.status_code == 200)
+        third.close()
+
+    def test_off_unless_serving_with_gevent(self):
+        app = create_app('testing')
+        self.assertTrue(app.config['FLASKY_SERVE_MODE'] == 'sync' and not app.config['FLASKY_LIVE_EVENTS'])
+        self.app.config['FLASKY_LIVE_EVENTS'] = False
+        data = self.client.get(url_for('main.index')).get_data(as_text=True)
+        self.assertTrue('EventSource' not in data)
+        self.assertTrue(self.client.get(url_for('main.live_posts')).status_code == 204)
+        self.app.config['FLASKY_LIVE_EVENTS'] = True
+        self.assertTrue('EventSource' in self.client.get(url_for('main.index')).get_data(as_text=True))
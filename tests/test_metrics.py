@@ -0,0 +1,90 @@
+__author__ = 'Stuart'
+import unittest
+import os
+import re
+import shutil
+import tempfile
+from app import create_app, db, metrics
+from fixtures import FlaskyTestCase
+
+
+class MetricsTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.app.config['FLASKY_LOCAL_STORE'] = 'sqlite:///' + os.path.join(self.tmpdir, 'store.sqlite')
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        super(MetricsTestCase, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def scrape(self, client=None):
+        response = (client or self.client).get('/metrics')
+        self.assertTrue(response.status_code == 200)
+        return response.get_data(as_text=True)
+
+    def value(self, text, series):
+        match = re.search('^' + re.escape(series) + r' ([0-9.e+-]+)$', text, re.M)
+        return float(match.group(1)) if match else None
+
+    def test_request_metrics(self):
+        for i in range(3):
+            self.assertTrue(self.client.get('/').status_code == 200)
+        self.client.get('/wrong/url')
+        text = self.scrape()
+        self.assertTrue('# TYPE flasky_http_request_duration_seconds histogram' in text)
+        self.assertTrue(self.value(
+            text, 'flasky_http_requests_total{endpoint="main.index",method="GET",status="200"}') == 3)
+        self.assertTrue(self.value(
+            text, 'flasky_http_requests_total{endpoint="unknown",method="GET",status="404"}') == 1)
+        self.assertTrue(self.value(text, 'flasky_http_request_duration_seconds_count{endpoint="main.index"}') == 3)
+        self.assertTrue(self.value(
+            text, 'flasky_http_request_duration_seconds_bucket{endpoint="main.index",le="+Inf"}') == 3)
+        self.assertTrue(self.value(text, 'flasky_db_queries_total{endpoint="main.index"}') >= 3)
+        self.assertTrue(self.value(text, 'flasky_template_render_seconds_count{template="index.html"}') == 3)
+
+        # buckets are in increasing order, +Inf last
+        bounds = re.findall(r'flasky_http_request_duration_seconds_bucket\{endpoint="main.index",le="([^"]+)"\}', text)
+        self.assertTrue(bounds[-1] == '+Inf')
+        self.assertTrue([float(b) for b in bounds[:-1]] == sorted(float(b) for b in bounds[:-1]))
+
+    def test_cache_counters(self):
+        with self.app.test_request_context():
+            metrics.cache_hit('users')
+            metrics.cache_hit('users')
+            metrics.cache_miss('users')
+        text = self.scrape()
+        self.assertTrue(self.value(text, 'flasky_cache_requests_total{cache="users",result="hit"}') == 2)
+        self.assertTrue(self.value(text, 'flasky_cache_requests_total{cache="users",result="miss"}') == 1)
+
+    def test_workers_are_aggregated(self):
+        # a second app on the same local store stands in for another gunicorn worker
+        other = create_app('testing')
+        other.config['FLASKY_LOCAL_STORE'] = self.app.config['FLASKY_LOCAL_STORE']
+        other_client = other.test_client()
+        self.client.get('/auth/login')
+        other_client.get('/auth/login')
+        other_client.get('/auth/login')
+        with other.app_context():
+            metrics.flush(other)
+        text = self.scrape()
+        self.assertTrue(self.value(
+            text, 'flasky_http_requests_total{endpoint="auth.login",method="GET",status="200"}') == 3)
+
+    def test_token(self):
+        self.app.config['FLASKY_METRICS_TOKEN'] = 'secret'
+        self.assertTrue(self.client.get('/metrics').status_code == 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertTrue(response.status_code == 200)
+        remote = {'REMOTE_ADDR': '10.0.0.1'}
+        self.assertTrue(self.client.get('/metrics', environ_base=remote).status_code == 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'}, environ_base=remote)
+        self.assertTrue(response.status_code == 200)
+
+    def test_local_only_without_token(self):
+        self.assertTrue(self.app.config['FLASKY_METRICS_TOKEN'] is None)
+        self.assertTrue(self.client.get('/metrics').status_code == 200)
+        self.assertTrue(self.client.get('/metrics', environ_base={'REMOTE_ADDR': '::1'}).status_code == 200)
+        self.assertTrue(self.client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 404)
+        self.assertTrue(self.client.get('/metrics', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 404)
@@ -0,0 +1,73 @@
+__author__ = 'Stuart'
+import unittest
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from app import db, mail, outbox
+from app.models import User, Outbox
+from fixtures import FlaskyTestCase
+
+
+class OutboxTestCase(FlaskyTestCase):
+    database = 'file'  # worker threads each have their own connection
+
+    def setUp(self):
+        super(OutboxTestCase, self).setUp()
+        self.client = self.app.test_client()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        super(OutboxTestCase, self).tearDown()
+
+    def test_register_queues_email_in_same_transaction(self):
+        response = self.client.post('/auth/register', data={
+            'email': 'john@example.com',
+            'username': 'john',
+            'password': 'cat',
+            'password2': 'cat'
+        })
+        self.assertTrue(response.status_code == 302)
+        self.assertTrue(User.query.filter_by(username='john').count() == 1)
+        message = Outbox.query.one()
+        self.assertTrue(message.kind == 'email' and message.status == 'pending')
+
+        with mail.record_messages() as sent:
+            self.assertTrue(outbox.drain_once(self.executor) == 1)
+        self.assertTrue(len(sent) == 1)
+        self.assertTrue(sent[0].recipients == ['john@example.com'])
+        self.assertTrue('Confirm Your Account' in sent[0].subject)
+        self.assertTrue(Outbox.query.one().status == 'done')
+        self.assertTrue(outbox.drain_once(self.executor) == 0)
+
+    def test_failures_are_retried_then_given_up(self):
+        calls = []
+
+        @outbox.handler('flaky')
+        def flaky(n):
+            calls.append(n)
+            raise IOError('smtp went away')
+
+        self.app.config['FLASKY_OUTBOX_MAX_ATTEMPTS'] = 2
+        outbox.enqueue('flaky', n=1)
+        db.session.commit()
+
+        self.assertTrue(outbox.drain_once(self.executor) == 1)
+        message = Outbox.query.one()
+        self.assertTrue(message.status == 'pending' and message.attempts == 1)
+        self.assertTrue('smtp went away' in message.last_error)
+        self.assertTrue(message.next_attempt_at > datetime.datetime.utcnow())
+
+        # not due yet
+        self.assertTrue(outbox.drain_once(self.executor) == 0)
+
+        message.next_attempt_at = datetime.datetime.utcnow()
+        db.session.commit()
+        self.assertTrue(outbox.drain_once(self.executor) == 1)
+        self.assertTrue(Outbox.query.one().status == 'failed')
+        self.assertTrue(calls == [1, 1])
+
+    def test_leased_rows_are_not_claimed_twice(self):
+        outbox.enqueue('email', subject='s', sender='a@example.com', recipients=['b@example.com'], body='', html='')
+        db.session.commit()
+        self.assertTrue(len(outbox.claim_batch(10, lease=60)) == 1)
+        self.assertTrue(outbox.claim_batch(10, lease=60) == [])
@@ -0,0 +1,59 @@
+__author__ = 'Stuart'
+import unittest
+import json
+from flask import url_for
+from app import db
+from app.models import Post
+from app.pagination import paginate
+from fixtures import FlaskyTestCase
+
+
+class PaginationTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(PaginationTestCase, self).setUp()
+        self.add_site(users=2, posts=5)  # 10 posts
+        self.query = Post.query.order_by(Post.id)
+        self.ids = [post.id for post in self.query]
+
+    def test_exact_total_comes_with_the_page(self):
+        with self.assertMaxQueries(1, 'exact page'):
+            page = paginate(self.query, 2, 4, mode='exact')
+        self.assertTrue([post.id for post in page.items] == self.ids[4:8])
+        self.assertTrue(page.total == 10 and page.pages == 3 and page.has_next and page.has_prev)
+        past_the_end = paginate(self.query, 5, 4, mode='exact')
+        self.assertTrue(past_the_end.items == [] and past_the_end.total == 10)
+        self.assertTrue(paginate(Post.query.filter(Post.id < 0), 1, 4, mode='exact').total == 0)
+
+    def test_cached_total_is_reused_until_it_expires(self):
+        self.assertTrue(paginate(self.query, 1, 4, mode='cached').total == 10)
+        Post.query.filter(Post.id == self.ids[0]).delete()
+        db.session.commit()
+        with self.assertMaxQueries(1, 'cached page'):
+            page = paginate(self.query, 1, 4, mode='cached')
+        self.assertTrue(page.total == 10)  # stale, for up to FLASKY_PAGE_TOTALS_TTL
+        self.assertTrue(paginate(self.query.filter(Post.id > 0), 1, 4, mode='cached').total == 9)  # other query
+
+        self.app.config['FLASKY_PAGE_TOTALS_TTL'] = -1
+        expiring = self.query.filter(Post.body != '')
+        self.assertTrue(paginate(expiring, 1, 4, mode='cached').total == 9)
+        Post.query.filter(Post.id == self.ids[1]).delete()
+        db.session.commit()
+        self.assertTrue(paginate(expiring, 1, 4, mode='cached').total == 8)  # expired, counted again
+
+    def test_no_total(self):
+        with self.assertMaxQueries(1, 'page without total'):
+            page = paginate(self.query, 2, 4, mode='none')
+        self.assertTrue([post.id for post in page.items] == self.ids[4:8])
+        self.assertTrue(page.total is None and page.has_next and page.pages == 3)
+        last = paginate(self.query, 3, 4, mode='none')
+        self.assertTrue(len(last.items) == 2 and not last.has_next and list(last.iter_pages()) == [1, 2, 3])
+
+    def test_api_clients_can_opt_out(self):
+        client = self.app.test_client()
+        headers = self.get_api_headers('u0@example.com', 'cat')
+        response = client.get(url_for('api.get_comments', count='none'), headers=headers)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertTrue(response.status_code == 200 and data['count'] is None and len(data['posts']) == 20)
+        self.assertTrue(data['next'] is None and data['prev'] is None)
+        response = client.get(url_for('api.get_posts', count='roughly'), headers=headers)
+        self.assertTrue(response.status_code == 400)
@@ -0,0 +1,90 @@
+__author__ = 'Stuart'
+import unittest
+import json
+import os
+import tempfile
+import shutil
+from app import db
+from app.models import User, Role
+from app.localstore import open_store, SQLiteStore
+from app.ratelimit import TokenBucketLimiter
+from fixtures import FlaskyTestCase
+
+
+class RateLimitTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(RateLimitTestCase, self).setUp()
+        self.app.config['FLASKY_API_RATE_LIMITS'] = {'read': (0.01, 2), 'write': (0.01, 1)}
+        self.client = self.app.test_client()
+
+    def add_user(self, email):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email=email, password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        return u
+
+    def test_client_over_limit_gets_429(self):
+        self.add_user('john@example.com')
+        self.add_user('susan@example.com')
+        headers = self.get_api_headers('john@example.com', 'cat')
+        for i in range(2):
+            response = self.client.get('/api/v1.0/posts/', headers=headers)
+            self.assertTrue(response.status_code == 200)
+        response = self.client.get('/api/v1.0/posts/', headers=headers)
+        self.assertTrue(response.status_code == 429)
+        self.assertTrue(int(response.headers['Retry-After']) >= 1)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertTrue(json_response['error'] == 'too many requests')
+
+        # other clients and other endpoint classes have their own buckets
+        response = self.client.get('/api/v1.0/posts/', headers=self.get_api_headers('susan@example.com', 'cat'))
+        self.assertTrue(response.status_code == 200)
+        response = self.client.post('/api/v1.0/posts/', headers=headers, data=json.dumps({'body': 'hi'}))
+        self.assertTrue(response.status_code == 201)
+
+    def test_bad_passwords_are_limited_too(self):
+        self.app.config['FLASKY_API_RATE_LIMITS']['ip'] = (0.01, 3)
+        self.add_user('john@example.com')
+        headers = self.get_api_headers('john@example.com', 'guess')
+        for i in range(3):
+            self.assertTrue(self.client.get('/api/v1.0/posts/', headers=headers).status_code == 401)
+        response = self.client.get('/api/v1.0/posts/', headers=headers)
+        self.assertTrue(response.status_code == 429 and int(response.headers['Retry-After']) >= 1)
+        # the right password doesn't get round it either, the address is out of tokens
+        response = self.client.get('/api/v1.0/posts/', headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertTrue(response.status_code == 429)
+
+    def test_busy_worker_sheds_load(self):
+        self.app.config['FLASKY_API_MAX_INFLIGHT'] = 1
+        self.add_user('john@example.com')
+        headers = self.get_api_headers('john@example.com', 'cat')
+        self.assertTrue(self.client.get('/api/v1.0/posts/', headers=headers).status_code == 200)
+
+        gate = self.app.extensions['api_gate']
+        self.assertTrue(gate.try_enter())  # someone else's request is in progress
+        response = self.client.get('/api/v1.0/posts/', headers=headers)
+        self.assertTrue(response.status_code == 503)
+        self.assertTrue(response.headers['Retry-After'] == '1')
+        gate.leave()
+        self.assertTrue(self.client.get('/api/v1.0/posts/', headers=headers).status_code == 200)
+
+
+class LocalStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sqlite_store_is_shared(self):
+        url = 'sqlite:///' + os.path.join(self.tmpdir, 'store.sqlite')
+        limiter = TokenBucketLimiter(open_store(url), {'read': (0.01, 1)})
+        self.assertTrue(limiter.hit('ip:1.2.3.4', 'read') == (True, 0))
+        # a second store on the same file, like another worker process would open, sees the empty bucket
+        other_store = SQLiteStore(os.path.join(self.tmpdir, 'store.sqlite'))
+        self.assertTrue(other_store is not open_store(url))
+        other = TokenBucketLimiter(other_store, {'read': (0.01, 1)})
+        allowed, retry_after = other.hit('ip:1.2.3.4', 'read')
+        self.assertFalse(allowed)
+        self.assertTrue(retry_after > 90)
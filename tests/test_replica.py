@@ -0,0 +1,99 @@
+__author__ = 'Stuart'
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from app import db
+from app.models import User, Role, Post, Comment
+from fixtures import FlaskyTestCase
+
+
+class ReplicaRoutingTestCase(FlaskyTestCase):
+    """
+    Primary is the usual data-test.sqlite, the "replica" is a second sqlite file. Nothing replicates between them,
+    which is handy: a post only present in one of them tells us where a request read from.
+    """
+    database = 'file'  # like the replica, which has to be a file
+
+    def setUp(self):
+        super(ReplicaRoutingTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.app.config['SQLALCHEMY_REPLICA_URI'] = 'sqlite:///' + os.path.join(self.tmpdir, 'replica.sqlite')
+        self.router = self.app.extensions['replica_router']
+        self.replica = self.router.replica_engine()
+        db.metadata.create_all(bind=self.replica)
+        self.client = self.app.test_client(use_cookies=True)
+
+        # same user on both sides, as a real replica would have
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+        user_row = dict((c.name, getattr(u, c.name)) for c in User.__table__.columns)
+        self.replica.execute(Role.__table__.insert(), id=r.id, name=r.name, permissions=r.permissions)
+        self.replica.execute(User.__table__.insert(), **user_row)
+        self.replica.execute(Post.__table__.insert(), body='from replica', body_html='<p>from replica</p>',
+                             author_id=u.id)
+
+    def tearDown(self):
+        self.replica.dispose()
+        super(ReplicaRoutingTestCase, self).tearDown()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def get_post_bodies(self, client, username='', password=''):
+        response = client.get('/api/v1.0/posts/', headers=self.get_api_headers(username, password))
+        self.assertTrue(response.status_code == 200)
+        return [p['body'] for p in json.loads(response.data.decode('utf-8'))['posts']]
+
+    def test_reads_go_to_replica(self):
+        self.assertTrue(self.get_post_bodies(self.client) == ['from replica'])
+
+    def test_writes_go_to_primary_and_are_read_back(self):
+        response = self.client.post('/api/v1.0/posts/',
+                                    headers=self.get_api_headers('john@example.com', 'cat'),
+                                    data=json.dumps({'body': 'from primary'}))
+        self.assertTrue(response.status_code == 201)
+        self.assertTrue([p.body for p in Post.query.all()] == ['from primary'])
+        self.assertTrue(self.replica.scalar('select count(*) from posts') == 1)
+
+        # same client (has the cookie) reads its own write
+        self.assertTrue(self.get_post_bodies(self.client) == ['from primary'])
+        # so does the same user from a client without cookies
+        other_client = self.app.test_client()
+        self.assertTrue(self.get_post_bodies(other_client, 'john@example.com', 'cat') == ['from primary'])
+        # everyone else still reads from the replica
+        self.assertTrue(self.get_post_bodies(other_client) == ['from replica'])
+
+    def test_falls_back_to_primary_when_replica_is_down(self):
+        self.app.config['SQLALCHEMY_REPLICA_URI'] = 'sqlite:///' + os.path.join(self.tmpdir, 'missing', 'x.sqlite')
+        self.router.checked_at = 0
+        db.session.add(Post(body='from primary', author=User.query.first()))
+        db.session.commit()
+        self.assertTrue(self.get_post_bodies(self.client) == ['from primary'])
+        self.assertTrue(self.router.down_until > 0)
+
+    def test_timeline_cache_fills_from_primary(self):
+        # committed and in the timeline's event log, but the replica hasn't caught up yet
+        john = User.query.filter_by(email='john@example.com').first()
+        db.session.add(Post(body='from primary', author=john))
+        db.session.commit()
+        self.assertTrue(john.is_following(john))
+        response = self.app.test_client().get('/api/v1.0/users/{}/timeline/'.format(john.id),
+                                              headers=self.get_api_headers('john@example.com', 'cat'))
+        bodies = [p['body'] for p in json.loads(response.data.decode('utf-8'))['posts']]
+        self.assertTrue(bodies == ['from primary'])
+        cached = self.app.extensions['timelinecache'].entries[john.id][0]
+        self.assertTrue([id for _, id in cached] == [Post.query.first().id])
+
+    def test_hot_posts_are_scored_from_primary(self):
+        # the post and its comment are committed, the replica only has its own post
+        john = User.query.filter_by(email='john@example.com').first()
+        post = Post(id=100, body='from primary', author=john)
+        db.session.add_all([post, Comment(body='first', author=john, post=post)])
+        db.session.commit()
+        response = self.app.test_client().get('/api/v1.0/posts/hot/',
+                                              headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertTrue(response.status_code == 200)
+        scores = self.app.extensions['trending'].scores
+        self.assertTrue(list(scores) == [100])
@@ -0,0 +1,75 @@
+__author__ = 'Stuart'
+import unittest
+from app import db
+from app import rerender as bulk
+from app.models import Post, Comment, POST_ALLOWED_TAGS
+from fixtures import FlaskyTestCase
+
+
+class RerenderTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(RerenderTestCase, self).setUp()
+        self.add_site(users=3, posts=4)
+        Post.query.update({'body': '# Title\n\nsome *text*'}, synchronize_session=False)  # no event, html untouched
+        db.session.commit()
+        self.post_ids = [id for id, in db.session.query(Post.id).order_by(Post.id)]
+
+    def html(self, model=Post):
+        return dict(db.session.query(model.id, model.body_html))
+
+    def test_stale_rows_are_rendered_again(self):
+        done, changed = bulk.rerender(self.app, 'posts', chunk=5, processes=1)
+        self.assertTrue(done == 12 and changed == 12)
+        self.assertTrue(all('<h1>Title</h1>' in html for html in self.html().values()))
+        self.assertTrue(bulk.checkpoint(self.app, 'posts') == 0)  # completed
+
+        # nothing to do the second time round, nothing is written
+        self.assertTrue(bulk.rerender(self.app, 'posts', chunk=5, processes=1) == (12, 0))
+
+    def test_rows_edited_meanwhile_are_left_alone(self):
+        edited = self.post_ids[1]
+        render_chunk = bulk.render_chunk
+
+        def edit_while_rendering(args):
+            result = render_chunk(args)
+            post = Post.query.get(edited)
+            if post.body != 'edited':
+                post.body = 'edited'
+                db.session.commit()
+            return result
+        bulk.render_chunk = edit_while_rendering
+        try:
+            self.assertTrue(bulk.rerender(self.app, 'posts', chunk=5, processes=1) == (12, 11))
+        finally:
+            bulk.render_chunk = render_chunk
+        self.assertTrue(self.html()[edited] == '<p>edited</p>')
+
+    def test_tag_changes_apply_to_existing_rows(self):
+        bulk.rerender(self.app, 'posts', processes=1)
+        tags = [tag for tag in POST_ALLOWED_TAGS if tag != 'h1']
+        saved = bulk.MODELS['posts']
+        bulk.MODELS['posts'] = (Post, tags)
+        try:
+            self.assertTrue(bulk.rerender(self.app, 'posts', chunk=5, processes=2) == (12, 12))
+        finally:
+            bulk.MODELS['posts'] = saved
+        self.assertTrue(all('<h1>' not in html and 'Title' in html for html in self.html().values()))
+
+    def test_resume_after_id(self):
+        seen = []
+        middle = self.post_ids[5]
+        done, changed = bulk.rerender(self.app, 'posts', start_id=middle, chunk=2, processes=1,
+                                      progress=lambda *args: seen.append(args))
+        self.assertTrue(done == 6)
+        self.assertTrue([args[0] for args in seen] == [2, 4, 6])
+        self.assertTrue(seen[-1][1] == 6)
+        self.assertTrue([args[3] for args in seen] == self.post_ids[7::2])
+        html = self.html()
+        self.assertTrue(all('<h1>' in html[id] for id in self.post_ids[6:]))
+        self.assertTrue(not any('<h1>' in html[id] for id in self.post_ids[:6]))
+
+    def test_comments(self):
+        Comment.query.update({'body_html': 'stale'}, synchronize_session=False)
+        db.session.commit()
+        bulk.rerender(self.app, 'comments', processes=1)
+        self.assertTrue(set(self.html(Comment).values()) == set(['comment']))  # no <p> in comments
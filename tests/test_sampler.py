@@ -0,0 +1,49 @@
+__author__ = 'Stuart'
+import unittest
+import time
+from collections import Counter
+from app import db, sampler
+from app.sampler import diff
+from fixtures import FlaskyTestCase
+
+
+def busy_view():
+    deadline = time.time() + 0.2
+    while time.time() < deadline:
+        pass
+    return 'done'
+
+
+class SamplerTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(SamplerTestCase, self).setUp()
+        self.app.config['FLASKY_SAMPLER_INTERVAL'] = 0.002
+        self.app.add_url_rule('/busy', 'busy', busy_view)
+        self.client = self.app.test_client()
+
+    def test_off_by_default(self):
+        self.client.get('/busy')
+        sampler.flush(self.app)
+        self.assertTrue(sampler.export(self.app) == [])
+
+    def test_sampled_stacks_are_exported_per_endpoint(self):
+        sampler.start(self.app, 1.0)
+        self.app.extensions['sampler'].rate_checked = 0  # don't wait for the next poll
+        self.client.get('/busy')
+        sampler.flush(self.app)
+        lines = sampler.export(self.app, 'busy')
+        self.assertTrue(len(lines) > 0)
+        self.assertTrue(all(line.startswith('busy;') for line in lines))
+        self.assertTrue(any('test_sampler:busy_view' in line for line in lines))
+        self.assertTrue(sum(int(line.rsplit(' ', 1)[1]) for line in lines) > 10)
+
+        sampler.reset(self.app)
+        self.assertTrue(sampler.export(self.app) == [])
+
+    def test_diff(self):
+        before = Counter({'main.index;views:index;db:query': 30, 'main.index;views:index;jinja:render': 10})
+        after = Counter({'main.index;views:index;db:query': 10, 'main.index;views:index;jinja:render': 10})
+        lines, changes = diff(before, after)
+        self.assertTrue('main.index;views:index;db:query 30 10' in lines)
+        self.assertTrue(changes[0][1] in ('db:query', 'jinja:render'))
+        self.assertTrue(abs(changes[0][0]) == 0.25)
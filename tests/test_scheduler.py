@@ -0,0 +1,80 @@
+__author__ = 'Stuart'
+import unittest
+import datetime
+from app import db, metrics
+from app.models import ScheduledJob
+from app.scheduler import Cron, Job, claim, run_due, load_jobs
+from fixtures import FlaskyTestCase
+
+
+class SchedulerTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(SchedulerTestCase, self).setUp()
+        self.calls = []
+
+    def make_job(self, name='tick', fail=False, **kwargs):
+        def fn():
+            self.calls.append(name)
+            if fail:
+                raise RuntimeError('boom')
+        if 'cron' not in kwargs:
+            kwargs.setdefault('every', 60)
+        return Job(name, fn, **kwargs)
+
+    def make_due(self, job):
+        row = ScheduledJob.query.get(job.row_name)
+        row.next_run_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db.session.commit()
+
+    def test_cron(self):
+        at = datetime.datetime(2015, 8, 22, 10, 3)  # a Saturday
+        self.assertTrue(Cron('15 4 * * *').next(at) == datetime.datetime(2015, 8, 23, 4, 15))
+        self.assertTrue(Cron('*/20 9-17 * * 1-5').next(at) == datetime.datetime(2015, 8, 24, 9, 0))
+        self.assertTrue(Cron('0 0 29 2 *').next(at) == datetime.datetime(2016, 2, 29))
+        self.assertTrue(Cron('0 12 13 * 5').next(at) == datetime.datetime(2015, 8, 28, 12))  # 13th or a Friday
+        self.assertRaises(ValueError, Cron, '60 * * * *')
+        self.assertRaises(ValueError, Cron, '* * *')
+
+    def test_jobs_run_once_when_due(self):
+        job = self.make_job()
+        self.assertTrue(run_due([job])[0] == [])  # first seen, due in a minute
+        self.make_due(job)
+        ran, next_due = run_due([job])
+        self.assertTrue(ran == ['tick'] and self.calls == ['tick'])
+        self.assertTrue(next_due > datetime.datetime.utcnow() + datetime.timedelta(seconds=50))
+        row = ScheduledJob.query.get('tick')
+        self.assertTrue(row.runs == 1 and row.last_error is None and row.locked_until is None)
+        self.assertTrue(run_due([job])[0] == [])
+
+    def test_only_one_scheduler_gets_the_lease(self):
+        job = self.make_job()
+        run_due([job])
+        self.make_due(job)
+        now = datetime.datetime.utcnow()
+        self.assertTrue(claim(job, now))
+        self.assertTrue(not claim(job, now))  # e.g. another process, while the first one runs it
+        self.assertTrue(run_due([job])[0] == [] and self.calls == [])
+        self.assertTrue(claim(job, now + datetime.timedelta(seconds=job.lease + 1)))  # the first one died
+
+    def test_failures_are_recorded_and_timed(self):
+        job = self.make_job('broken', fail=True, cron='0 * * * *', jitter=30)
+        run_due([job])
+        self.make_due(job)
+        self.assertTrue(run_due([job])[0] == ['broken'])
+        row = ScheduledJob.query.get('broken')
+        self.assertTrue(row.last_error == 'RuntimeError: boom' and row.next_run_at.minute in (0, 1))
+        totals = metrics.totals(self.app)
+        self.assertTrue(totals['flasky_job_runs_total']['job="broken",result="error"'] == 1)
+        self.assertTrue(totals['flasky_job_duration_seconds_count']['job="broken"'] == 1)
+
+    def test_changed_schedules_are_picked_up(self):
+        run_due([self.make_job(every=3600)])
+        run_due([self.make_job(every=60)])
+        row = ScheduledJob.query.get('tick')
+        self.assertTrue(row.schedule == 'every 60s' and row.next_run_at < datetime.datetime.utcnow() +
+                        datetime.timedelta(seconds=61))
+
+    def test_app_jobs_are_registered(self):
+        jobs = dict((job.name, job) for job in load_jobs())
+        self.assertTrue(set(['purge-local-store', 'purge-outbox', 'archive']) <= set(jobs))
+        self.assertTrue(jobs['purge-local-store'].row_name != 'purge-local-store')  # one per host
@@ -0,0 +1,24 @@
+__author__ = 'Stuart'
+import unittest
+from app.serving import gunicorn_argv, PRESETS
+
+
+class ServingTestCase(unittest.TestCase):
+    def test_gevent_preset(self):
+        argv = gunicorn_argv('gevent', workers=2, bind='0.0.0.0:8000', connections=50)
+        self.assertTrue(argv[0] == 'gunicorn' and argv[-1] == 'manage:app')
+        self.assertTrue(argv[argv.index('--worker-class') + 1] == 'gevent')
+        self.assertTrue(argv[argv.index('--workers') + 1] == '2')
+        self.assertTrue(argv[argv.index('--worker-connections') + 1] == '50')
+        self.assertTrue(argv[argv.index('--bind') + 1] == '0.0.0.0:8000')
+        self.assertTrue(argv[argv.index('-c') + 1].endswith('serving.py'))
+
+    def test_sync_preset_defaults(self):
+        argv = gunicorn_argv('sync')
+        self.assertTrue(argv[argv.index('--workers') + 1] == str(PRESETS['sync']['workers']))
+        self.assertFalse('--worker-connections' in argv)
+        self.assertFalse('--bind' in argv)  # gunicorn picks $PORT itself
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            gunicorn_argv('tornado')
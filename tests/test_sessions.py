@@ -0,0 +1,71 @@
+__author__ = 'Stuart'
+import unittest
+from flask import url_for
+from app.localstore import get_store
+from app.sessions import LocalStoreSessionInterface, KEY_PREFIX
+from fixtures import FlaskyTestCase
+
+
+class ServerSessionTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(ServerSessionTestCase, self).setUp()
+        self.app.session_interface = LocalStoreSessionInterface()
+        self.store = get_store(self.app)
+        self.client = self.app.test_client(use_cookies=True)
+        self.add_site(users=1)
+
+    def session_cookie(self):
+        cookies = [c.value for c in self.client.cookie_jar if c.name == self.app.session_cookie_name]
+        return cookies[0] if cookies else None
+
+    def sessions(self):
+        return dict((key[len(KEY_PREFIX):], entry['data']) for key, entry in self.store.items(KEY_PREFIX))
+
+    def login(self, password='cat'):
+        return self.client.post(url_for('auth.login'), data={'email': 'u0@example.com', 'password': password})
+
+    def test_anonymous_visitors_get_no_session(self):
+        response = self.client.get(url_for('main.index'))
+        self.assertTrue(response.status_code == 200)
+        self.assertIsNone(self.session_cookie())
+        self.assertTrue(self.sessions() == {})
+
+    def test_cookie_is_only_an_id(self):
+        self.assertTrue(self.login().status_code == 302)
+        sid = self.session_cookie()
+        self.assertTrue(len(sid) == 24)
+        self.assertTrue(list(self.sessions()) == [sid])
+        self.assertTrue('user_id' in self.sessions()[sid])
+        self.assertTrue('Hello,' in self.client.get(url_for('main.index')).get_data(as_text=True))
+        self.assertTrue('u0' in self.client.get(url_for('main.index')).get_data(as_text=True))
+
+    def test_unchanged_session_is_not_written(self):
+        self.login()
+        writes = []
+        store_set = self.store.set
+        self.store.set = lambda *args, **kwargs: writes.append(args) or store_set(*args, **kwargs)
+        self.client.get(url_for('main.index'))
+        self.client.get(url_for('main.index'))
+        self.assertTrue(writes == [])
+
+    def test_id_changes_on_login_and_logout(self):
+        with self.client.session_transaction() as session:  # a session from before login, e.g. a planted one
+            session['next'] = '/'
+        before = self.session_cookie()
+        self.assertTrue(list(self.sessions()) == [before])
+        self.login()
+        logged_in = self.session_cookie()
+        self.assertTrue(logged_in != before)
+        self.assertTrue(list(self.sessions()) == [logged_in])
+        self.client.get(url_for('auth.logout'))
+        self.assertTrue(self.session_cookie() != logged_in)
+        self.assertTrue(logged_in not in self.sessions())
+
+    def test_idle_sessions_are_evicted(self):
+        self.login()
+        sid = self.session_cookie()
+        entry = self.store.get(KEY_PREFIX + sid)
+        self.store.set(KEY_PREFIX + sid, entry, ttl=-1)  # as if it had been idle for FLASKY_SESSION_IDLE
+        data = self.client.get(url_for('main.index')).get_data(as_text=True)
+        self.assertTrue('Stranger' in data)
+        self.assertTrue(self.sessions() == {})
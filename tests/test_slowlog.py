@@ -0,0 +1,46 @@
+__author__ = 'Stuart'
+import unittest
+from app import db, slowlog
+from app.models import Post
+from app.slowlog import normalize, fingerprint, percentile
+from fixtures import FlaskyTestCase
+
+
+class SlowLogTestCase(FlaskyTestCase):
+    database = 'file'  # EXPLAIN needs a second connection
+
+    def setUp(self):
+        super(SlowLogTestCase, self).setUp()
+        self.app.config['FLASKY_SLOW_DB_QUERY_TIME'] = 0  # everything is slow
+        self.client = self.app.test_client()
+
+    def test_normalize(self):
+        self.assertTrue(normalize("SELECT * FROM users  WHERE id = 5 AND name = 'o''brien' -- hi") ==
+                        'SELECT * FROM users WHERE id = ? AND name = ?')
+        self.assertTrue(normalize('SELECT * FROM t1 WHERE id IN (1, 2, 3)') == 'SELECT * FROM t1 WHERE id IN (?+)')
+        self.assertTrue(normalize('SELECT * FROM t1 WHERE id IN (%(id_1)s, %(id_2)s)') ==
+                        'SELECT * FROM t1 WHERE id IN (?+)')
+        self.assertTrue(normalize("SELECT x::text FROM t WHERE y = :y") == 'SELECT x::text FROM t WHERE y = ?')
+        self.assertTrue(normalize('INSERT INTO t (a, b) VALUES (?, ?), (?, ?)') == 'INSERT INTO t (a, b) VALUES (?+)+')
+        self.assertTrue(fingerprint('select 1 from t where id = 1')[0] == fingerprint('select 1 from t where id = 2')[0])
+
+    def test_queries_are_grouped_and_explained(self):
+        for page in (1, 2, 3):
+            self.assertTrue(self.client.get('/?page={}'.format(page)).status_code == 200)
+        entries = [e for e in slowlog.report(self.app) if 'FROM posts' in e['statement'] and
+                   'ORDER BY posts.timestamp DESC' in e['statement'] and 'LIMIT' in e['statement']]
+        self.assertTrue(len(entries) == 1)
+        entry = entries[0]
+        self.assertTrue(entry['count'] == 3)
+        self.assertTrue(entry['endpoint'] == 'main.index')
+        self.assertTrue(any('posts' in line for line in entry['plan']))  # sqlite EXPLAIN QUERY PLAN output
+        self.assertTrue(0 <= percentile(entry, 50) <= entry['max'])
+
+        slowlog.reset(self.app)
+        self.assertTrue(slowlog.report(self.app) == [])
+
+    def test_fast_queries_are_not_recorded(self):
+        self.app.config['FLASKY_SLOW_DB_QUERY_TIME'] = 10
+        slowlog.reset(self.app)  # forget setUp's queries
+        Post.query.all()
+        self.assertTrue(slowlog.report(self.app) == [])
@@ -0,0 +1,120 @@
+__author__ = 'Stuart'
+import unittest
+import datetime
+import json
+from flask import url_for
+from app import db, timelinecache
+from app.localstore import get_store
+from app.models import User, Post
+from fixtures import FlaskyTestCase
+
+
+class TimelineCacheTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(TimelineCacheTestCase, self).setUp()
+        self.app.config['FLASKY_POSTS_PER_PAGE'] = 3  # so 4 ids are cached
+        self.ids = self.add_site(users=3, posts=2)
+
+    def user(self, i):
+        return User.query.get(self.ids[i])
+
+    def newest(self, i):
+        return [id for id, in db.session.query(Post.id).filter(Post.author_id.in_(
+            [f.followed_id for f in self.user(i).followed])).order_by(Post.timestamp.desc()).limit(4)]
+
+    def write(self, i, body, **kwargs):
+        post = Post(body=body, author=self.user(i), **kwargs)
+        db.session.add(post)
+        db.session.commit()
+        return post.id
+
+    def test_hits_need_no_timeline_query(self):
+        ids = timelinecache.recent_ids(self.user(0))
+        self.assertTrue(ids == self.newest(0))
+        user = self.user(0)
+        with self.assertMaxQueries(0, 'hit'):
+            self.assertTrue(timelinecache.recent_ids(user) == ids)
+
+    def test_new_posts_are_patched_in(self):
+        timelinecache.recent_ids(self.user(0))
+        post_id = self.write(1, 'new')
+        user = self.user(0)
+        with self.assertMaxQueries(0, 'patched'):
+            ids = timelinecache.recent_ids(user)
+        self.assertTrue(ids[0] == post_id and ids == self.newest(0))
+
+        # too old for the cached page, left out
+        self.write(2, 'old', timestamp=datetime.datetime(2000, 1, 1))
+        self.assertTrue(timelinecache.recent_ids(self.user(0)) == ids)
+
+    def test_follows_drop_the_entry(self):
+        timelinecache.recent_ids(self.user(0))
+        self.user(0).unfollow(self.user(1))
+        db.session.commit()
+        ids = timelinecache.recent_ids(self.user(0))
+        self.assertTrue(ids == self.newest(0))
+        self.assertTrue(not set(ids) & set(p.id for p in self.user(1).posts))
+
+    def test_least_recently_used_users_go_first(self):
+        self.app.config['FLASKY_TIMELINE_CACHE_SIZE'] = 2
+        for i in (0, 1, 0, 2):
+            timelinecache.recent_ids(self.user(i))
+        state = self.app.extensions['timelinecache']
+        self.assertTrue(list(state.entries) == [self.ids[0], self.ids[2]])
+        self.assertTrue(all(self.ids[1] not in followers for followers in state.followers.values()))
+
+    def test_other_workers_catch_up_or_start_over(self):
+        timelinecache.recent_ids(self.user(0))
+        state = self.app.extensions['timelinecache']
+        self.app.config['FLASKY_TIMELINE_CACHE_EVENTS'] = 2
+        for i in range(3):
+            self.write(1, 'more {}'.format(i))
+        timelinecache.recent_ids(self.user(1))
+        self.assertTrue(list(state.entries) == [self.ids[1]])  # missed an event, so started over
+
+    def test_index_and_api_serve_page_one(self):
+        client = self.app.test_client(use_cookies=True)
+        client.post(url_for('auth.login'), data={'email': 'u0@example.com', 'password': 'cat'})
+        client.get(url_for('main.show_followed'))
+        post_id = self.write(2, 'fresh post')
+        data = client.get(url_for('main.index')).get_data(as_text=True)
+        self.assertTrue('fresh post' in data)
+
+        headers = self.get_api_headers('u0@example.com', 'cat')
+        response = client.get(url_for('api.get_user_followed_posts', id=self.ids[0]), headers=headers)
+        timeline = json.loads(response.data.decode('utf-8'))
+        self.assertTrue(len(timeline['posts']) == 3 and timeline['count'] == 7 and timeline['next'])
+        self.assertTrue(timeline['posts'][0]['url'].endswith(url_for('api.get_post', id=post_id)))
+
+    def test_hits_keep_the_total(self):
+        self.app.config['FLASKY_PAGE_TOTALS'] = 'exact'
+        self.assertTrue(timelinecache.first_page(self.user(0), 3).total == 6)
+        user = self.user(0)
+        with self.assertMaxQueries(1, 'hit'):
+            page = timelinecache.first_page(user, 3)
+        self.assertTrue(page.total == 6 and len(page.items) == 3)
+        self.write(1, 'new')
+        self.write(1, 'old', timestamp=datetime.datetime(2000, 1, 1))  # on a later page, still one more
+        user = self.user(0)
+        with self.assertMaxQueries(1, 'hit'):
+            self.assertTrue(timelinecache.first_page(user, 3).total == 8)
+
+    def test_seq_never_goes_back(self):
+        # A appends its event, B appends the next and sets its seq, then A sets its own
+        log = timelinecache.log
+        store = get_store(self.app)
+        start = log.last(self.app)
+        update = store.update
+
+        def racing_update(key, fn, ttl=None):
+            result = update(key, fn, ttl)
+            if key == log.events_key and result == start + 1:
+                log.publish(self.app, [('b',)])
+            return result
+        store.update = racing_update
+        try:
+            log.publish(self.app, [('a',)])
+        finally:
+            del store.update
+        self.assertTrue(log.last(self.app) == start + 2)
+        self.assertTrue(log.read(self.app, start + 1) == (start + 2, [[start + 2, 'b']]))
@@ -0,0 +1,56 @@
+__author__ = 'Stuart'
+import unittest
+import os
+import tempfile
+from sqlalchemy import create_engine
+from app import db
+from app.models import Post
+from app.transfer import transfer, verify, table_levels
+from fixtures import FlaskyTestCase
+
+
+class TransferTestCase(FlaskyTestCase):
+    database = 'file'  # the copy reads it from other connections
+
+    def setUp(self):
+        super(TransferTestCase, self).setUp()
+        self.add_site(users=3, posts=3)
+        Post.query.filter(Post.id == 2).delete()  # ids with gaps, they must come out the same
+        db.session.commit()
+        self.source = self.app.config['SQLALCHEMY_DATABASE_URI']
+        self.path = os.path.join(tempfile.gettempdir(), 'flasky-transfer-{}.sqlite'.format(os.getpid()))
+        self.target = 'sqlite:///' + self.path
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        super(TransferTestCase, self).tearDown()
+
+    def test_levels_follow_foreign_keys(self):
+        levels = [set(level) for level in table_levels(db.metadata)]
+        index = dict((name, i) for i, level in enumerate(levels) for name in level)
+        self.assertTrue(index['roles'] < index['users'] < index['posts'] < index['comments'])
+        self.assertTrue(index['users'] < index['follows'])
+
+    def test_rows_are_copied_with_their_ids(self):
+        report = transfer(self.source, self.target, chunk=4, processes=2)
+        self.assertTrue(all(ok for _, _, _, ok in report))
+        counts = dict((name, (source, target)) for name, source, target, _ in report)
+        self.assertTrue(counts['posts'] == (8, 8) and counts['follows'] == (9, 9))
+        engine = create_engine(self.target)
+        ids = [id for id, in engine.execute('SELECT id FROM posts ORDER BY id')]
+        engine.dispose()
+        self.assertTrue(ids == [1] + list(range(3, 10)))
+
+    def test_changed_rows_are_reported(self):
+        transfer(self.source, self.target, processes=1)
+        engine = create_engine(self.target)
+        engine.execute("UPDATE comments SET body = 'changed' WHERE id = 3")
+        engine.dispose()
+        bad = [name for name, _, _, ok in verify(self.source, self.target) if not ok]
+        self.assertTrue(bad == ['comments'])
+
+    def test_target_must_be_empty(self):
+        transfer(self.source, self.target, processes=1)
+        with self.assertRaises(ValueError):
+            transfer(self.source, self.target, processes=1)
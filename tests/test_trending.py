@@ -0,0 +1,75 @@
+__author__ = 'Stuart'
+import unittest
+import datetime
+import json
+from flask import url_for
+from app import db, trending
+from app.models import User, Post, Comment
+from app.trending import HotIndex
+from fixtures import FlaskyTestCase
+
+
+class HotIndexTestCase(unittest.TestCase):
+    def test_recent_activity_wins(self):
+        index = HotIndex(half_life=3600, size=100)
+        now = 1500000000
+        for i in range(3):
+            index.add(1, now - 3 * 3600)  # 3 comments 3 half lives ago: 3/8
+        index.add(2, now - 3600)  # 1 an hour ago: 1/2
+        index.add(3, now - 7200)  # 1/4
+        self.assertTrue([post_id for post_id, _ in index.top(3)] == [2, 1, 3])
+        index.add(3, now - 7200)  # 1/4 + 1/4 + a bit over 1/4, more than 2's 1/2
+        index.add(3, now - 7000)
+        self.assertTrue(index.top(1)[0][0] == 3)
+        self.assertTrue([post_id for post_id, _ in index.top(10)] == [3, 2, 1])  # outdated entries skipped
+
+    def test_size_is_bounded(self):
+        index = HotIndex(half_life=3600, size=150)
+        for i in range(1000):
+            index.add(i, 1500000000 + i)
+            index.add(i, 1500000000 + i)
+        self.assertTrue(len(index.heap) <= 2 * max(len(index.scores), 100) and len(index.scores) <= 300)
+        self.assertTrue([post_id for post_id, _ in index.top(3)] == [999, 998, 997])
+        index.remove(999)
+        self.assertTrue([post_id for post_id, _ in index.top(2)] == [998, 997])
+
+
+class TrendingTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(TrendingTestCase, self).setUp()
+        self.ids = self.add_site(users=2, posts=2)
+        self.posts = [id for id, in db.session.query(Post.id).order_by(Post.id)]
+
+    def comment(self, post_id, n=1):
+        for i in range(n):
+            db.session.add(Comment(body='hot', post_id=post_id, author_id=self.ids[0]))
+        db.session.commit()
+
+    def test_comments_move_posts_up(self):
+        trending.top(10)  # built from the db
+        self.comment(self.posts[0], 3)
+        with self.assertMaxQueries(0, 'hot ids'):
+            top = trending.top(2)
+        self.assertTrue(top[0][0] == self.posts[0])
+        self.comment(self.posts[2], 5)
+        self.assertTrue([post_id for post_id, _ in trending.top(2)] == [self.posts[2], self.posts[0]])
+
+    def test_old_activity_is_outside_the_window(self):
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+        Post.query.filter(Post.id == self.posts[1]).update({'timestamp': old})
+        Comment.query.filter(Comment.post_id == self.posts[1]).update({'timestamp': old})
+        db.session.commit()
+        self.assertTrue(self.posts[1] not in [post_id for post_id, _ in trending.top(10)])
+
+    def test_web_and_api(self):
+        self.comment(self.posts[3], 4)
+        client = self.app.test_client()
+        response = client.get(url_for('main.hot'))
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue('post 1 of u1' in response.get_data(as_text=True))
+        headers = self.get_api_headers('u0@example.com', 'cat')
+        response = client.get(url_for('api.get_hot_posts', limit=2, fields='url,comment_count'), headers=headers)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertTrue(data['count'] == 2)
+        self.assertTrue(data['posts'][0]['url'].endswith(url_for('api.get_post', id=self.posts[3])))
+        self.assertTrue(data['posts'][0]['comment_count'] == 6)
@@ -2,23 +2,12 @@ __author__ = 'Stuart'
 import unittest
 import time
 from datetime import datetime
-from app import create_app, db
-from app.models import User, AnonymousUser, Role, Permission, Follow
+from app import db
+from app.models import User, AnonymousUser, Permission, Follow
+from fixtures import FlaskyTestCase
 
 
-class UserModelTestCase(unittest.TestCase):
-    def setUp(self):
-        self.app = create_app('testing')
-        self.app_context = self.app.app_context()
-        self.app_context.push()
-        db.create_all()
-        Role.insert_roles()
-
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-        self.app_context.pop()
-
+class UserModelTestCase(FlaskyTestCase):
     def test_password_setter(self):
         u = User(password='cat')
         self.assertTrue(u.password_hash is not None)
@@ -0,0 +1,79 @@
+__author__ = 'Stuart'
+import unittest
+from sqlalchemy import event
+from app import db, usercache
+from app.models import User
+from fixtures import FlaskyTestCase
+
+
+class UserCacheTestCase(FlaskyTestCase):
+    def setUp(self):
+        super(UserCacheTestCase, self).setUp()
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count)
+        super(UserCacheTestCase, self).tearDown()
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def add_user(self, username):
+        u = User(email=username + '@example.com', username=username, password='cat')
+        db.session.add(u)
+        db.session.commit()
+        return u
+
+    def test_hits_need_no_queries(self):
+        user_id = self.add_user('john').id
+        db.session.remove()
+        with self.app.test_request_context():
+            self.assertTrue(usercache.lookup('john').id == user_id)
+            db.session.remove()
+            del self.statements[:]
+            user = usercache.lookup('john')
+            self.assertTrue(user.username == 'john' and user.email == 'john@example.com')
+            self.assertTrue(self.statements == [])
+            self.assertTrue(user.role.name == 'User')  # relationships still load
+            self.assertTrue(user.last_seen is not None)  # and so do the columns we don't cache
+
+    def test_negative_caching(self):
+        with self.app.test_request_context():
+            self.assertTrue(usercache.lookup('nobody') is None)
+            del self.statements[:]
+            self.assertTrue(usercache.lookup('nobody') is None)
+            self.assertTrue(self.statements == [])
+            # validators check the db for names the cache thinks are free
+            self.assertTrue(usercache.lookup('nobody', trust_negative=False) is None)
+            self.assertTrue(len(self.statements) == 1)
+
+    def test_invalidated_on_insert_and_change(self):
+        with self.app.test_request_context():
+            self.assertTrue(usercache.lookup('susan') is None)
+            u = self.add_user('susan')
+            self.assertTrue(usercache.lookup('susan').id == u.id)
+
+            u.username = 'susan2'
+            db.session.add(u)
+            db.session.commit()
+            self.assertTrue(usercache.lookup('susan') is None)
+            self.assertTrue(usercache.lookup('susan2').id == u.id)
+
+    def test_last_seen_does_not_invalidate(self):
+        u = self.add_user('david')
+        with self.app.test_request_context():
+            usercache.lookup('david')
+            u.ping()
+            del self.statements[:]
+            usercache.lookup('david')
+            self.assertFalse(any('WHERE users.username' in s for s in self.statements))
+
+    def test_profile_page_and_register_form(self):
+        self.add_user('john')
+        client = self.app.test_client()
+        self.assertTrue(client.get('/user/john').status_code == 200)
+        self.assertTrue(client.get('/user/nobody').status_code == 404)
+        response = client.post('/auth/register', data={
+            'email': 'other@example.com', 'username': 'john', 'password': 'cat', 'password2': 'cat'})
+        self.assertTrue(b'Username already in use' in response.data)